@@ -1,10 +1,26 @@
-from flask import Flask, request, render_template, redirect, url_for, flash, session, jsonify
+from flask import Flask, Response, request, render_template, redirect, url_for, flash, session, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
 import os
+import heapq
+import itertools
 import logging
 import json
 from datetime import datetime, timedelta, timezone
+from timeutils import now_ms, to_epoch_ms, current_elapsed_ms, remaining_ms, format_ms, format_ms_column, local_periods
+import database
+import migrations
+import preferences_cache
+import repositories
+import rate_limiter
+import retention
+import timer_cache
+import timer_events
+import timer_expiry
+import timezones
+import write_queue
+from repositories import StorageError, CHECKIN_TIMER_ACTIONS
+from timer_state import IllegalTransition, VersionConflict, IdempotencyKeyReused
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -13,125 +29,86 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__, template_folder="templates")  # Explicitly set the templates folder
 app.secret_key = os.environ.get('SECRET_KEY', 'default_secret_key')
 
-# Ensure DB_PATH points to Deepflow.db
-DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Deepflow.db')
+# Ensure DB_PATH points to Deepflow.db (can be overridden for tests and deployments)
+DB_PATH = os.environ.get('DEEPFLOW_DB_PATH',
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Deepflow.db'))
 
-def convert_to_user_timezone(timestamp_str, timezone_offset_hours):
-    """
-    Convert a timestamp string to the user's timezone.
-    
-    Args:
-        timestamp_str: The timestamp string in format 'YYYY-MM-DD HH:MM:SS'
-        timezone_offset_hours: The timezone offset in hours (e.g., 10 for AEST, -5 for EST)
-    
-    Returns:
-        A datetime object adjusted to the user's timezone
-    """
-    try:
-        # Parse the timestamp as UTC (SQLite stores in server local time, treat as UTC for conversion)
-        dt = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-        
-        # Create timezone offset
-        offset = timezone(timedelta(hours=timezone_offset_hours))
-        
-        # Apply the timezone
-        dt_with_tz = dt.replace(tzinfo=timezone.utc).astimezone(offset)
-        
-        return dt_with_tz
-    except (ValueError, TypeError) as e:
-        logger.error("Error converting timestamp %s with offset %s: %s", 
-                    timestamp_str, timezone_offset_hours, str(e))
-        # Return original datetime if conversion fails
-        return datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
 
-def get_user_timezone_offset(user_id):
-    """Get the user's timezone offset from their country and state preferences."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT country, state_province FROM users WHERE id = ?", (user_id,))
-        result = cursor.fetchone()
-        country = result[0] if result else 'AU'
-        state_province = result[1] if result and result[1] else ''
-        conn.close()
-        
-        # Use the same timezone mapping logic from get_user_preferences
-        timezone_mappings = {
-            'US': {
-                'default': 10,  # Default to AEST for Australia (changed from -5)
-                'states': {
-                    'CA': -8,   # Pacific
-                    'NY': -5,   # Eastern
-                    'TX': -6,   # Central
-                    'FL': -5,   # Eastern
-                    'IL': -6,   # Central
-                    'WA': -8,   # Pacific
-                    'CO': -7,   # Mountain
-                    'AZ': -7,   # Mountain (no DST)
-                    'HI': -10,  # Hawaii
-                    'AK': -9,   # Alaska
-                }
-            },
-            'AU': {
-                'default': 10,
-                'states': {
-                    'NSW': 10,    # AEST
-                    'VIC': 10,    # AEST
-                    'QLD': 10,    # AEST (no DST)
-                    'WA': 8,      # AWST
-                    'SA': 9.5,    # ACST
-                    'TAS': 10,    # AEST
-                    'NT': 9.5,    # ACST (no DST)
-                    'ACT': 10,    # AEST
-                }
-            },
-            'CA': {
-                'default': -5,
-                'provinces': {
-                    'ON': -5,     # Eastern
-                    'QC': -5,     # Eastern
-                    'BC': -8,     # Pacific
-                    'AB': -7,     # Mountain
-                    'SK': -6,     # Central
-                    'MB': -6,     # Central
-                    'NB': -4,     # Atlantic
-                    'NS': -4,     # Atlantic
-                    'PE': -4,     # Atlantic
-                    'NL': -3.5,   # Newfoundland
-                }
-            },
-            'UK': {'default': 0},
-            'DE': {'default': 1},
-            'FR': {'default': 1},
-            'ES': {'default': 1},
-            'IT': {'default': 1},
-            'JP': {'default': 9},
-            'CN': {'default': 8},
-            'IN': {'default': 5.5},
-            'BR': {
-                'default': -3,
-                'states': {
-                    'SP': -3,     # BRT
-                    'RJ': -3,     # BRT
-                    'AC': -5,     # ACT
-                    'AM': -4,     # AMT
-                }
-            }
-        }
-        
-        country_data = timezone_mappings.get(country, timezone_mappings['AU'])  # Default to AU
-        
-        # Check for state/province specific timezone
-        if state_province and isinstance(country_data, dict):
-            for region_key in ['states', 'provinces']:
-                if region_key in country_data and state_province in country_data[region_key]:
-                    return country_data[region_key][state_province]
-        
-        return country_data.get('default', 10)  # Default to AEST (Australia) if not found
-        
-    except (sqlite3.Error, ValueError, TypeError) as e:
-        logger.error("Error getting user timezone offset: %s", str(e))
-        return 10  # Default to AEST (Australia) on error
+def init_db():
+    """Bring the database schema up to date by applying any pending migrations"""
+    # Runs at import time, outside any request, so borrow connections from the pools.
+    # Every shard gets the full schema so all files stay on the same version.
+    for pool in database.get_pools():
+        conn = pool.acquire()
+        try:
+            version = migrations.migrate(conn)
+            logger.info("Database %s initialised successfully (schema version %d)", pool.db_path, version)
+        except sqlite3.Error as e:
+            logger.error("Database initialization error: %s", str(e))
+            return False
+        finally:
+            pool.release(conn)
+    return True
+
+
+def timer_payload(timer, now=None):
+    """A timer's live state as /get_timer_state and /timers/stream send it"""
+    current_elapsed = current_elapsed_ms(timer.elapsed_time, timer.start_time, timer.is_running, now)
+    return {
+        "id": timer.id,
+        "name": timer.name,
+        "duration": timer.duration,  # Duration in seconds
+        "elapsed_time": current_elapsed,  # Elapsed time in milliseconds
+        "is_running": timer.is_running,
+        "remaining_time": remaining_ms(timer.duration, current_elapsed),  # Remaining time in milliseconds
+        "version": timer.version  # Send back as expected_version to act only on this state
+    }
+
+
+def timer_expired(timer):
+    """Tell the user's open dashboards that a timer ran out and was stopped"""
+    timer_events.get_broker().publish(timer.user_id, "expired", timer_payload(timer))
+
+
+# Pooled, request-scoped connections (see database.py). DEEPFLOW_SHARDS=N spreads
+# per-user tables over N database files next to DB_PATH, which then only holds users.
+database.init_app(app, DB_PATH, shards=int(os.environ.get('DEEPFLOW_SHARDS', '1')))
+
+# Optional single-writer commit queue, enabled with DEEPFLOW_WRITE_QUEUE=1 (see write_queue.py)
+write_queue.init_app(app, database.get_pools())
+
+# Bring the schema up to date before anything below loads from the database
+init_db()
+
+# Optionally serve analytics reads from a periodically refreshed copy of the database
+_snapshot_interval = int(os.environ.get('DEEPFLOW_ANALYTICS_SNAPSHOT_SECONDS', '0'))
+if _snapshot_interval > 0:
+    database.enable_snapshot(interval=_snapshot_interval)
+
+# Storage the routes go through: DEEPFLOW_STORAGE=sqlite (default) or memory (see repositories.py)
+repos = repositories.init_app(app)
+
+# Write-through timer state cache serving /get_timer_state; DEEPFLOW_TIMER_CACHE=0 turns it off (see timer_cache.py)
+timer_cache.init_app(app, repos)
+
+# LRU cache of user preferences; DEEPFLOW_PREFERENCES_CACHE=0 turns it off (see preferences_cache.py)
+preferences_cache.init_app(app, repos)
+
+# Users' timezones from their country and state, with DST, remembered per user (see timezones.py)
+timezones.init_app(app, repos)
+
+# Live timer events for dashboards (see timer_events.py)
+timer_events.init_app(app)
+
+# Stop running timers when they reach their duration, even with no dashboard open (see timer_expiry.py).
+# Timers that ran out while the app was down are announced straight away, so this comes after the events.
+timer_expiry.init_app(app, repos, on_expired=timer_expired)
+
+# End check-ins per period, counted in memory and loaded from the database here (see rate_limiter.py)
+rate_limiter.init_app(app, repos, timezones.get_service().zone)
+
+# Optional background roll-up of old check-ins, enabled with DEEPFLOW_RETENTION_DAYS (see retention.py)
+retention.init_app(app, database.get_user_pools(), timezones.get_service().zone)
 
 def validate_password(password):
     """
@@ -179,7 +156,6 @@ def add_user_to_db(username, password):
     status_code: 'success', 'exists', 'db_error', 'file_error', 'unexpected_error'
     message: descriptive message for logging/flashing
     """
-    conn = None
     try:
         logger.debug("Attempting to add user '%s' to database at %s", username, DB_PATH)
 
@@ -188,12 +164,8 @@ def add_user_to_db(username, password):
             logger.error("Database file does not exist at %s", DB_PATH)
             return "file_error", "Database file not found."
 
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
         # Check if username exists
-        cursor.execute("SELECT username FROM users WHERE username = ?", (username,))
-        if cursor.fetchone():
+        if repos.users.username_taken(username):
             logger.warning("Username '%s' already exists in database", username)
             return "exists", f"Username '{username}' already exists."
 
@@ -201,156 +173,29 @@ def add_user_to_db(username, password):
         hashed_password = generate_password_hash(password)
         logger.debug("Password hashed successfully")
 
-        cursor.execute(
-            "INSERT INTO users (username, password) VALUES (?, ?)",
-            (username, hashed_password)
-        )
-        conn.commit()
+        repos.users.create(username, hashed_password)
         logger.info("User '%s' added to database successfully", username)
         return "success", f"User '{username}' added successfully."
-    except sqlite3.Error as e:
+    except StorageError as e:
         logger.error("SQLite error: %s when adding user '%s'", str(e), username)
-        if conn:
-            conn.rollback()
         return "db_error", f"Database error: {str(e)}"
     except (ValueError, TypeError) as e:  # Catch specific exceptions instead of generic Exception
         logger.error("Input error: %s when adding user '%s'", str(e), username)
-        if conn:
-            conn.rollback()
         return "input_error", f"Input validation error: {str(e)}"
-    finally:
-        if conn:
-            conn.close()
 
 def validate_user(username, password):
     """Validates a user's credentials"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-        user = cursor.fetchone()
-        conn.close()
+        user = repos.users.get_by_username(username)
         
-        if user and check_password_hash(user[2], password):
+        if user and check_password_hash(user.password, password):
             return user
         return None
-    except sqlite3.Error as e:
+    except StorageError as e:
         logger.error("Database error: %s", str(e))
         return None
 
 # Update the database schema
-def init_db():
-    """Initialise the database with proper schema"""
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Create the users table in Deepflow.db
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                country TEXT DEFAULT 'AU',
-                state_province TEXT DEFAULT NULL
-            )
-        """)
-        
-        # Add country column if it doesn't exist (for existing databases)
-        try:
-            cursor.execute("ALTER TABLE users ADD COLUMN country TEXT DEFAULT 'AU'")
-        except sqlite3.OperationalError:
-            # Column already exists
-            pass
-            
-        # Add state_province column if it doesn't exist (for existing databases)
-        try:
-            cursor.execute("ALTER TABLE users ADD COLUMN state_province TEXT DEFAULT NULL")
-        except sqlite3.OperationalError:
-            # Column already exists
-            pass
-        
-        # Add elapsed_time column if it doesn't exist (for existing databases)
-        try:
-            cursor.execute("ALTER TABLE timers ADD COLUMN elapsed_time INTEGER DEFAULT 0")
-        except sqlite3.OperationalError:
-            # Column already exists
-            pass
-        
-        # Create the timers table in Deepflow.db
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS timers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                name TEXT NOT NULL,
-                duration INTEGER NOT NULL, -- Duration in seconds
-                start_time TEXT DEFAULT NULL,
-                end_time TEXT DEFAULT NULL,
-                paused_at TEXT DEFAULT NULL,
-                elapsed_time INTEGER DEFAULT 0, -- Time elapsed before pause (in milliseconds)
-                is_running INTEGER NOT NULL DEFAULT 0, -- 0: stopped, 1: running, 2: paused
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        """)
-        
-        # Create flow_shelf table for task queue
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS flow_shelf (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                task_text TEXT NOT NULL,
-                created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                completed BOOLEAN NOT NULL DEFAULT 0,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        """)
-        
-        # Create energy_logs table for energy tracking
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS energy_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                timer_id INTEGER NOT NULL,
-                stage TEXT NOT NULL,  -- 'start' or 'end'
-                energy_level INTEGER NOT NULL,  -- 1-10
-                timestamp TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (timer_id) REFERENCES timers (id)
-            )
-        """)
-        
-        # Create energy_insights table for detailed energy insights
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS energy_insights (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                overall_energy INTEGER NOT NULL,  -- 1-10
-                motivation_level INTEGER NOT NULL,  -- 1-10
-                focus_clarity INTEGER NOT NULL,  -- 1-10
-                physical_energy INTEGER NOT NULL,  -- 1-10
-                mood_state TEXT NOT NULL,  -- happy, calm, stressed, anxious, excited, etc.
-                energy_source TEXT,  -- what's contributing to current energy
-                energy_drains TEXT,  -- what's draining energy
-                notes TEXT,  -- additional user notes
-                timestamp TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        """)
-        
-        conn.commit()
-        logger.info("Database initialised successfully")
-        return True
-    except sqlite3.Error as e:
-        logger.error("Database initialization error: %s", str(e))
-        return False
-    finally:
-        if conn:
-            conn.close()
-
-# Initialise the database
-init_db()
-
 @app.route("/")
 def home():
     """Home page with statistics"""
@@ -360,16 +205,10 @@ def home():
         'total_tasks': 0
     }
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM users")
-        stats['total_users'] = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM timers")
-        stats['total_timers'] = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM flow_shelf")
-        stats['total_tasks'] = cursor.fetchone()[0]
-        conn.close()
-    except sqlite3.Error as e:
+        stats['total_users'] = repos.users.count()
+        stats['total_timers'] = repos.timers.count_all()
+        stats['total_tasks'] = repos.shelf.count_all()
+    except StorageError as e:
         logger.error("Error fetching stats: %s", str(e))
     
     return render_template("index.html", stats=stats)
@@ -387,9 +226,14 @@ def login():
 
         user = validate_user(username, password)
         if user:
-            session['user_id'] = user[0]  # Set user ID in session
-            session['username'] = user[1]  # Set username in session
-            session['just_logged_in'] = True  # Flag for first dashboard visit
+            session['user_id'] = user.id  # Set user ID in session
+            session['username'] = user.username  # Set username in session
+            try:
+                # A new session epoch: timers left running or paused now count as stopped (see timer_state.py)
+                repos.users.start_session(user.id)
+            except StorageError as e:
+                logger.error("Error starting session for user %d: %s", user.id, str(e))
+                flash("There was an issue resetting your timer states.", "error")
             flash("Login successful!", "success")
             return redirect(url_for("dashboard"))  # Redirect to dashboard
         else:
@@ -434,17 +278,12 @@ def signup():
 
         # Debug - check database state
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM users")
-            user_count = cursor.fetchone()[0]
+            user_count = repos.users.count()
             logger.debug("Current user count in database: %d", user_count)
             
-            cursor.execute("SELECT username FROM users")
-            usernames = [row[0] for row in cursor.fetchall()]
+            usernames = repos.users.list_usernames()
             logger.debug("Current usernames in database: %s", usernames)
-            conn.close()
-        except sqlite3.Error as e:
+        except StorageError as e:
             logger.error("Debug query error: %s", str(e))
         
         if status == "success":
@@ -477,44 +316,22 @@ def dashboard():
     
     user_id = session['user_id']
 
-    # If the user just logged in, reset any running or paused timers
-    if session.pop('just_logged_in', False):
-        try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            # Reset any timers that were running or paused
-            cursor.execute("""
-                UPDATE timers 
-                SET is_running = 0, start_time = NULL, end_time = NULL, paused_at = NULL
-                WHERE user_id = ? AND is_running IN (1, 2)
-            """, (user_id,))
-            conn.commit()
-            conn.close()
-            logger.info("Reset all active timers for user %d on new login.", user_id)
-        except sqlite3.Error as e:
-            logger.error("Error resetting timers for user %d on login: %s", user_id, str(e))
-            flash("There was an issue resetting your timer states.", "error")
-
     timers = []
+    timer_states = []
     energy_checkin_status = None
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        # Fetch timers without resetting paused ones
-        cursor.execute("SELECT * FROM timers WHERE user_id = ?", (user_id,))
-        timers = cursor.fetchall()
-        conn.close()
+        # Running timers that reached their duration have already been stopped by timer_expiry,
+        # and ones left over from before this login come back stopped
+        timers = repos.timers.list_for_user(user_id, repos.users.session_epoch(user_id))
+        
+        # Their live state, embedded so the countdowns start without a request per timer
+        timer_states = [timer_payload(timer) for timer in timers]
         
         # Get energy check-in rate limit status
         is_allowed, remaining, message = check_energy_checkin_rate_limit(user_id)
         
-        # Calculate next reset time (6:00 AM)
-        now = datetime.now()
-        if now.hour < 6:
-            next_reset = now.replace(hour=6, minute=0, second=0, microsecond=0)
-        else:
-            next_reset = now.replace(hour=6, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        # Next reset (6:00 AM), in the user's own timezone like the limiter's periods
+        _, next_reset = rate_limiter.period_bounds(now_ms(), timezones.get_service().zone(user_id))
         
         energy_checkin_status = {
             'is_allowed': is_allowed,
@@ -524,11 +341,12 @@ def dashboard():
             'reset_time': next_reset.strftime('%I:%M %p')
         }
         
-    except sqlite3.Error as e:
+    except StorageError as e:
         logger.error("Error fetching timers: %s", str(e))
         flash("Failed to load timers.", "error")
     
-    return render_template("dashboard.html", timers=timers, energy_checkin_status=energy_checkin_status)  # Render dashboard.html
+    return render_template("dashboard.html", timers=timers, timer_states=timer_states,
+                           energy_checkin_status=energy_checkin_status)  # Render dashboard.html
 
 
 @app.route("/add_timer", methods=["POST"])
@@ -553,28 +371,101 @@ def add_timer():
             logger.warning("Invalid duration value: %d. Setting to default (90 minutes).", duration_int)
             duration_int = 90  # Set to default 90 minutes if invalid
         
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
         # Convert minutes to seconds for storage
         duration_seconds = duration_int * 60
-        cursor.execute("""
-            INSERT INTO timers (user_id, name, duration)
-            VALUES (?, ?, ?)
-        """, (user_id, name, duration_seconds))
-        conn.commit()
-        conn.close()
+        repos.timers.create(user_id, name, duration_seconds)
         flash("Timer added successfully!", "success")
     except (ValueError, TypeError) as e:
         logger.error("Error with duration value: %s", str(e))
         flash("Invalid duration format. Please try again.", "error")
         return redirect(url_for("dashboard"))
-    except sqlite3.Error as e:
+    except StorageError as e:
         logger.error("Error adding timer: %s", str(e))
         flash("Failed to add timer.", "error")
     
     return redirect(url_for("dashboard"))
 
 
+TIMER_ACTION_PAST = {"start": "started", "pause": "paused", "resume": "resumed", "stop": "stopped"}
+
+
+MAX_IDEMPOTENCY_KEY_LENGTH = 128
+
+
+def timer_command_options():
+    """
+    The idempotency key (Idempotency-Key header or "idempotency_key") and
+    "expected_version" of a JSON timer command, as (key, expected_version, error)
+    """
+    data = request.get_json(silent=True) if request.is_json else None
+    data = data if isinstance(data, dict) else {}
+    
+    key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    if key is not None and (not isinstance(key, str) or not 0 < len(key) <= MAX_IDEMPOTENCY_KEY_LENGTH):
+        return None, None, f"idempotency_key must be a string of up to {MAX_IDEMPOTENCY_KEY_LENGTH} characters"
+    
+    expected_version = data.get('expected_version')
+    if expected_version is not None and (isinstance(expected_version, bool) or not isinstance(expected_version, int)):
+        return None, None, "expected_version must be an integer"
+    return key, expected_version, None
+
+
+def apply_timer_action(timer_id, action):
+    """
+    Apply a timer action for the logged-in user through the timer state machine.
+    
+    JSON requests may carry an idempotency key and an expected version (see
+    timer_command_options()). Returns (CommandResult, None, None), or
+    (None, error, status) when the request is invalid, the timer is missing,
+    the move is illegal or stale, or storage fails.
+    """
+    user_id = session['user_id']
+    key, expected_version, error = timer_command_options()
+    if error:
+        return None, error, 400
+    
+    try:
+        result = repos.timers.command(user_id, timer_id, action, repos.users.session_epoch(user_id),
+                                      expected_version, key)
+    except (IllegalTransition, VersionConflict) as e:
+        logger.info("Rejected timer action: %s", str(e))
+        return None, str(e), 409
+    except IdempotencyKeyReused as e:
+        logger.warning("Rejected timer action: %s", str(e))
+        return None, str(e), 422
+    except StorageError as e:
+        logger.error("Database error updating timer: %s", str(e))
+        return None, "Database error", 500
+    
+    if result is None:
+        logger.warning("Timer %d not found or doesn't belong to user %d", timer_id, user_id)
+        return None, "Timer not found", 404
+    
+    # A replayed retry changed nothing, so there is nothing new to announce
+    if not result.replayed:
+        timer_changed(result.timer, TIMER_ACTION_PAST[action])
+    return result, None, None
+
+
+def timer_action_response(timer_id, action):
+    """JSON response of the /start_timer, /pause_timer, /resume_timer and /stop_timer routes"""
+    result, error, status = apply_timer_action(timer_id, action)
+    if error:
+        return {"success": False, "error": error}, status
+    return {
+        "success": True,
+        "message": f"Timer {TIMER_ACTION_PAST[action]} successfully",
+        "version": result.timer.version,
+        "replayed": result.replayed
+    }
+
+
+def timer_changed(timer, event):
+    """(Re)schedule a changed timer's expiry and tell the user's open dashboards ('started', 'paused', ...)"""
+    timer_expiry.get_scheduler().track(timer)
+    timer_events.get_broker().publish(timer.user_id, event, timer_payload(timer))
+
+
 @app.route("/update_timer/<int:timer_id>", methods=["POST"])
 def update_timer(timer_id):
     """Start or stop a timer - supports both form submission and JSON API"""
@@ -595,7 +486,7 @@ def update_timer(timer_id):
     logger.debug("Received timer update request: timer_id=%d, action=%s, request_type=%s", timer_id, action, 'JSON' if request.is_json else 'form')
     
     # Validate action
-    if action not in ["start", "pause", "resume", "stop"]:
+    if action not in TIMER_ACTION_PAST:
         logger.warning("Invalid timer action requested: %s", action)
         if request.is_json:
             return {"error": "Invalid action", "success": False}, 400
@@ -604,140 +495,20 @@ def update_timer(timer_id):
     
     logger.info("Updating timer %d with action: %s for user %d", timer_id, action, session['user_id'])
     
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # First check if the timer exists and belongs to the user
-        cursor.execute("""
-            SELECT id FROM timers 
-            WHERE id = ? AND user_id = ?
-        """, (timer_id, session['user_id']))
-        
-        if not cursor.fetchone():
-            logger.warning("Timer %d not found or doesn't belong to user %d", timer_id, session['user_id'])
-            if request.is_json:
-                return {"error": "Timer not found", "success": False}, 404
-            flash("Timer not found.", "error")
-            return redirect(url_for("dashboard"))
-        
-        if action == "start":
-            cursor.execute("""
-                UPDATE timers
-                SET is_running = 1, start_time = datetime('now', 'localtime'), 
-                    end_time = NULL, paused_at = NULL, elapsed_time = 0
-                WHERE id = ? AND user_id = ?
-            """, (timer_id, session['user_id']))
-            logger.debug("Started timer %d", timer_id)
-        elif action == "pause":
-            # Calculate elapsed time since start and store it in milliseconds
-            cursor.execute("""
-                SELECT start_time, elapsed_time FROM timers
-                WHERE id = ? AND user_id = ?
-            """, (timer_id, session['user_id']))
-            timer_data = cursor.fetchone()
-            
-            if timer_data and timer_data[0]:  # start_time exists
-                start_time_str = timer_data[0]
-                current_elapsed = timer_data[1] or 0
-                
-                # Parse the start time and calculate elapsed milliseconds
-                start_time = datetime.strptime(start_time_str, '%Y-%m-%d %H:%M:%S')
-                current_time = datetime.now()
-                session_elapsed = int((current_time - start_time).total_seconds() * 1000)  # Convert to milliseconds
-                total_elapsed = current_elapsed + session_elapsed
-                
-                cursor.execute("""
-                    UPDATE timers
-                    SET is_running = 2, paused_at = datetime('now', 'localtime'),
-                        elapsed_time = ?
-                    WHERE id = ? AND user_id = ?
-                """, (total_elapsed, timer_id, session['user_id']))
-                logger.debug("Paused timer %d with total elapsed time: %d milliseconds", timer_id, total_elapsed)
-            else:
-                # If no start_time, just set to paused
-                cursor.execute("""
-                    UPDATE timers
-                    SET is_running = 2, paused_at = datetime('now', 'localtime')
-                    WHERE id = ? AND user_id = ?
-                """, (timer_id, session['user_id']))
-                logger.debug("Paused timer %d (no start time)", timer_id)
-        elif action == "resume":
-            # When resuming, set new start_time and keep elapsed_time
-            cursor.execute("""
-                UPDATE timers
-                SET is_running = 1, start_time = datetime('now', 'localtime'), paused_at = NULL
-                WHERE id = ? AND user_id = ?
-            """, (timer_id, session['user_id']))
-            logger.debug("Resumed timer %d", timer_id)
-        elif action == "stop":
-            # Calculate final elapsed time when stopping in milliseconds
-            cursor.execute("""
-                SELECT start_time, elapsed_time, is_running FROM timers
-                WHERE id = ? AND user_id = ?
-            """, (timer_id, session['user_id']))
-            timer_data = cursor.fetchone()
-            
-            total_elapsed = 0
-            if timer_data:
-                current_elapsed = timer_data[1] or 0
-                is_currently_running = timer_data[2]
-                
-                # If timer is currently running (not paused), add current session time
-                if is_currently_running == 1 and timer_data[0]:  # Running and has start_time
-                    start_time_str = timer_data[0]
-                    start_time = datetime.strptime(start_time_str, '%Y-%m-%d %H:%M:%S')
-                    current_time = datetime.now()
-                    session_elapsed = int((current_time - start_time).total_seconds() * 1000)  # Convert to milliseconds
-                    total_elapsed = current_elapsed + session_elapsed
-                else:
-                    # Timer was paused, use stored elapsed time (already in milliseconds)
-                    total_elapsed = current_elapsed
-            
-            cursor.execute("""
-                UPDATE timers
-                SET is_running = 0, end_time = datetime('now', 'localtime'),
-                    elapsed_time = ?, start_time = NULL, paused_at = NULL
-                WHERE id = ? AND user_id = ?
-            """, (total_elapsed, timer_id, session['user_id']))
-            logger.debug("Stopped timer %d with final elapsed time: %d milliseconds", timer_id, total_elapsed)
-        
-        conn.commit()
-        
-        # Check if the update was successful
-        cursor.execute("""
-            SELECT is_running FROM timers
-            WHERE id = ? AND user_id = ?
-        """, (timer_id, session['user_id']))
-        
-        row = cursor.fetchone()
-        is_running = row[0] if row else None
-        
-        # Make sure the database update worked as expected
-        expected_running = 1 if action in ["start", "resume"] else 2 if action == "pause" else 0 if action == "stop" else None
-        if expected_running is not None and is_running != expected_running:
-            logger.error("Timer update failed: expected is_running=%d, got %d", expected_running, is_running)
-            conn.close()
-            if request.is_json:
-                return {"error": "Timer update failed", "success": False}, 500
-            flash("Failed to update timer status.", "error")
-            return redirect(url_for("dashboard"))
-        
-        conn.close()
-        
+    result, error, status = apply_timer_action(timer_id, action)
+    if error:
         if request.is_json:
-            return {"success": True, "message": f"Timer {action}ed successfully", "status": action, "timer_id": timer_id}, 200
-        
-        flash(f"Timer {action}ed successfully!", "success")
-        return redirect(url_for("dashboard"))
-    except sqlite3.Error as e:
-        logger.error("Database error updating timer: %s", str(e))
-        
-        if request.is_json:
-            return {"error": f"Database error: {str(e)}", "success": False}, 500
-        
-        flash(f"Failed to update timer: {str(e)}", "error")
+            return {"error": error, "success": False}, status
+        flash(f"Failed to update timer: {error}", "error")
         return redirect(url_for("dashboard"))
+    
+    message = f"Timer {TIMER_ACTION_PAST[action]} successfully"
+    if request.is_json:
+        return {"success": True, "message": message, "status": action, "timer_id": timer_id,
+                "version": result.timer.version, "replayed": result.replayed}, 200
+    
+    flash(message + "!", "success")
+    return redirect(url_for("dashboard"))
 
 
 @app.route("/delete_timer/<int:timer_id>", methods=["POST"])
@@ -748,13 +519,9 @@ def delete_timer(timer_id):
         return redirect(url_for("login"))
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM timers WHERE id = ? AND user_id = ?", (timer_id, session['user_id']))
-        conn.commit()
-        conn.close()
+        repos.timers.delete(session['user_id'], timer_id)
         flash("Timer deleted successfully!", "success")
-    except sqlite3.Error as e:
+    except StorageError as e:
         logger.error("Error deleting timer: %s", str(e))
         flash("Failed to delete timer.", "error")
     
@@ -774,7 +541,8 @@ def logout():
 def check_energy_checkin_rate_limit(user_id, timer_id=None):
     """
     Check if user has exceeded the energy check-in rate limit.
-    Rate limit: 5 end check-ins per day. When reached, all check-ins are blocked until 6:00 AM the next day.
+    Rate limit: 5 end check-ins per day. When reached, all check-ins are blocked until 6:00 AM the next day,
+    in the user's own timezone.
     
     Args:
         user_id: The user's ID
@@ -783,122 +551,24 @@ def check_energy_checkin_rate_limit(user_id, timer_id=None):
     Returns:
         tuple: (is_allowed, remaining_count, message)
     """
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Get current time and calculate rate limit period (6:00 AM to 6:00 AM next day)
-        now = datetime.now()
-        
-        # If it's before 6:00 AM today, the period started at 6:00 AM yesterday
-        if now.hour < 6:
-            period_start = now.replace(hour=6, minute=0, second=0, microsecond=0) - timedelta(days=1)
-        else:
-            # If it's 6:00 AM or later, the period started at 6:00 AM today
-            period_start = now.replace(hour=6, minute=0, second=0, microsecond=0)
-        
-        period_end = period_start + timedelta(days=1)
-        
-        # Count end check-ins for this period
-        query = """
-            SELECT COUNT(*) 
-            FROM energy_logs 
-            WHERE user_id = ? 
-            AND stage = 'end' 
-            AND timestamp BETWEEN ? AND ?
-        """
-        
-        params = [user_id, period_start.strftime('%Y-%m-%d %H:%M:%S'), period_end.strftime('%Y-%m-%d %H:%M:%S')]
-        
-        # Exclude current timer if provided
-        if timer_id:
-            query += " AND timer_id != ?"
-            params.append(timer_id)
-            
-        cursor.execute(query, params)
-        end_checkins_today = cursor.fetchone()[0]
-        conn.close()
-        
-        DAILY_LIMIT = 5
-        remaining = max(0, DAILY_LIMIT - end_checkins_today)
-        
-        if end_checkins_today >= DAILY_LIMIT:
-            next_reset = period_end.strftime('%I:%M %p')
-            next_reset_date = period_end.strftime('%B %d')
-            return False, 0, f"Daily limit reached. You've completed {DAILY_LIMIT} end check-ins today. All energy check-ins are blocked until 6:00 AM tomorrow ({next_reset_date})."
-        
-        return True, remaining, f"End check-ins available: {remaining} out of {DAILY_LIMIT} daily end check-ins (resets at 6:00 AM)."
-        
-    except sqlite3.Error as e:
-        logger.error("Error checking energy check-in rate limit: %s", str(e))
-        # Allow check-in if we can't determine the limit (fail open)
-        return True, 5, "Rate limit check failed, allowing check-in."
+    # Count end check-ins for the current period, excluding the current timer if provided
+    end_checkins_today, period_end = rate_limiter.get_limiter().status(user_id, timer_id)
+    
+    DAILY_LIMIT = rate_limiter.DAILY_LIMIT
+    remaining = max(0, DAILY_LIMIT - end_checkins_today)
+    
+    if end_checkins_today >= DAILY_LIMIT:
+        next_reset_date = period_end.strftime('%B %d')
+        return False, 0, f"Daily limit reached. You've completed {DAILY_LIMIT} end check-ins today. All energy check-ins are blocked until 6:00 AM tomorrow ({next_reset_date})."
+    
+    return True, remaining, f"End check-ins available: {remaining} out of {DAILY_LIMIT} daily end check-ins (resets at 6:00 AM)."
 
 def get_user_feature_preferences(user_id):
     """Get user's feature preferences as a dictionary"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Ensure user_preferences table exists
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_preferences (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER UNIQUE NOT NULL,
-                enable_start_checkin BOOLEAN DEFAULT 1,
-                enable_mid_checkin BOOLEAN DEFAULT 1,
-                enable_end_checkin BOOLEAN DEFAULT 1,
-                enable_energy_log BOOLEAN DEFAULT 1,
-                enable_sound BOOLEAN DEFAULT 0,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        """)
-        
-        # Add new columns if they don't exist (for existing databases)
-        try:
-            cursor.execute("ALTER TABLE user_preferences ADD COLUMN enable_start_checkin BOOLEAN DEFAULT 1")
-        except sqlite3.OperationalError:
-            pass
-        try:
-            cursor.execute("ALTER TABLE user_preferences ADD COLUMN enable_mid_checkin BOOLEAN DEFAULT 1")
-        except sqlite3.OperationalError:
-            pass
-        try:
-            cursor.execute("ALTER TABLE user_preferences ADD COLUMN enable_end_checkin BOOLEAN DEFAULT 1")
-        except sqlite3.OperationalError:
-            pass
-        
-        # Get user preferences
-        cursor.execute("""
-            SELECT enable_start_checkin, enable_mid_checkin, enable_end_checkin, 
-                   enable_energy_log, enable_sound
-            FROM user_preferences
-            WHERE user_id = ?
-        """, (user_id,))
-        
-        prefs = cursor.fetchone()
-        
-        if not prefs:
-            # Create default preferences for new user
-            cursor.execute("""
-                INSERT INTO user_preferences (user_id, enable_start_checkin, enable_mid_checkin, 
-                                            enable_end_checkin, enable_energy_log, enable_sound)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (user_id, 1, 1, 1, 1, 0))
-            conn.commit()
-            prefs = (1, 1, 1, 1, 0)  # Default values
-        
-        conn.close()
-        
-        return {
-            "enable_start_checkin": bool(prefs[0]),
-            "enable_mid_checkin": bool(prefs[1]),
-            "enable_end_checkin": bool(prefs[2]),
-            "enable_energy_log": bool(prefs[3]),
-            "enable_sound": bool(prefs[4])
-        }
-        
-    except sqlite3.Error as e:
+        # Stores the defaults for a new user
+        return repos.preferences.get_or_create(user_id).preferences
+    except StorageError as e:
         logger.error("Error getting user preferences: %s", str(e))
         # Return defaults if there's an error
         return {
@@ -924,58 +594,25 @@ def get_user_preferences():
     if 'user_id' not in session:
         return {"error": "Not authenticated"}, 401
     
+    user_id = session['user_id']
+    
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Add user_preferences table if it doesn't exist
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_preferences (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER UNIQUE NOT NULL,
-                enable_start_checkin BOOLEAN DEFAULT 1,
-                enable_mid_checkin BOOLEAN DEFAULT 1,
-                enable_end_checkin BOOLEAN DEFAULT 1,
-                enable_energy_log BOOLEAN DEFAULT 1,
-                enable_sound BOOLEAN DEFAULT 0,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        """)
-        
-        # Get user preferences
-        cursor.execute("""
-            SELECT enable_start_checkin, enable_mid_checkin, enable_end_checkin,
-                   enable_energy_log, enable_sound
-            FROM user_preferences
-            WHERE user_id = ?
-        """, (session['user_id'],))
-        
-        prefs = cursor.fetchone()
-        
-        if not prefs:
-            # Create default preferences for new user
-            cursor.execute("""
-                INSERT INTO user_preferences (user_id, enable_start_checkin, enable_mid_checkin,
-                                            enable_end_checkin, enable_energy_log, enable_sound)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (session['user_id'], 1, 1, 1, 1, 0))
-            conn.commit()
-            prefs = (1, 1, 1, 1, 0)  # Default values
-        
-        conn.close()
+        # Get user preferences, creating the defaults for a new user
+        stored = repos.preferences.get_or_create(user_id)
+        
+        # Browsers revalidate on every fetch and get a 304 until the preferences are saved again.
+        # The user id is part of the tag so another account on the same browser never matches.
+        etag = f"{user_id}-{stored.version}"
+        headers = {"ETag": f'"{etag}"', "Cache-Control": "private, no-cache"}
+        if request.if_none_match.contains(etag):
+            return "", 304, headers
         
         return {
             "success": True,
-            "preferences": {
-                "enable_start_checkin": bool(prefs[0]),
-                "enable_mid_checkin": bool(prefs[1]),
-                "enable_end_checkin": bool(prefs[2]),
-                "enable_energy_log": bool(prefs[3]),
-                "enable_sound": bool(prefs[4])
-            }
-        }, 200
+            "preferences": stored.preferences
+        }, 200, headers
         
-    except sqlite3.Error as e:
+    except StorageError as e:
         logger.error("Error getting user preferences: %s", str(e))
         return {"error": "Database error"}, 500
 
@@ -1002,20 +639,14 @@ def update_user_preferences():
             enable_end_checkin = False
         
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            
             # Update or insert preferences
-            cursor.execute("""
-                INSERT OR REPLACE INTO user_preferences 
-                (user_id, enable_start_checkin, enable_mid_checkin, enable_end_checkin,
-                 enable_energy_log, enable_sound)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (session['user_id'], enable_start_checkin, enable_mid_checkin, enable_end_checkin,
-                  enable_energy_log, enable_sound))
-            
-            conn.commit()
-            conn.close()
+            repos.preferences.save(session['user_id'], {
+                "enable_start_checkin": enable_start_checkin,
+                "enable_mid_checkin": enable_mid_checkin,
+                "enable_end_checkin": enable_end_checkin,
+                "enable_energy_log": enable_energy_log,
+                "enable_sound": enable_sound
+            })
             
             return {
                 "success": True,
@@ -1029,7 +660,7 @@ def update_user_preferences():
                 }
             }, 200
             
-        except sqlite3.Error as e:
+        except StorageError as e:
             logger.error("Error updating user preferences: %s", str(e))
             return {"error": "Database error"}, 500
     
@@ -1051,18 +682,7 @@ def add_shelf_item():
             return {"error": "Text is required"}, 400
         
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO flow_shelf (user_id, task_text)
-                VALUES (?, ?)
-            """, (session['user_id'], text))
-            
-            # Get the ID of the newly inserted item
-            item_id = cursor.lastrowid
-            
-            conn.commit()
-            conn.close()
+            item_id = repos.shelf.add(session['user_id'], text)
             
             return {
                 "success": True,
@@ -1070,7 +690,7 @@ def add_shelf_item():
                 "text": text,
                 "message": "Item added to Flow Shelf"
             }, 200
-        except sqlite3.Error as e:
+        except StorageError as e:
             logger.error("Error adding shelf item: %s", str(e))
             return {"error": "Database error"}, 500
     
@@ -1088,32 +708,18 @@ def remove_shelf_item():
         item_id = data.get("id")
         text = data.get("text")
         
+        if not item_id and not text:
+            return {"error": "ID or text is required"}, 400
+        
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            
             # If we have the ID, use that; otherwise use the text
-            if item_id:
-                cursor.execute("""
-                    DELETE FROM flow_shelf
-                    WHERE id = ? AND user_id = ?
-                """, (item_id, session['user_id']))
-            elif text:
-                cursor.execute("""
-                    DELETE FROM flow_shelf
-                    WHERE task_text = ? AND user_id = ?
-                """, (text, session['user_id']))
-            else:
-                return {"error": "ID or text is required"}, 400
-            
-            conn.commit()
-            conn.close()
+            repos.shelf.remove(session['user_id'], item_id=item_id, text=text)
             
             return {
                 "success": True,
                 "message": "Item removed from Flow Shelf"
             }, 200
-        except sqlite3.Error as e:
+        except StorageError as e:
             logger.error("Error removing shelf item: %s", str(e))
             return {"error": "Database error"}, 500
     
@@ -1127,34 +733,80 @@ def get_shelf_items():
         return {"error": "Not authenticated"}, 401
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, task_text, created_at, completed
-            FROM flow_shelf
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-        """, (session['user_id'],))
-        
         items = []
-        for row in cursor.fetchall():
+        for item in repos.shelf.list_for_user(session['user_id']):
             items.append({
-                "id": row[0],
-                "text": row[1],
-                "created_at": row[2],
-                "completed": bool(row[3])
+                "id": item.id,
+                "text": item.task_text,
+                "created_at": item.created_at,
+                "completed": bool(item.completed)
             })
         
-        conn.close()
         
         return {"items": items}, 200
-    except sqlite3.Error as e:
+    except StorageError as e:
         logger.error("Error getting shelf items: %s", str(e))
         return {"error": "Database error"}, 500
 
 
 # Energy Log API Endpoints
 
+MAX_CHECKIN_BATCH = 100
+
+
+def validate_energy_checkin(data, prefs):
+    """
+    Validate one check-in payload against the user's feature preferences
+    (prefs=None leaves the enabled-stage check to repos.energy.record_checkin).
+    
+    Returns:
+        tuple: (checkin, None, None) with timer_id (an int), stage, energy_level and
+        focus_level parsed, or (None, error_message, status_code)
+    """
+    timer_id = data.get("timer_id")
+    stage = data.get("stage")  # 'start', 'mid', or 'end'
+    energy_level = data.get("energy_level")  # 1-10
+    focus_level = data.get("focus_level")  # 1-10 (optional)
+    
+    if not all([timer_id, stage, energy_level]):
+        return None, "Timer ID, stage, and energy level are required", 400
+    
+    # The dashboard sends the id as a string (from a data attribute); storage and caches key on ints
+    if isinstance(timer_id, bool) or not isinstance(timer_id, (int, str)):
+        return None, "Timer ID must be an integer", 400
+    try:
+        timer_id = int(timer_id)
+    except ValueError:
+        return None, "Timer ID must be an integer", 400
+    
+    if stage not in ['start', 'mid', 'end']:
+        return None, "Stage must be 'start', 'mid', or 'end'", 400
+    
+    # Check if the specific type of check-in is enabled for this user
+    if prefs is not None and not prefs.get(f'enable_{stage}_checkin', True):
+        return None, f"{stage.capitalize()} check-in is disabled for this user", 403
+    
+    try:
+        energy_level = int(energy_level)
+        if not (1 <= energy_level <= 10):
+            return None, "Energy level must be between 1 and 10", 400
+            
+        # Validate focus level if provided
+        if focus_level is not None:
+            focus_level = int(focus_level)
+            if not (1 <= focus_level <= 10):
+                return None, "Focus level must be between 1 and 10", 400
+    except (ValueError, TypeError):
+        return None, "Energy and focus levels must be numbers", 400
+    
+    return {
+        "timer_id": timer_id,
+        "stage": stage,
+        "energy_level": energy_level,
+        "focus_level": focus_level
+    }, None, None
+
+
 @app.route("/log_energy", methods=["POST"])
 def log_energy():
     """Log user's energy level for a timer session"""
@@ -1163,187 +815,363 @@ def log_energy():
     
     if request.is_json:
         data = request.get_json()
-        timer_id = data.get("timer_id")
-        stage = data.get("stage")  # 'start', 'mid', or 'end'
-        energy_level = data.get("energy_level")  # 1-10
-        focus_level = data.get("focus_level")  # 1-10 (optional)
-        
-        if not all([timer_id, stage, energy_level]):
-            return {"error": "Timer ID, stage, and energy level are required"}, 400
-        
-        if stage not in ['start', 'mid', 'end']:
-            return {"error": "Stage must be 'start', 'mid', or 'end'"}, 400
-        
-        # Check if the specific type of check-in is enabled for this user
-        prefs = get_user_feature_preferences(session['user_id'])
-        stage_enabled = False
-        
-        if stage == 'start' and prefs.get('enable_start_checkin', True):
-            stage_enabled = True
-        elif stage == 'mid' and prefs.get('enable_mid_checkin', True):
-            stage_enabled = True
-        elif stage == 'end' and prefs.get('enable_end_checkin', True):
-            stage_enabled = True
-        
-        if not stage_enabled:
-            return {"error": f"{stage.capitalize()} check-in is disabled for this user"}, 403
-        
-        # Check energy check-in rate limit for all stages
-        # The rate limit is based on end check-ins, but when reached, it blocks all check-ins
-        is_allowed, remaining, message = check_energy_checkin_rate_limit(session['user_id'], timer_id)
-        if not is_allowed:
-            return {"error": message, "remaining_sessions": 0}, 429  # Too Many Requests
-        
-        try:
-            energy_level = int(energy_level)
-            if not (1 <= energy_level <= 10):
-                return {"error": "Energy level must be between 1 and 10"}, 400
-                
-            # Validate focus level if provided
-            if focus_level is not None:
-                focus_level = int(focus_level)
-                if not (1 <= focus_level <= 10):
-                    return {"error": "Focus level must be between 1 and 10"}, 400
-        except (ValueError, TypeError):
-            return {"error": "Energy and focus levels must be numbers"}, 400
+        # Whether the stage is enabled is checked in the check-in's own transaction
+        checkin, error, status = validate_energy_checkin(data, None)
+        if error:
+            return {"error": error}, status
+        
+        timer_id = checkin["timer_id"]
+        stage = checkin["stage"]
+        energy_level = checkin["energy_level"]
+        user_id = session['user_id']
         
-        try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
+        # Held until the check-in is counted, so concurrent check-ins can't both take the last one
+        with rate_limiter.get_limiter().checking_in(user_id):
+            # Check energy check-in rate limit for all stages
+            # The rate limit is based on end check-ins, but when reached, it blocks all check-ins
+            is_allowed, remaining, message = check_energy_checkin_rate_limit(user_id, timer_id)
+            if not is_allowed:
+                return {"error": message, "remaining_sessions": 0}, 429  # Too Many Requests
             
-            # Check if the timer belongs to the user
-            cursor.execute("""
-                SELECT id FROM timers
-                WHERE id = ? AND user_id = ?
-            """, (timer_id, session['user_id']))
+            try:
+                # One transaction: ownership and preference check, the log and insight rows, and
+                # starting the timer for a 'start' check-in or stopping it for an 'end' one
+                epoch = repos.users.session_epoch(user_id)
+                logged = repos.energy.record_checkin(user_id, timer_id, stage, energy_level, epoch)
+            except StorageError as e:
+                logger.error("Error logging energy: %s", str(e))
+                return {"error": "Database error"}, 500
             
-            if not cursor.fetchone():
-                conn.close()
+            if logged.outcome == "not_found":
                 return {"error": "Timer not found or doesn't belong to user"}, 404
+            if logged.outcome == "disabled":
+                return {"error": f"{stage.capitalize()} check-in is disabled for this user"}, 403
             
-            # Insert energy log for simple tracking
-            cursor.execute("""
-                INSERT INTO energy_logs (user_id, timer_id, stage, energy_level)
-                VALUES (?, ?, ?, ?)
-            """, (session['user_id'], timer_id, stage, energy_level))
-
-            # Also insert into the detailed energy_insights table for graphing
-            # We'll use the single energy_level for all numeric insight fields
-            # and provide default values for text fields.
-            cursor.execute("""
-                INSERT INTO energy_insights 
-                (user_id, overall_energy, motivation_level, focus_clarity, physical_energy, 
-                 mood_state, notes)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (session['user_id'], energy_level, energy_level, energy_level, 
-                  energy_level, 'check-in', f'Logged from timer {stage}'))
-
-            # If the stage is 'start', also start the timer
-            if stage == 'start':
-                cursor.execute("""
-                    UPDATE timers
-                    SET is_running = 1, start_time = datetime('now', 'localtime'), 
-                        end_time = NULL, paused_at = NULL, elapsed_time = 0
-                    WHERE id = ? AND user_id = ?
-                """, (timer_id, session['user_id']))
-                logger.debug("Timer %s started automatically after energy log.", timer_id)
-            elif stage == 'end':
-                cursor.execute("""
-                    UPDATE timers
-                    SET is_running = 0, end_time = datetime('now', 'localtime')
-                    WHERE id = ? AND user_id = ?
-                """, (timer_id, session['user_id']))
-                logger.debug("Timer %s stopped automatically after energy log.", timer_id)
-            
-            conn.commit()
-            conn.close()
+            if stage == 'end':
+                rate_limiter.get_limiter().record(user_id, timer_id, logged.timestamp)
             
             # Get updated rate limit status
-            _, remaining, rate_message = check_energy_checkin_rate_limit(session['user_id'])
+            _, remaining, rate_message = check_energy_checkin_rate_limit(user_id)
+        
+        if logged.timer is not None:
+            timer_changed(logged.timer, TIMER_ACTION_PAST[CHECKIN_TIMER_ACTIONS[stage]])
+        
+        return {
+            "success": True,
+            "message": "Energy logged and timer action completed successfully",
+            "rate_limit": {
+                "remaining_sessions": remaining,
+                "daily_limit": 5,
+                "status_message": rate_message
+            }
+        }, 200
+    
+    return {"error": "Invalid request"}, 400
+
+
+@app.route("/log_energy/batch", methods=["POST"])
+def log_energy_batch():
+    """
+    Log a list of energy check-ins in one request (e.g. ones queued while offline).
+    
+    Every item is validated against a single snapshot of the user's preferences and
+    rate limit, the accepted ones are inserted in one transaction, and the response
+    has a result per item in request order. An item may carry the epoch-millisecond
+    "timestamp" it was taken at. Unlike /log_energy, batched check-ins are only
+    recorded; they do not start or stop timers.
+    """
+    if 'user_id' not in session:
+        return {"error": "Not authenticated"}, 401
+    
+    data = request.get_json(silent=True) or {}
+    items = data.get("checkins")
+    if not isinstance(items, list) or not items:
+        return {"error": "A non-empty list of check-ins is required"}, 400
+    if len(items) > MAX_CHECKIN_BATCH:
+        return {"error": f"At most {MAX_CHECKIN_BATCH} check-ins can be sent at once"}, 400
+    
+    user_id = session['user_id']
+    prefs = get_user_feature_preferences(user_id)
+    now = now_ms()
+    
+    results = [None] * len(items)
+    valid = []  # (index, checkin)
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = {"success": False, "error": "Invalid check-in", "status": 400}
+            continue
+        checkin, error, status = validate_energy_checkin(item, prefs)
+        if error:
+            results[index] = {"success": False, "error": error, "status": status}
+            continue
+        
+        timestamp = item.get("timestamp", now)
+        if not isinstance(timestamp, int) or isinstance(timestamp, bool) or not (0 < timestamp <= now):
+            results[index] = {"success": False, "error": "Timestamp must be epoch milliseconds in the past", "status": 400}
+            continue
+        
+        checkin["timestamp"] = timestamp
+        valid.append((index, checkin))
+    
+    try:
+        # Check-ins on timers that aren't the user's are refused before they can take a slot of the limit
+        owned = {timer.id for timer in repos.timers.list_for_user(user_id)}
+    except StorageError as e:
+        logger.error("Error logging energy batch: %s", str(e))
+        return {"error": "Database error"}, 500
+    
+    # Held until the batch is counted, like /log_energy, so concurrent requests can't both take the last slots
+    with rate_limiter.get_limiter().checking_in(user_id):
+        is_allowed, remaining, message = check_energy_checkin_rate_limit(user_id)
+        
+        accepted = []  # (index, checkin)
+        for index, checkin in valid:
+            if checkin["timer_id"] not in owned:
+                results[index] = {"success": False, "error": "Timer not found or doesn't belong to user", "status": 404}
+                continue
             
-            return {
-                "success": True,
-                "message": "Energy logged and timer action completed successfully",
-                "rate_limit": {
-                    "remaining_sessions": remaining,
-                    "daily_limit": 5,
-                    "status_message": rate_message
-                }
-            }, 200
-        except sqlite3.Error as e:
-            logger.error("Error logging energy: %s", str(e))
+            # The limit counts end check-ins, but once it is reached every check-in is blocked
+            if not is_allowed or remaining <= 0:
+                results[index] = {"success": False, "error": message, "status": 429}
+                continue
+            if checkin["stage"] == 'end':
+                remaining -= 1
+                if remaining == 0:
+                    is_allowed = False
+                    message = "Daily limit reached. All energy check-ins are blocked until 6:00 AM tomorrow."
+            
+            accepted.append((index, checkin))
+        
+        try:
+            recorded = repos.energy.record_checkins(user_id, [checkin for _, checkin in accepted])
+            inserted = {index for (index, _), ok in zip(accepted, recorded) if ok}
+        except StorageError as e:
+            logger.error("Error logging energy batch: %s", str(e))
             return {"error": "Database error"}, 500
+        
+        for index, checkin in accepted:
+            if index in inserted:
+                results[index] = {"success": True, "status": 200}
+                if checkin["stage"] == 'end':
+                    rate_limiter.get_limiter().record(user_id, checkin["timer_id"], checkin["timestamp"])
+            else:
+                # Deleted since the ownership check
+                results[index] = {"success": False, "error": "Timer not found or doesn't belong to user", "status": 404}
+        
+        # Counted from what was stored
+        _, remaining, rate_message = check_energy_checkin_rate_limit(user_id)
     
-    return {"error": "Invalid request"}, 400
+    for index, result in enumerate(results):
+        result["index"] = index
+    
+    return {
+        "success": True,
+        "logged": len(inserted),
+        "failed": len(items) - len(inserted),
+        "results": results,
+        "rate_limit": {
+            "remaining_sessions": remaining,
+            "daily_limit": 5,
+            "status_message": rate_message
+        }
+    }, 200
+
+
+# Entries per /get_energy_logs page by default, and the most a client may ask for
+ENERGY_LOG_PAGE_SIZE = 500
+MAX_ENERGY_LOG_PAGE_SIZE = 2000
+
+# Most points a client may ask a downsampled series for (about a 4K screen's width)
+MAX_ENERGY_LOG_POINTS = 4000
+
+# Order of entries that share a timestamp; a page cursor is (timestamp, kind's position, id)
+ENERGY_LOG_KINDS = ("check-in", "insight", "daily")
+DAILY_ROLLUP_RANK = ENERGY_LOG_KINDS.index("daily")
+
+
+def parse_energy_log_cursor(value):
+    """The (timestamp, kind, id) key of a page cursor, or None without one; raises ValueError if malformed"""
+    if not value:
+        return None
+    timestamp, rank, entry_id = (int(part) for part in value.split("."))
+    if not 0 <= rank < len(ENERGY_LOG_KINDS):
+        raise ValueError(f"Unknown entry kind in cursor: {rank}")
+    return timestamp, rank, entry_id
+
+
+def energy_log_bound(cursor, rank):
+    """The exclusive (timestamp, id) bound a page cursor puts on one kind of entry"""
+    if cursor is None:
+        return None
+    timestamp, cursor_rank, entry_id = cursor
+    if rank < cursor_rank:
+        return timestamp + 1, 0  # This kind comes first among entries at the cursor's timestamp
+    if rank > cursor_rank:
+        return timestamp, 0
+    return timestamp, entry_id
+
+
+def rollup_noon_ms(day, tz):
+    """Epoch ms of local noon on a roll-up's day, where the chart plots its average"""
+    return to_epoch_ms(datetime.strptime(day, '%Y-%m-%d').replace(hour=12, tzinfo=tz))
+
+
+def energy_log_page(user_id, from_ms, to_ms, cursor, limit):
+    """
+    The newest `limit` of the user's energy log entries between two instants
+    that come before `cursor`, oldest first, and the cursor of the page before
+    them (None when there is nothing older)
+    """
+    user_tz = timezones.get_service().zone(user_id)
+    
+    # One more than a page from each source shows whether anything is left after this page
+    fetch = limit + 1
+    
+    # Get logs from energy_logs (check-ins)
+    checkin_logs = [
+        ((checkin.timestamp, 0, checkin.id), {
+            "type": "check-in",
+            "energy_level": checkin.energy_level,
+            "timer_name": checkin.timer_name,
+            "stage": checkin.stage
+        })
+        for checkin in repos.energy.checkins_with_timer_names(user_id, from_ms, to_ms,
+                                                              energy_log_bound(cursor, 0), fetch)
+    ]
+    
+    # Get logs from energy_insights (detailed insights)
+    insight_logs = [
+        ((timestamp, 1, insight_id), {
+            "type": "insight",
+            "energy_level": overall_energy
+        })
+        for insight_id, timestamp, overall_energy in repos.energy.insight_levels(user_id, from_ms, to_ms,
+                                                                                 energy_log_bound(cursor, 1), fetch)
+    ]
+    
+    # Older check-ins only survive as daily roll-ups (see retention.py); plot their average at
+    # local noon. They are fetched by day, so the days at either end may fall outside the range.
+    last_ms = min(to_ms, cursor[0]) if cursor else to_ms
+    rollup_logs = []
+    for rollup in repos.energy.daily_rollups(user_id, format_ms(from_ms, user_tz)[:10],
+                                             format_ms(last_ms, user_tz)[:10], fetch + 1):
+        key = (rollup_noon_ms(rollup.day, user_tz), DAILY_ROLLUP_RANK, 0)
+        if from_ms <= key[0] <= to_ms and (cursor is None or key < cursor):
+            rollup_logs.append((key, {
+                "type": "daily",
+                "timestamp": rollup.day + " 12:00:00",
+                "energy_level": round(rollup.energy_sum / rollup.checkin_count, 1),
+                "checkin_count": rollup.checkin_count,
+                "energy_min": rollup.energy_min,
+                "energy_max": rollup.energy_max
+            }))
+    
+    # Every source is newest first; merge them and keep the newest page
+    merged = heapq.merge(checkin_logs, insight_logs, rollup_logs, key=lambda entry: entry[0], reverse=True)
+    page = list(itertools.islice(merged, fetch))
+    next_cursor = "{}.{}.{}".format(*page[limit - 1][0]) if len(page) > limit else None
+    page = page[:limit][::-1]
+    
+    # Convert the page's timestamps to the user's timezone a whole column at a time
+    timed = [(key, log) for key, log in page if key[1] != DAILY_ROLLUP_RANK]
+    for (_, log), timestamp in zip(timed, format_ms_column([key[0] for key, _ in timed], user_tz)):
+        log["timestamp"] = timestamp
+    
+    return [log for _, log in page], next_cursor
+
+
+def energy_log_samples(user_id, from_ms, to_ms, points):
+    """
+    At most `points` (timestamp, energy level) samples tracing the user's energy
+    logs between two instants, oldest first, and whether they were downsampled.
+
+    The logs' time span is cut into points / 2 equal buckets, and each bucket is
+    represented by its lowest and highest reading in the order they happened, so
+    dips and peaks survive however many readings fall into a bucket. The buckets
+    are computed by SQLite; only the roll-ups (one per day) are folded in here.
+    When there are no more logs than points, they are returned as they are.
+    """
+    user_tz = timezones.get_service().zone(user_id)
+    
+    rollups = []
+    for rollup in repos.energy.daily_rollups(user_id, format_ms(from_ms, user_tz)[:10], format_ms(to_ms, user_tz)[:10]):
+        noon = rollup_noon_ms(rollup.day, user_tz)
+        if from_ms <= noon <= to_ms:
+            rollups.append((noon, round(rollup.energy_sum / rollup.checkin_count, 1)))
+    
+    first, last, readings = repos.energy.energy_level_span(user_id, from_ms, to_ms)
+    if readings + len(rollups) <= points:
+        return energy_log_page(user_id, from_ms, to_ms, None, points)[0], False
+    
+    instants = [noon for noon, _ in rollups] + [instant for instant in (first, last) if instant is not None]
+    first, last = min(instants), max(instants)
+    bucket_ms = (last - first) // max(points // 2, 1) + 1
+    
+    # bucket -> [low timestamp, low, high timestamp, high]
+    extremes = {
+        bucket.bucket: [bucket.low_timestamp, bucket.low, bucket.high_timestamp, bucket.high]
+        for bucket in repos.energy.energy_level_extremes(user_id, first, last, bucket_ms)
+    }
+    for noon, level in rollups:
+        extreme = extremes.setdefault((noon - first) // bucket_ms, [noon, level, noon, level])
+        if level < extreme[1]:
+            extreme[0:2] = noon, level
+        if level > extreme[3]:
+            extreme[2:4] = noon, level
+    
+    samples = []
+    for bucket in sorted(extremes):
+        low_timestamp, low, high_timestamp, high = extremes[bucket]
+        samples.extend(sorted({(low_timestamp, low), (high_timestamp, high)}))
+    
+    timestamps = format_ms_column([timestamp for timestamp, _ in samples], user_tz)
+    return [{"type": "sample", "timestamp": timestamp, "energy_level": level}
+            for timestamp, (_, level) in zip(timestamps, samples)], True
 
 
 @app.route("/get_energy_logs", methods=["GET"])
 def get_energy_logs():
-    """Get energy logs for the user from both energy_logs and energy_insights"""
+    """
+    Get a page of the user's energy logs from energy_logs, energy_insights and the daily roll-ups.
+    
+    Query parameters (all optional): from and to, epoch milliseconds bounding the
+    range; limit, the page size; and cursor, the next_cursor of the previous page, to
+    continue back in time. A page holds the newest logs before the cursor, in
+    ascending order.
+    
+    With points, the whole range comes back instead as at most that many samples
+    keeping its shape (see energy_log_samples), for charts that draw all of it;
+    limit and cursor are then ignored.
+    """
     if 'user_id' not in session:
         return {"error": "Not authenticated", "success": False}, 401
     
     user_id = session['user_id']
     
+    now = now_ms()
+    from_ms = max(request.args.get('from', 0, type=int), 0)
+    to_ms = min(request.args.get('to', now, type=int), now)
+    limit = min(max(request.args.get('limit', ENERGY_LOG_PAGE_SIZE, type=int), 1), MAX_ENERGY_LOG_PAGE_SIZE)
     try:
-        # Get user's timezone offset
-        timezone_offset = get_user_timezone_offset(user_id)
-        
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        all_logs = []
-        
-        # Get logs from energy_logs (check-ins)
-        cursor.execute("""
-            SELECT 
-                e.timestamp,
-                e.energy_level,
-                t.name as timer_name,
-                e.stage
-            FROM energy_logs e
-            JOIN timers t ON e.timer_id = t.id
-            WHERE e.user_id = ?
-        """, (user_id,))
-        
-        for row in cursor.fetchall():
-            # Convert timestamp to user's timezone
-            adjusted_time = convert_to_user_timezone(row["timestamp"], timezone_offset)
-            all_logs.append({
-                "type": "check-in",
-                "timestamp": adjusted_time.strftime('%Y-%m-%d %H:%M:%S'),
-                "energy_level": row["energy_level"],
-                "timer_name": row["timer_name"],
-                "stage": row["stage"]
-            })
-            
-        # Get logs from energy_insights (detailed insights)
-        cursor.execute("""
-            SELECT 
-                timestamp,
-                overall_energy
-            FROM energy_insights
-            WHERE user_id = ?
-        """, (user_id,))
-
-        for row in cursor.fetchall():
-            # Convert timestamp to user's timezone
-            adjusted_time = convert_to_user_timezone(row["timestamp"], timezone_offset)
-            all_logs.append({
-                "type": "insight",
-                "timestamp": adjusted_time.strftime('%Y-%m-%d %H:%M:%S'),
-                "energy_level": row["overall_energy"]
-            })
-        
-        conn.close()
-        
-        # Sort all logs by timestamp in ascending order for the chart
-        all_logs.sort(key=lambda x: x['timestamp'])
+        cursor = parse_energy_log_cursor(request.args.get('cursor'))
+    except ValueError:
+        return {"error": "Invalid cursor", "success": False}, 400
+    
+    points = request.args.get('points', type=int)
+    
+    if from_ms > to_ms:
+        return {"success": True, "logs": [], "next_cursor": None}, 200
+    
+    try:
+        if points is not None:
+            points = min(max(points, 2), MAX_ENERGY_LOG_POINTS)
+            logs, downsampled = energy_log_samples(user_id, from_ms, to_ms, points)
+            return {"success": True, "logs": logs, "next_cursor": None, "downsampled": downsampled}, 200
         
-        return {"success": True, "logs": all_logs}, 200
+        logs, next_cursor = energy_log_page(user_id, from_ms, to_ms, cursor, limit)
+        return {"success": True, "logs": logs, "next_cursor": next_cursor}, 200
         
-    except sqlite3.Error as e:
+    except StorageError as e:
         logger.error("Error getting combined energy logs: %s", str(e))
         return {"error": "Database error", "success": False}, 500
 
@@ -1354,21 +1182,7 @@ def start_timer_route(timer_id):
     if 'user_id' not in session:
         return {"error": "Not authenticated"}, 401
     
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE timers
-            SET is_running = 1, start_time = datetime('now', 'localtime'), 
-                end_time = NULL, paused_at = NULL, elapsed_time = 0
-            WHERE id = ? AND user_id = ?
-        """, (timer_id, session['user_id']))
-        conn.commit()
-        conn.close()
-        return {"success": True, "message": "Timer started successfully"}
-    except sqlite3.Error as e:
-        logger.error("Error starting timer: %s", e)
-        return {"success": False, "error": "Database error"}, 500
+    return timer_action_response(timer_id, "start")
 
 
 @app.route("/pause_timer/<int:timer_id>", methods=["POST"])
@@ -1376,46 +1190,7 @@ def pause_timer_route(timer_id):
     if 'user_id' not in session:
         return {"error": "Not authenticated"}, 401
     
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Get current timer state
-        cursor.execute("""
-            SELECT start_time, elapsed_time FROM timers
-            WHERE id = ? AND user_id = ?
-        """, (timer_id, session['user_id']))
-        timer_data = cursor.fetchone()
-        
-        if timer_data and timer_data[0]:  # start_time exists
-            start_time_str = timer_data[0]
-            current_elapsed = timer_data[1] or 0
-            
-            # Calculate elapsed time in milliseconds
-            start_time = datetime.strptime(start_time_str, '%Y-%m-%d %H:%M:%S')
-            current_time = datetime.now()
-            session_elapsed = int((current_time - start_time).total_seconds() * 1000)  # Convert to milliseconds
-            total_elapsed = current_elapsed + session_elapsed
-            
-            cursor.execute("""
-                UPDATE timers
-                SET is_running = 2, paused_at = datetime('now', 'localtime'),
-                    elapsed_time = ?
-                WHERE id = ? AND user_id = ?
-            """, (total_elapsed, timer_id, session['user_id']))
-        else:
-            cursor.execute("""
-                UPDATE timers
-                SET is_running = 2, paused_at = datetime('now', 'localtime')
-                WHERE id = ? AND user_id = ?
-            """, (timer_id, session['user_id']))
-        
-        conn.commit()
-        conn.close()
-        return {"success": True, "message": "Timer paused successfully"}
-    except sqlite3.Error as e:
-        logger.error("Error pausing timer: %s", e)
-        return {"success": False, "error": "Database error"}, 500
+    return timer_action_response(timer_id, "pause")
 
 
 @app.route("/resume_timer/<int:timer_id>", methods=["POST"])
@@ -1423,20 +1198,7 @@ def resume_timer_route(timer_id):
     if 'user_id' not in session:
         return {"error": "Not authenticated"}, 401
     
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE timers
-            SET is_running = 1, start_time = datetime('now', 'localtime'), paused_at = NULL
-            WHERE id = ? AND user_id = ?
-        """, (timer_id, session['user_id']))
-        conn.commit()
-        conn.close()
-        return {"success": True, "message": "Timer resumed successfully"}
-    except sqlite3.Error as e:
-        logger.error("Error resuming timer: %s", e)
-        return {"success": False, "error": "Database error"}, 500
+    return timer_action_response(timer_id, "resume")
 
 
 @app.route("/stop_timer/<int:timer_id>", methods=["POST"])
@@ -1444,44 +1206,45 @@ def stop_timer_route(timer_id):
     if 'user_id' not in session:
         return {"error": "Not authenticated"}, 401
     
+    return timer_action_response(timer_id, "stop")
+
+
+@app.route("/timers/stream")
+def timer_stream():
+    """Server-Sent Events stream of the state of all the user's timers"""
+    if 'user_id' not in session:
+        return {"error": "Not authenticated"}, 401
+    
+    user_id = session['user_id']
+    broker = timer_events.get_broker()
+    
+    # Subscribe before reading the snapshot so no transition falls in between
+    subscription = broker.subscribe(user_id)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Calculate final elapsed time
-        cursor.execute("""
-            SELECT start_time, elapsed_time, is_running FROM timers
-            WHERE id = ? AND user_id = ?
-        """, (timer_id, session['user_id']))
-        timer_data = cursor.fetchone()
-        
-        total_elapsed = 0
-        if timer_data:
-            current_elapsed = timer_data[1] or 0
-            is_currently_running = timer_data[2]
-            
-            # If timer is currently running, add current session time
-            if is_currently_running == 1 and timer_data[0]:  # Running and has start_time
-                start_time_str = timer_data[0]
-                start_time = datetime.strptime(start_time_str, '%Y-%m-%d %H:%M:%S')
-                current_time = datetime.now()
-                session_elapsed = int((current_time - start_time).total_seconds() * 1000)  # Convert to milliseconds
-                total_elapsed = current_elapsed + session_elapsed
-            else:
-                total_elapsed = current_elapsed
-        
-        cursor.execute("""
-            UPDATE timers
-            SET is_running = 0, end_time = datetime('now', 'localtime'),
-                elapsed_time = ?, start_time = NULL, paused_at = NULL
-            WHERE id = ? AND user_id = ?
-        """, (total_elapsed, timer_id, session['user_id']))
-        conn.commit()
-        conn.close()
-        return {"success": True, "message": "Timer stopped successfully"}
-    except sqlite3.Error as e:
-        logger.error("Error stopping timer: %s", e)
-        return {"success": False, "error": "Database error"}, 500
+        timers = repos.timers.list_for_user(user_id, repos.users.session_epoch(user_id))
+        snapshot = [timer_payload(timer) for timer in timers]
+    except StorageError as e:
+        broker.unsubscribe(subscription)
+        logger.error("Error opening timer stream: %s", str(e))
+        return {"error": "Database error"}, 500
+    
+    return Response(broker.stream(subscription, snapshot), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/get_timer_states", methods=["GET"])
+def get_timer_states():
+    """Get the current state of all the user's timers in one request"""
+    if 'user_id' not in session:
+        return {"error": "Not authenticated"}, 401
+    
+    try:
+        user_id = session['user_id']
+        timers = repos.timers.list_for_user(user_id, repos.users.session_epoch(user_id))
+        return {"success": True, "timers": [timer_payload(timer) for timer in timers]}, 200
+    except StorageError as e:
+        logger.error("Error getting timer states: %s", e)
+        return {"error": "Database error"}, 500
 
 
 @app.route("/get_timer_state/<int:timer_id>", methods=["GET"])
@@ -1491,48 +1254,77 @@ def get_timer_state(timer_id):
         return {"error": "Not authenticated"}, 401
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT id, name, duration, start_time, elapsed_time, is_running
-            FROM timers
-            WHERE id = ? AND user_id = ?
-        """, (timer_id, session['user_id']))
-        
-        timer_data = cursor.fetchone()
-        conn.close()
+        user_id = session['user_id']
+        timer = repos.timers.state(user_id, timer_id, repos.users.session_epoch(user_id))
         
-        if not timer_data:
+        if not timer:
             return {"error": "Timer not found"}, 404
         
-        timer_id, name, duration, start_time, elapsed_time, is_running = timer_data
-        
-        # Calculate current elapsed time if timer is running
-        current_elapsed = elapsed_time or 0
-        if is_running == 1 and start_time:  # Timer is running
-            start_time_obj = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')
-            current_time = datetime.now()
-            session_elapsed = int((current_time - start_time_obj).total_seconds() * 1000)
-            current_elapsed += session_elapsed
-        
-        return {
-            "success": True,
-            "timer": {
-                "id": timer_id,
-                "name": name,
-                "duration": duration,  # Duration in seconds
-                "elapsed_time": current_elapsed,  # Elapsed time in milliseconds
-                "is_running": is_running,
-                "remaining_time": max(0, (duration * 1000) - current_elapsed)  # Remaining time in milliseconds
-            }
-        }, 200
+        # Elapsed and remaining time are worked out as of now for running timers
+        return {"success": True, "timer": timer_payload(timer)}, 200
         
-    except sqlite3.Error as e:
+    except StorageError as e:
         logger.error("Error getting timer state: %s", e)
         return {"error": "Database error"}, 500
         
 
+def focus_minutes(user_id, period, count):
+    """
+    Focused minutes and finished runs for each of the last `count` days or
+    weeks (period) in the user's timezone, oldest first, with zeros for
+    periods without any runs
+    """
+    user_tz = timezones.get_service().zone(user_id)
+    today = datetime.now(user_tz).date()
+    if period == "week":
+        step = timedelta(weeks=1)
+        first = today - timedelta(days=today.weekday()) - step * (count - 1)
+    else:
+        step = timedelta(days=1)
+        first = today - step * (count - 1)
+    periods, end = local_periods(first, count, user_tz, step)
+    
+    totals = {total.period: total for total in repos.timers.focus_totals(user_id, periods, end)}
+    
+    result = []
+    for key, _ in periods:
+        total = totals.get(key)
+        result.append({
+            period: key,
+            "focus_minutes": round(total.focused_ms / 60000, 1) if total else 0,
+            "sessions": total.session_count if total else 0
+        })
+    return result
+
+
+@app.route("/get_focus_minutes/daily", methods=["GET"])
+def get_daily_focus_minutes():
+    """Focused minutes per day over the last `days` days (default 7)"""
+    if 'user_id' not in session:
+        return {"error": "Not authenticated"}, 401
+    
+    days = min(max(request.args.get('days', 7, type=int), 1), 366)
+    try:
+        return {"success": True, "days": focus_minutes(session['user_id'], "day", days)}, 200
+    except StorageError as e:
+        logger.error("Error getting daily focus minutes: %s", str(e))
+        return {"error": "Database error"}, 500
+
+
+@app.route("/get_focus_minutes/weekly", methods=["GET"])
+def get_weekly_focus_minutes():
+    """Focused minutes per week (starting Monday) over the last `weeks` weeks (default 4)"""
+    if 'user_id' not in session:
+        return {"error": "Not authenticated"}, 401
+    
+    weeks = min(max(request.args.get('weeks', 4, type=int), 1), 104)
+    try:
+        return {"success": True, "weeks": focus_minutes(session['user_id'], "week", weeks)}, 200
+    except StorageError as e:
+        logger.error("Error getting weekly focus minutes: %s", str(e))
+        return {"error": "Database error"}, 500
+
+
 # Energy Insights API Endpoints
 
 @app.route("/save_energy_insights", methods=["POST"])
@@ -1573,26 +1365,17 @@ def save_energy_insights():
         except (ValueError, TypeError):
             return {"error": "Energy levels must be numbers"}, 400
         
+        user_id = session['user_id']
+        
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                INSERT INTO energy_insights 
-                (user_id, overall_energy, motivation_level, focus_clarity, physical_energy, 
-                 mood_state, energy_source, energy_drains, notes)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (session['user_id'], overall_energy, motivation_level, focus_clarity, 
-                  physical_energy, mood_state, energy_source, energy_drains, notes))
-            
-            conn.commit()
-            conn.close()
+            repos.energy.save_insight(user_id, overall_energy, motivation_level, focus_clarity, physical_energy,
+                                      mood_state, energy_source, energy_drains, notes)
             
             return {
                 "success": True,
                 "message": "Energy insights saved successfully"
             }, 200
-        except sqlite3.Error as e:
+        except StorageError as e:
             logger.error("Error saving energy insights: %s", str(e))
             return {"error": "Database error"}, 500
     
@@ -1606,22 +1389,11 @@ def get_energy_insights():
         return {"error": "Not authenticated"}, 401
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
         # Get recent insights with optional limit
         limit = request.args.get('limit', 10, type=int)
         
-        cursor.execute("""
-            SELECT * FROM energy_insights
-            WHERE user_id = ?
-            ORDER BY timestamp DESC
-            LIMIT ?
-        """, (session['user_id'], limit))
-        
         insights = []
-        for row in cursor:
+        for row in repos.energy.latest_insights(session['user_id'], limit):
             insights.append({
                 "id": row["id"],
                 "overall_energy": row["overall_energy"],
@@ -1632,13 +1404,12 @@ def get_energy_insights():
                 "energy_source": row["energy_source"],
                 "energy_drains": row["energy_drains"],
                 "notes": row["notes"],
-                "timestamp": row["timestamp"]
+                "timestamp": format_ms(row["timestamp"], timezone.utc)
             })
         
-        conn.close()
         
         return {"insights": insights}, 200
-    except sqlite3.Error as e:
+    except StorageError as e:
         logger.error("Error getting energy insights: %s", str(e))
         return {"error": "Database error"}, 500
 
@@ -1653,8 +1424,9 @@ def get_weekly_insights():
         user_id = session['user_id']
         week_offset = request.args.get('week_offset', 0, type=int)  # 0 = current week, -1 = last week, etc.
         
-        # Calculate week boundaries
-        today = datetime.now()
+        # Calculate week boundaries on the user's calendar
+        user_tz = timezones.get_service().zone(user_id)
+        today = datetime.now(user_tz).date()
         days_since_monday = today.weekday()
         monday_this_week = today - timedelta(days=days_since_monday)
         
@@ -1662,23 +1434,11 @@ def get_weekly_insights():
         target_monday = monday_this_week + timedelta(weeks=week_offset)
         target_sunday = target_monday + timedelta(days=6)
         
-        # Format dates for SQL query
-        week_start = target_monday.strftime('%Y-%m-%d 00:00:00')
-        week_end = target_sunday.strftime('%Y-%m-%d 23:59:59')
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        # The week's days, each from the user's local midnight, as epoch milliseconds for the SQL query
+        week_days, week_end = local_periods(target_monday, 7, user_tz)
         
-        # Get energy logs for the week
-        cursor.execute('''
-            SELECT energy_level, timestamp, 
-                   DATE(timestamp) as log_date
-            FROM energy_logs 
-            WHERE user_id = ? AND timestamp BETWEEN ? AND ?
-            ORDER BY timestamp
-        ''', (user_id, week_start, week_end))
-        
-        weekly_logs = cursor.fetchall()
+        # Get per-day energy totals for the week
+        weekly_logs = repos.energy.daily_totals(user_id, week_days, week_end)
         
         if not weekly_logs:
             return jsonify({
@@ -1695,31 +1455,19 @@ def get_weekly_insights():
                 }
             })
         
-        # Group logs by date and calculate daily averages
-        daily_data = {}
-        for log in weekly_logs:
-            log_date = log[2]  # DATE(timestamp) as log_date
-            if log_date not in daily_data:
-                daily_data[log_date] = []
-            daily_data[log_date].append(log[0])  # energy_level
-        
         # Calculate daily averages
         daily_averages = {}
         formatted_logs = []
-        for date, energy_levels in daily_data.items():
-            avg_energy = sum(energy_levels) / len(energy_levels)
+        for date, energy_sum, session_count in weekly_logs:
+            avg_energy = energy_sum / session_count
             daily_averages[date] = avg_energy
             
-            # Convert to user's timezone for display
-            timezone_offset = get_user_timezone_offset(user_id)
-            date_obj = datetime.strptime(date + ' 12:00:00', '%Y-%m-%d %H:%M:%S')
-            adjusted_time = convert_to_user_timezone(date_obj.strftime('%Y-%m-%d %H:%M:%S'), timezone_offset)
-            
+            # Days are already the user's own, so each is plotted at its local midday
             formatted_logs.append({
                 'energy_level': round(avg_energy, 1),
-                'timestamp': adjusted_time.strftime('%Y-%m-%d %H:%M:%S'),
+                'timestamp': date + ' 12:00:00',
                 'date': date,
-                'session_count': len(energy_levels)
+                'session_count': session_count
             })
         
         # Calculate insights based on daily averages
@@ -1788,7 +1536,6 @@ def get_weekly_insights():
             'insight_message': insight_message
         }
         
-        conn.close()
         
         return jsonify({
             'success': True,
@@ -1798,7 +1545,7 @@ def get_weekly_insights():
             'insights': insights
         })
         
-    except (sqlite3.Error, ValueError) as e:
+    except (StorageError, ValueError) as e:
         logger.error("Error getting weekly insights: %s", str(e))
         return {"error": "Database error"}, 500
 
@@ -1813,8 +1560,9 @@ def get_monthly_insights():
         user_id = session['user_id']
         month_offset = request.args.get('month_offset', 0, type=int)  # 0 = current month, -1 = last month, etc.
         
-        # Calculate month boundaries
-        today = datetime.now()
+        # Calculate month boundaries on the user's calendar
+        user_tz = timezones.get_service().zone(user_id)
+        today = datetime.now(user_tz).date()
         # Get first day of current month
         first_day_current_month = today.replace(day=1)
         
@@ -1837,23 +1585,11 @@ def get_monthly_insights():
         else:
             last_day_target_month = target_month.replace(month=target_month.month + 1) - timedelta(days=1)
         
-        # Format dates for SQL query
-        month_start = target_month.strftime('%Y-%m-%d 00:00:00')
-        month_end = last_day_target_month.strftime('%Y-%m-%d 23:59:59')
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Get energy logs for the month
-        cursor.execute('''
-            SELECT energy_level, timestamp, 
-                   DATE(timestamp) as log_date
-            FROM energy_logs 
-            WHERE user_id = ? AND timestamp BETWEEN ? AND ?
-            ORDER BY timestamp
-        ''', (user_id, month_start, month_end))
+        # The month's days, each from the user's local midnight, as epoch milliseconds for the SQL query
+        month_days, month_end = local_periods(target_month, (last_day_target_month - target_month).days + 1, user_tz)
         
-        monthly_logs = cursor.fetchall()
+        # Get per-day energy totals for the month
+        monthly_logs = repos.energy.daily_totals(user_id, month_days, month_end)
         
         if not monthly_logs:
             return jsonify({
@@ -1870,31 +1606,19 @@ def get_monthly_insights():
                 }
             })
         
-        # Group logs by date and calculate daily averages
-        daily_data = {}
-        for log in monthly_logs:
-            log_date = log[2]  # DATE(timestamp) as log_date
-            if log_date not in daily_data:
-                daily_data[log_date] = []
-            daily_data[log_date].append(log[0])  # energy_level
-        
         # Calculate daily averages
         daily_averages = {}
         formatted_logs = []
-        for date, energy_levels in daily_data.items():
-            avg_energy = sum(energy_levels) / len(energy_levels)
+        for date, energy_sum, session_count in monthly_logs:
+            avg_energy = energy_sum / session_count
             daily_averages[date] = avg_energy
             
-            # Convert to user's timezone for display
-            timezone_offset = get_user_timezone_offset(user_id)
-            date_obj = datetime.strptime(date + ' 12:00:00', '%Y-%m-%d %H:%M:%S')
-            adjusted_time = convert_to_user_timezone(date_obj.strftime('%Y-%m-%d %H:%M:%S'), timezone_offset)
-            
+            # Days are already the user's own, so each is plotted at its local midday
             formatted_logs.append({
                 'energy_level': round(avg_energy, 1),
-                'timestamp': adjusted_time.strftime('%Y-%m-%d %H:%M:%S'),
+                'timestamp': date + ' 12:00:00',
                 'date': date,
-                'session_count': len(energy_levels)
+                'session_count': session_count
             })
         
         # Calculate insights based on daily averages
@@ -1963,7 +1687,6 @@ def get_monthly_insights():
             'insight_message': insight_message
         }
         
-        conn.close()
         
         return jsonify({
             'success': True,
@@ -1973,7 +1696,7 @@ def get_monthly_insights():
             'insights': insights
         })
         
-    except (sqlite3.Error, ValueError) as e:
+    except (StorageError, ValueError) as e:
         logger.error("Error getting monthly insights: %s", str(e))
         return {"error": "Database error"}, 500
 
@@ -1989,14 +1712,10 @@ def settings():
     
     # Get current user's country and state
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT country, state_province FROM users WHERE id = ?", (session['user_id'],))
-        result = cursor.fetchone()
-        current_country = result[0] if result else 'AU'
-        current_state = result[1] if result and result[1] else ''
-        conn.close()
-    except sqlite3.Error as e:
+        user = repos.users.get(session['user_id'])
+        current_country = user.country if user else 'AU'
+        current_state = user.state_province if user and user.state_province else ''
+    except StorageError as e:
         logger.error("Error fetching user location: %s", str(e))
         current_country = 'AU'
         current_state = ''
@@ -2011,20 +1730,13 @@ def settings():
                 return redirect(url_for("settings"))
             
             try:
-                conn = sqlite3.connect(DB_PATH)
-                cursor = conn.cursor()
-                cursor.execute("SELECT id FROM users WHERE username = ? AND id != ?", 
-                             (new_username, session['user_id']))
-                if cursor.fetchone():
+                if repos.users.username_taken(new_username, exclude_user_id=session['user_id']):
                     flash("Username already exists!", "error")
                 else:
-                    cursor.execute("UPDATE users SET username = ? WHERE id = ?", 
-                                 (new_username, session['user_id']))
-                    conn.commit()
+                    repos.users.update_username(session['user_id'], new_username)
                     session['username'] = new_username
                     flash("Username updated successfully!", "success")
-                conn.close()
-            except sqlite3.Error as e:
+            except StorageError as e:
                 logger.error("Error updating username: %s", str(e))
                 flash("Error updating username.", "error")
             
@@ -2050,22 +1762,16 @@ def settings():
                 return redirect(url_for("settings"))
             
             try:
-                conn = sqlite3.connect(DB_PATH)
-                cursor = conn.cursor()
-                cursor.execute("SELECT password FROM users WHERE id = ?", (session['user_id'],))
-                stored_password = cursor.fetchone()[0]
+                stored_password = repos.users.get(session['user_id']).password
                 
                 if check_password_hash(stored_password, current_password):
                     hashed_new_password = generate_password_hash(new_password)
-                    cursor.execute("UPDATE users SET password = ? WHERE id = ?", 
-                                 (hashed_new_password, session['user_id']))
-                    conn.commit()
+                    repos.users.update_password(session['user_id'], hashed_new_password)
                     flash("Password updated successfully!", "success")
                 else:
                     flash("Current password is incorrect!", "error")
                 
-                conn.close()
-            except sqlite3.Error as e:
+            except StorageError as e:
                 logger.error("Error updating password: %s", str(e))
                 flash("Error updating password.", "error")
             
@@ -2076,14 +1782,10 @@ def settings():
             state_province = request.form.get("state_province", "").strip()
             
             try:
-                conn = sqlite3.connect(DB_PATH)
-                cursor = conn.cursor()
-                cursor.execute("UPDATE users SET country = ?, state_province = ? WHERE id = ?", 
-                             (country, state_province, session['user_id']))
-                conn.commit()
-                conn.close()
+                repos.users.update_location(session['user_id'], country, state_province)
+                timezones.get_service().forget(session['user_id'])
                 flash("Location updated successfully!", "success")
-            except sqlite3.Error as e:
+            except StorageError as e:
                 logger.error("Error updating location: %s", str(e))
                 flash("Error updating location.", "error")
             
@@ -2104,48 +1806,32 @@ def export_user_data():
     
     try:
         user_id = session['user_id']
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
         
         # Get user info
-        cursor.execute("SELECT username, country, state_province FROM users WHERE id = ?", (user_id,))
-        user_info = cursor.fetchone()
+        user_info = repos.users.get(user_id)
         
-        # Get timers
-        cursor.execute("SELECT * FROM timers WHERE user_id = ?", (user_id,))
-        timers = cursor.fetchall()
-        
-        # Get energy logs
-        cursor.execute("SELECT * FROM energy_logs WHERE user_id = ?", (user_id,))
-        energy_logs = cursor.fetchall()
-        
-        # Get energy insights
-        cursor.execute("SELECT * FROM energy_insights WHERE user_id = ?", (user_id,))
-        energy_insights = cursor.fetchall()
-        
-        # Get flow shelf items
-        cursor.execute("SELECT * FROM flow_shelf WHERE user_id = ?", (user_id,))
-        flow_shelf = cursor.fetchall()
-        
-        conn.close()
+        # Get energy logs, insights and daily roll-ups of older check-ins
+        energy = repos.energy.export(user_id)
         
         user_data = {
             "user_info": {
-                "username": user_info[0],
-                "country": user_info[1],
-                "state_province": user_info[2]
+                "username": user_info.username,
+                "country": user_info.country,
+                "state_province": user_info.state_province
             },
-            "timers": [dict(zip([col[0] for col in cursor.description], timer)) for timer in timers],
-            "energy_logs": [dict(zip([col[0] for col in cursor.description], log)) for log in energy_logs],
-            "energy_insights": [dict(zip([col[0] for col in cursor.description], insight)) for insight in energy_insights],
-            "flow_shelf": [dict(zip([col[0] for col in cursor.description], item)) for item in flow_shelf]
+            "timers": repos.timers.export(user_id),
+            "timer_sessions": repos.timers.export_sessions(user_id),
+            "energy_logs": energy["energy_logs"],
+            "energy_insights": energy["energy_insights"],
+            "energy_daily_rollups": energy["energy_daily_rollups"],
+            "flow_shelf": repos.shelf.export(user_id)
         }
         
         response = jsonify(user_data)
-        response.headers['Content-Disposition'] = f'attachment; filename=deepflow_data_{user_info[0]}.json'
+        response.headers['Content-Disposition'] = f'attachment; filename=deepflow_data_{user_info.username}.json'
         return response
         
-    except sqlite3.Error as e:
+    except StorageError as e:
         logger.error("Error exporting user data: %s", str(e))
         flash("Error exporting data.", "error")
         return redirect(url_for("settings"))
@@ -2172,27 +1858,24 @@ def delete_account():
         
         try:
             user_id = session['user_id']
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
             
             # Verify password
-            cursor.execute("SELECT password FROM users WHERE id = ?", (user_id,))
-            stored_password = cursor.fetchone()[0]
+            stored_password = repos.users.get(user_id).password
             
             if not check_password_hash(stored_password, password):
                 flash("Incorrect password!", "error")
                 return render_template("delete_account.html")
             
-            # Delete all user data
-            cursor.execute("DELETE FROM energy_insights WHERE user_id = ?", (user_id,))
-            cursor.execute("DELETE FROM energy_logs WHERE user_id = ?", (user_id,))
-            cursor.execute("DELETE FROM flow_shelf WHERE user_id = ?", (user_id,))
-            cursor.execute("DELETE FROM timers WHERE user_id = ?", (user_id,))
-            cursor.execute("DELETE FROM user_preferences WHERE user_id = ?", (user_id,))
-            cursor.execute("DELETE FROM users WHERE id = ?", ( user_id,))
+            # Delete all user data (from the user's shard when sharding is on)
+            repos.energy.delete_for_user(user_id)
+            repos.shelf.delete_for_user(user_id)
+            repos.timers.delete_for_user(user_id)
+            repos.preferences.delete_for_user(user_id)
             
-            conn.commit()
-            conn.close()
+            # Then the account itself, so a failure above leaves it intact
+            repos.users.delete(user_id)
+            rate_limiter.get_limiter().forget(user_id)
+            timezones.get_service().forget(user_id)
             
             # Clear session
             session.clear()
@@ -2200,7 +1883,7 @@ def delete_account():
             flash("Account deleted successfully.", "success")
             return redirect(url_for("home"))
             
-        except sqlite3.Error as e:
+        except StorageError as e:
             logger.error("Error deleting account: %s", str(e))
             flash("Error deleting account.", "error")
             return render_template("delete_account.html")
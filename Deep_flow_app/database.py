@@ -0,0 +1,421 @@
+"""
+Connection management for the DeepFlow SQLite database.
+
+Connections are kept in a small pool per database file and have their PRAGMAs
+applied once, when they are first opened. Inside a Flask request every helper
+that calls get_db() shares the same connection, which goes back to the pool
+when the app context is torn down.
+
+Analytics routes read through get_read_db() instead, which hands out read-only
+connections from a separate pool. Each request's reads run in one WAL read
+transaction, so they see a single consistent snapshot and never take the
+write lock. Optionally (enable_snapshot()) that pool points at a copy of the
+database that is refreshed in the background every few seconds.
+"""
+import os
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+
+from flask import g, has_app_context, has_request_context, session
+
+logger = logging.getLogger(__name__)
+
+# PRAGMAs applied once to every new connection
+CONNECTION_PRAGMAS = (
+    ("auto_vacuum", "INCREMENTAL"),  # Only takes on a new, empty file, so before WAL writes its header (see retention.py)
+    ("journal_mode", "WAL"),      # Readers don't block the writer
+    ("busy_timeout", 5000),       # Wait up to 5s for the write lock instead of failing
+    ("synchronous", "NORMAL"),    # Safe with WAL, avoids an fsync per commit
+    ("cache_size", -16000),       # 16 MB page cache (negative value = KiB)
+    ("mmap_size", 134217728),     # 128 MB memory-mapped reads
+    ("temp_store", "MEMORY"),
+)
+
+# PRAGMAs for read-only analytics connections (journal mode is a property of the file)
+READ_ONLY_PRAGMAS = (
+    ("busy_timeout", 5000),
+    ("cache_size", -16000),
+    ("mmap_size", 134217728),
+    ("temp_store", "MEMORY"),
+    ("query_only", 1),            # Belt and braces on top of mode=ro
+)
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_SNAPSHOT_INTERVAL = 30  # Seconds between analytics snapshot refreshes
+
+
+class ConnectionPool:
+    """
+    A LIFO pool of configured sqlite3 connections for one database file.
+
+    Connections are opened with check_same_thread=False so that a connection
+    released by one worker thread can be reused by the next one; the most
+    recently used connection is handed out first so its page cache stays warm.
+    A connection is only ever checked out by one request at a time.
+    """
+
+    def __init__(self, db_path, max_idle=DEFAULT_POOL_SIZE, pragmas=CONNECTION_PRAGMAS,
+                 read_only=False):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.pragmas = pragmas
+        self.read_only = read_only
+        self._idle = []
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._opened_in = {}  # connection -> generation it was opened in
+
+    def _open(self):
+        """Open a new connection and apply the pool's PRAGMAs to it"""
+        if self.read_only:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True,
+                                   check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for name, value in self.pragmas:
+            conn.execute(f"PRAGMA {name} = {value}")
+        with self._lock:
+            self._opened_in[conn] = self._generation
+        logger.debug("Opened new SQLite connection to %s", self.db_path)
+        return conn
+
+    def _close(self, conn):
+        with self._lock:
+            self._opened_in.pop(conn, None)
+        conn.close()
+
+    def acquire(self):
+        """Take an idle connection from the pool, opening a new one if needed"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._open()
+
+    def release(self, conn):
+        """Return a connection to the pool, closing it if the pool is full"""
+        if conn.in_transaction:
+            # Never hand out a connection with someone else's uncommitted work
+            conn.rollback()
+        conn.row_factory = None
+        with self._lock:
+            current = self._opened_in.get(conn) == self._generation
+            if current and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        self._close(conn)
+
+    def recycle(self):
+        """
+        Close every idle connection and retire checked-out ones when they are released.
+
+        Used after the file behind the pool has been replaced, so that no one keeps
+        reading the old copy.
+        """
+        with self._lock:
+            self._generation += 1
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks a connection out for the duration of a block"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """Close every idle connection held by the pool"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn)
+
+
+class SnapshotRefresher:
+    """
+    Keeps a read-only copy of a database file fresh for analytics queries.
+
+    Every interval seconds the source is copied with SQLite's online backup API
+    into a temporary file, which is then switched to rollback-journal mode and
+    atomically renamed over the snapshot. The read pool is recycled afterwards so
+    new requests open the fresh copy while in-flight ones finish on the old one.
+    """
+
+    def __init__(self, source_path, snapshot_path, read_pool, interval=DEFAULT_SNAPSHOT_INTERVAL):
+        self.source_path = source_path
+        self.snapshot_path = snapshot_path
+        self.read_pool = read_pool
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()  # One refresh at a time; they share the temporary file
+
+    def refresh(self):
+        """Copy the source database over the snapshot"""
+        tmp_path = self.snapshot_path + ".tmp"
+        with self._lock:
+            source = sqlite3.connect(f"file:{self.source_path}?mode=ro", uri=True)
+            target = sqlite3.connect(tmp_path)
+            try:
+                source.backup(target)
+                # A plain journal lets mode=ro readers open the copy without -wal/-shm files
+                target.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                target.close()
+                source.close()
+            os.replace(tmp_path, self.snapshot_path)
+            self.read_pool.recycle()
+        logger.debug("Refreshed analytics snapshot %s", self.snapshot_path)
+
+    def start(self):
+        """Take a first snapshot, then keep refreshing it on a background thread"""
+        if self._thread is not None:
+            return
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name="deepflow-snapshot", daemon=True)
+        self._thread.start()
+        logger.info("Analytics snapshot refresh started (every %ss)", self.interval)
+
+    def stop(self):
+        """Stop refreshing the snapshot"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except (sqlite3.Error, OSError) as e:
+                # Keep serving the previous snapshot and try again next time
+                logger.error("Failed to refresh analytics snapshot: %s", str(e))
+
+
+_pool = None
+_read_pool = None
+_shard_pools = []
+_shard_read_pools = []
+_snapshot = None
+
+
+def shard_paths(db_path, shards):
+    """File names of the per-user shards that sit next to db_path"""
+    root, ext = os.path.splitext(db_path)
+    return [f"{root}.shard{index}{ext}" for index in range(shards)]
+
+
+def init_app(app, db_path, max_idle=DEFAULT_POOL_SIZE, shards=1):
+    """
+    Create the connection pools for db_path and bind them to the Flask app.
+
+    With shards > 1, db_path becomes the global directory database (users) and
+    the per-user tables live in `shards` separate files, each with its own pools
+    and write lock. A user's shard is fixed by their id, so the shard count
+    must not change once users have data.
+    """
+    global _pool, _read_pool, _shard_pools, _shard_read_pools
+    _pool = ConnectionPool(db_path, max_idle=max_idle)
+    _read_pool = ConnectionPool(db_path, max_idle=max_idle, pragmas=READ_ONLY_PRAGMAS,
+                                read_only=True)
+    if shards > 1:
+        paths = shard_paths(db_path, shards)
+        _shard_pools = [ConnectionPool(path, max_idle=max_idle) for path in paths]
+        _shard_read_pools = [ConnectionPool(path, max_idle=max_idle, pragmas=READ_ONLY_PRAGMAS,
+                                            read_only=True) for path in paths]
+        logger.info("Per-user data sharded across %d databases", shards)
+    app.teardown_appcontext(close_db)
+    return _pool
+
+
+def enable_snapshot(snapshot_path=None, interval=DEFAULT_SNAPSHOT_INTERVAL):
+    """
+    Serve get_read_db() from a periodically refreshed copy of the database.
+
+    Analytics reads then never touch the live file at all, at the cost of being
+    up to interval seconds stale. Call this after the schema has been migrated.
+    Not available in sharded mode, where reads already spread over the shards.
+    """
+    global _read_pool, _snapshot
+    if _shard_pools:
+        logger.warning("Analytics snapshots are not supported with sharding; reading live shards")
+        return None
+    pool = get_pool()
+    if snapshot_path is None:
+        root, ext = os.path.splitext(pool.db_path)
+        snapshot_path = f"{root}.snapshot{ext}"
+    _read_pool = ConnectionPool(snapshot_path, max_idle=pool.max_idle,
+                                pragmas=READ_ONLY_PRAGMAS, read_only=True)
+    _snapshot = SnapshotRefresher(pool.db_path, snapshot_path, _read_pool, interval)
+    _snapshot.start()
+    return _snapshot
+
+
+def refresh_snapshot():
+    """
+    Bring the analytics snapshot up to date now, for callers that must read
+    what was just written (tests, scripts). Does nothing without a snapshot.
+    """
+    if _snapshot is not None:
+        _snapshot.refresh()
+
+
+def get_pool():
+    """Return the pool for the global database created by init_app()"""
+    if _pool is None:
+        raise RuntimeError("database.init_app() has not been called")
+    return _pool
+
+
+def get_pools():
+    """Every writable pool: the global database followed by the shards, if any"""
+    return [get_pool()] + _shard_pools
+
+
+def get_user_pools():
+    """The pools that hold per-user tables (the shards, or just the global database)"""
+    return list(_shard_pools) or [get_pool()]
+
+
+def shard_for_user(user_id):
+    """Index of the shard holding user_id's data, or None when sharding is off"""
+    if not _shard_pools:
+        return None
+    return int(user_id) % len(_shard_pools)
+
+
+def _shard_index(user_id):
+    """
+    Shard for user_id (by default the logged-in user, or the user of a
+    user_context() block), or None for the global database
+    """
+    if user_id is None and has_request_context():
+        user_id = session.get('user_id')
+    if user_id is None and has_app_context():
+        user_id = g.get('background_user_id')
+    if user_id is None:
+        return None
+    return shard_for_user(user_id)
+
+
+def current_pool(user_id=None):
+    """The writable pool get_db(user_id) would hand a connection from"""
+    index = _shard_index(user_id)
+    return get_pool() if index is None else _shard_pools[index]
+
+
+def get_directory_db():
+    """
+    Get the request's connection to the global database.
+
+    This is where the users table lives; without sharding it is the same
+    connection get_db() returns.
+    """
+    if not has_app_context():
+        raise RuntimeError("get_directory_db() needs an app context; use connection() instead")
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+
+def get_db(user_id=None):
+    """
+    Get the connection for the current request.
+
+    The first call in a request checks a connection out of the pool; later calls
+    in the same request (from routes and helpers alike) get the same one back.
+    With sharding enabled it is the connection to the shard holding user_id
+    (by default the logged-in user); with no user it is the global database.
+    """
+    if not has_app_context():
+        raise RuntimeError("get_db() needs an app context; use connection() instead")
+    index = _shard_index(user_id)
+    if index is None:
+        return get_directory_db()
+    shard_dbs = g.setdefault('shard_dbs', {})
+    if index not in shard_dbs:
+        shard_dbs[index] = _shard_pools[index].acquire()
+    return shard_dbs[index]
+
+
+@contextmanager
+def user_context(app, user_id):
+    """
+    App context for work on one user's data outside a request (background
+    threads), so get_db(), get_read_db() and run_write() go to that user's
+    database. Connections go back to the pools when the block ends.
+    """
+    with app.app_context():
+        g.background_user_id = user_id
+        yield
+
+
+@contextmanager
+def connection():
+    """
+    Yield a pooled connection to the global database.
+
+    Inside a request this is the request's connection; elsewhere (start-up code,
+    scripts, background threads) a connection is checked out just for the block.
+    """
+    if has_app_context():
+        yield get_directory_db()
+    else:
+        with get_pool().connection() as conn:
+            yield conn
+
+
+def get_read_pool():
+    """Return the read-only analytics pool for the global database"""
+    if _read_pool is None:
+        raise RuntimeError("database.init_app() has not been called")
+    return _read_pool
+
+
+def _begin_read(pool):
+    conn = pool.acquire()
+    conn.execute("BEGIN")
+    return conn
+
+
+def get_read_db(user_id=None):
+    """
+    Get the read-only analytics connection for the current request.
+
+    The connection is opened with mode=ro and a read transaction is started on
+    checkout, so every query the request makes sees the same WAL snapshot.
+    Writes through it fail; use get_db() or run_write() for those. Like get_db(),
+    it follows the user's shard when sharding is enabled.
+    """
+    if not has_app_context():
+        raise RuntimeError("get_read_db() needs an app context")
+    index = _shard_index(user_id)
+    if index is None:
+        if 'read_db' not in g:
+            g.read_db = _begin_read(get_read_pool())
+        return g.read_db
+    shard_read_dbs = g.setdefault('shard_read_dbs', {})
+    if index not in shard_read_dbs:
+        shard_read_dbs[index] = _begin_read(_shard_read_pools[index])
+    return shard_read_dbs[index]
+
+
+def close_db(exception=None):
+    """Teardown handler that returns the request's connections to their pools"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(conn)
+    read_conn = g.pop('read_db', None)
+    if read_conn is not None:
+        # release() ends the read transaction
+        get_read_pool().release(read_conn)
+    for index, shard_conn in g.pop('shard_dbs', {}).items():
+        _shard_pools[index].release(shard_conn)
+    for index, shard_conn in g.pop('shard_read_dbs', {}).items():
+        _shard_read_pools[index].release(shard_conn)
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations for the DeepFlow database.
+
+Every schema change lives here as an ordered, idempotent migration step. The
+schema_version table records which steps have been applied, so migrate() runs
+each step exactly once per database: at application start-up, or from the
+command line with
+
+    python3 migrations.py [path/to/Deepflow.db]
+
+Request handlers never issue DDL themselves.
+"""
+import os
+import sys
+import sqlite3
+import logging
+
+from timeutils import SQL_NOW_MS
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.environ.get('DEEPFLOW_DB_PATH',
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Deepflow.db'))
+
+
+def _column_names(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in cursor.fetchall()}
+
+
+def _add_column_if_missing(cursor, table, column, definition):
+    """ALTER TABLE ... ADD COLUMN, skipped when the column already exists"""
+    if column not in _column_names(cursor, table):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def create_base_tables(cursor):
+    """Create every application table in its original form (later steps alter them)"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            country TEXT DEFAULT 'AU',
+            state_province TEXT DEFAULT NULL
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS timers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            duration INTEGER NOT NULL, -- Duration in seconds
+            start_time TEXT DEFAULT NULL,
+            end_time TEXT DEFAULT NULL,
+            paused_at TEXT DEFAULT NULL,
+            elapsed_time INTEGER DEFAULT 0, -- Time elapsed before pause (in milliseconds)
+            is_running INTEGER NOT NULL DEFAULT 0, -- 0: stopped, 1: running, 2: paused
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+
+    # Task queue for the Flow Shelf
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS flow_shelf (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            task_text TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            completed BOOLEAN NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+
+    # Energy check-ins logged around timer sessions
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS energy_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            timer_id INTEGER NOT NULL,
+            stage TEXT NOT NULL,  -- 'start', 'mid' or 'end'
+            energy_level INTEGER NOT NULL,  -- 1-10
+            timestamp TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (timer_id) REFERENCES timers (id)
+        )
+    """)
+
+    # Detailed energy insights
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS energy_insights (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            overall_energy INTEGER NOT NULL,  -- 1-10
+            motivation_level INTEGER NOT NULL,  -- 1-10
+            focus_clarity INTEGER NOT NULL,  -- 1-10
+            physical_energy INTEGER NOT NULL,  -- 1-10
+            mood_state TEXT NOT NULL,  -- happy, calm, stressed, anxious, excited, etc.
+            energy_source TEXT,  -- what's contributing to current energy
+            energy_drains TEXT,  -- what's draining energy
+            notes TEXT,  -- additional user notes
+            timestamp TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_preferences (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE NOT NULL,
+            enable_start_checkin BOOLEAN DEFAULT 1,
+            enable_mid_checkin BOOLEAN DEFAULT 1,
+            enable_end_checkin BOOLEAN DEFAULT 1,
+            enable_energy_log BOOLEAN DEFAULT 1,
+            enable_sound BOOLEAN DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+
+
+def add_legacy_columns(cursor):
+    """Bring databases created by older versions of the app up to the current columns"""
+    _add_column_if_missing(cursor, "users", "country", "TEXT DEFAULT 'AU'")
+    _add_column_if_missing(cursor, "users", "state_province", "TEXT DEFAULT NULL")
+    # Older timers tables declared is_running as BOOLEAN; its NUMERIC affinity already
+    # stores the paused state (2), so only the missing columns need adding
+    _add_column_if_missing(cursor, "timers", "paused_at", "TEXT DEFAULT NULL")
+    _add_column_if_missing(cursor, "timers", "elapsed_time", "INTEGER DEFAULT 0")
+    _add_column_if_missing(cursor, "user_preferences", "enable_start_checkin", "BOOLEAN DEFAULT 1")
+    _add_column_if_missing(cursor, "user_preferences", "enable_mid_checkin", "BOOLEAN DEFAULT 1")
+    _add_column_if_missing(cursor, "user_preferences", "enable_end_checkin", "BOOLEAN DEFAULT 1")
+
+
+# Secondary indexes, one per hot access path (checked by tests/test_query_plans.py)
+SCHEMA_INDEXES = [
+    # dashboard and export_user_data: a user's timers
+    "CREATE INDEX IF NOT EXISTS idx_timers_user ON timers (user_id)",
+    # Served the SQL count of a user's end check-ins per period; rate_limiter.py counts them in
+    # memory now, and step 10 replaces this with idx_energy_logs_end_time for its start-up load
+    """CREATE INDEX IF NOT EXISTS idx_energy_logs_user_stage_time
+       ON energy_logs (user_id, stage, timestamp, timer_id)""",
+    # get_weekly_insights / get_monthly_insights / get_energy_logs: a user's logs by time
+    """CREATE INDEX IF NOT EXISTS idx_energy_logs_user_time
+       ON energy_logs (user_id, timestamp, energy_level)""",
+    # get_energy_insights / get_energy_logs: a user's insights, newest first
+    "CREATE INDEX IF NOT EXISTS idx_energy_insights_user_time ON energy_insights (user_id, timestamp)",
+    # get_shelf_items: a user's shelf ordered by created_at
+    "CREATE INDEX IF NOT EXISTS idx_flow_shelf_user_created ON flow_shelf (user_id, created_at)",
+]
+
+
+def create_indexes(cursor):
+    """Create the secondary indexes for the per-user hot queries"""
+    for statement in SCHEMA_INDEXES:
+        cursor.execute(statement)
+
+
+def _local_text_to_ms(column):
+    """SQL converting a 'YYYY-MM-DD HH:MM:SS' server-local-time column to epoch milliseconds"""
+    return (f"CASE WHEN typeof({column}) = 'text' "
+            f"THEN CAST(strftime('%s', {column}, 'utc') AS INTEGER) * 1000 ELSE {column} END")
+
+
+def _utc_text_to_ms(column):
+    """SQL converting a 'YYYY-MM-DD HH:MM:SS' UTC column (CURRENT_TIMESTAMP) to epoch milliseconds"""
+    return (f"CASE WHEN typeof({column}) = 'text' "
+            f"THEN CAST(strftime('%s', {column}) AS INTEGER) * 1000 ELSE {column} END")
+
+
+def convert_timestamps_to_epoch_ms(cursor):
+    """
+    Store timer instants and energy timestamps as INTEGER UTC epoch milliseconds.
+
+    SQLite can't change a column's type, so each table is rebuilt and its rows
+    converted on the way across. Timer times were written with
+    datetime('now', 'localtime'); energy timestamps with CURRENT_TIMESTAMP (UTC).
+    """
+    cursor.execute("""
+        CREATE TABLE timers_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            duration INTEGER NOT NULL, -- Duration in seconds
+            start_time INTEGER DEFAULT NULL, -- Epoch ms the current run (re)started
+            end_time INTEGER DEFAULT NULL, -- Epoch ms the last run stopped
+            paused_at INTEGER DEFAULT NULL, -- Epoch ms the timer was paused
+            elapsed_time INTEGER DEFAULT 0, -- Time elapsed before pause (in milliseconds)
+            is_running INTEGER NOT NULL DEFAULT 0, -- 0: stopped, 1: running, 2: paused
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+    cursor.execute(f"""
+        INSERT INTO timers_new (id, user_id, name, duration, start_time, end_time,
+                                paused_at, elapsed_time, is_running)
+        SELECT id, user_id, name, duration, {_local_text_to_ms('start_time')},
+               {_local_text_to_ms('end_time')}, {_local_text_to_ms('paused_at')},
+               COALESCE(elapsed_time, 0), is_running
+        FROM timers
+    """)
+
+    cursor.execute(f"""
+        CREATE TABLE energy_logs_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            timer_id INTEGER NOT NULL,
+            stage TEXT NOT NULL,  -- 'start', 'mid' or 'end'
+            energy_level INTEGER NOT NULL,  -- 1-10
+            timestamp INTEGER NOT NULL DEFAULT {SQL_NOW_MS},  -- Epoch ms
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (timer_id) REFERENCES timers (id)
+        )
+    """)
+    cursor.execute(f"""
+        INSERT INTO energy_logs_new (id, user_id, timer_id, stage, energy_level, timestamp)
+        SELECT id, user_id, timer_id, stage, energy_level, {_utc_text_to_ms('timestamp')}
+        FROM energy_logs
+    """)
+
+    cursor.execute(f"""
+        CREATE TABLE energy_insights_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            overall_energy INTEGER NOT NULL,  -- 1-10
+            motivation_level INTEGER NOT NULL,  -- 1-10
+            focus_clarity INTEGER NOT NULL,  -- 1-10
+            physical_energy INTEGER NOT NULL,  -- 1-10
+            mood_state TEXT NOT NULL,  -- happy, calm, stressed, anxious, excited, etc.
+            energy_source TEXT,  -- what's contributing to current energy
+            energy_drains TEXT,  -- what's draining energy
+            notes TEXT,  -- additional user notes
+            timestamp INTEGER NOT NULL DEFAULT {SQL_NOW_MS},  -- Epoch ms
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+    cursor.execute(f"""
+        INSERT INTO energy_insights_new (id, user_id, overall_energy, motivation_level, focus_clarity,
+                                         physical_energy, mood_state, energy_source, energy_drains,
+                                         notes, timestamp)
+        SELECT id, user_id, overall_energy, motivation_level, focus_clarity, physical_energy,
+               mood_state, energy_source, energy_drains, notes, {_utc_text_to_ms('timestamp')}
+        FROM energy_insights
+    """)
+
+    for table in ("timers", "energy_logs", "energy_insights"):
+        cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+    # Dropping the old tables dropped their indexes too
+    create_indexes(cursor)
+
+
+def create_energy_daily_rollups(cursor):
+    """Per-user, per-day aggregates of energy check-ins compacted by retention.py"""
+    # day is the user's own calendar date in their timezone, the same days the insight routes group by
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS energy_daily_rollups (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            checkin_count INTEGER NOT NULL,
+            energy_sum INTEGER NOT NULL,
+            energy_min INTEGER NOT NULL,
+            energy_max INTEGER NOT NULL,
+            start_count INTEGER NOT NULL DEFAULT 0,
+            start_sum INTEGER NOT NULL DEFAULT 0,
+            mid_count INTEGER NOT NULL DEFAULT 0,
+            mid_sum INTEGER NOT NULL DEFAULT 0,
+            end_count INTEGER NOT NULL DEFAULT 0,
+            end_sum INTEGER NOT NULL DEFAULT 0,
+            first_timestamp INTEGER NOT NULL,
+            last_timestamp INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    """)
+
+
+def create_timer_sessions(cursor):
+    """Append-only history of completed timer runs, plus the per-run bookkeeping on timers"""
+    # When the current run began (start_time moves on every resume) and how often it was paused
+    _add_column_if_missing(cursor, "timers", "run_started_at", "INTEGER")
+    _add_column_if_missing(cursor, "timers", "pause_count", "INTEGER NOT NULL DEFAULT 0")
+
+    # One row per run, written when the timer is stopped; timer_id is kept even after the timer is deleted
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS timer_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            timer_id INTEGER NOT NULL,
+            started_at INTEGER NOT NULL,
+            ended_at INTEGER NOT NULL,
+            focused_ms INTEGER NOT NULL,
+            pause_count INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_timer_sessions_user_ended
+        ON timer_sessions (user_id, ended_at)
+    """)
+
+
+def add_session_epochs(cursor):
+    """Per-user session epoch, bumped on every login, and the epoch each timer was started under"""
+    _add_column_if_missing(cursor, "users", "session_epoch", "INTEGER NOT NULL DEFAULT 0")
+    _add_column_if_missing(cursor, "timers", "epoch", "INTEGER NOT NULL DEFAULT 0")
+
+
+def add_timer_versions(cursor):
+    """Version counter on timers and the results of idempotent timer commands"""
+    _add_column_if_missing(cursor, "timers", "version", "INTEGER NOT NULL DEFAULT 0")
+
+    # The first result of each command sent with an idempotency key, so a retry can be answered with it
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS timer_commands (
+            user_id INTEGER NOT NULL,
+            idempotency_key TEXT NOT NULL,
+            timer_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            result TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            PRIMARY KEY (user_id, idempotency_key)
+        ) WITHOUT ROWID
+    """)
+
+
+def add_preference_versions(cursor):
+    """Version counter on user preferences, bumped on every save (the ETag of /get_user_preferences)"""
+    _add_column_if_missing(cursor, "user_preferences", "version", "INTEGER NOT NULL DEFAULT 1")
+
+
+def index_recent_end_checkins(cursor):
+    """
+    Index every user's end check-ins by time for rate_limiter.py's start-up load
+    (repositories.RECENT_END_CHECKINS_SQL), in place of the per-user index the
+    SQL rate-limit count used
+    """
+    cursor.execute("DROP INDEX IF EXISTS idx_energy_logs_user_stage_time")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_energy_logs_end_time
+        ON energy_logs (timestamp, user_id, timer_id) WHERE stage = 'end'
+    """)
+
+
+# Ordered migration steps: (version, description, function taking a cursor).
+# Append new steps at the end; never edit or reorder a step once released.
+MIGRATIONS = [
+    (1, "create base tables", create_base_tables),
+    (2, "add columns missing from older databases", add_legacy_columns),
+    (3, "add indexes for hot queries", create_indexes),
+    (4, "store timer and energy timestamps as epoch milliseconds", convert_timestamps_to_epoch_ms),
+    (5, "add daily energy roll-ups", create_energy_daily_rollups),
+    (6, "add timer session history", create_timer_sessions),
+    (7, "add session epochs", add_session_epochs),
+    (8, "add timer versions and idempotent commands", add_timer_versions),
+    (9, "add preference versions", add_preference_versions),
+    (10, "index recent end check-ins", index_recent_end_checkins),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    """Return the highest migration version applied to the database (0 if none)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn):
+    """
+    Apply every pending migration to the database, one transaction per step.
+
+    Safe to call from several processes at once: each step takes the write lock
+    and re-checks the version before running.
+
+    Returns the schema version after migrating.
+    """
+    # auto_vacuum can only be chosen before the first table exists; retention.py frees
+    # space incrementally, and older databases are switched over once by hand (see there)
+    if conn.execute("SELECT 1 FROM sqlite_master").fetchone() is None:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+    version = current_version(conn)
+    conn.commit()
+
+    for step_version, description, step in MIGRATIONS:
+        if step_version <= version:
+            continue
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            # Another process may have applied this step while we waited for the lock
+            if current_version(conn) >= step_version:
+                conn.rollback()
+                continue
+            step(cursor)
+            cursor.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                           (step_version, description))
+            conn.commit()
+            logger.info("Applied migration %d: %s", step_version, description)
+        except sqlite3.Error:
+            conn.rollback()
+            logger.error("Migration %d (%s) failed", step_version, description)
+            raise
+        version = step_version
+
+    return version
+
+
+def migrate_database(db_path=DB_PATH):
+    """Open db_path, apply pending migrations and return the resulting version"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return migrate(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    target = sys.argv[1] if len(sys.argv) > 1 else DB_PATH
+    try:
+        new_version = migrate_database(target)
+        print(f"✅ {target} is at schema version {new_version}.")
+    except sqlite3.Error as e:
+        print(f"❌ Migration failed: {e}")
+        sys.exit(1)
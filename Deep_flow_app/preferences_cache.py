@@ -0,0 +1,119 @@
+"""
+Cache of user preferences for DeepFlow.
+
+The check-in routes consult a user's preferences on every request, and the
+dashboard, settings page and energy chart fetch /get_user_preferences on every
+load and chart reload. This cache keeps the preferences of the most recently
+active users in a bounded LRU, so those reads are a dict lookup instead of a
+query.
+
+Every save goes through CachedPreferencesRepository, which replaces the cached
+entry with what it saved once it has committed; deleting a user's preferences
+drops it. Each entry carries the preferences' version, which the route uses as
+the ETag of /get_user_preferences.
+
+The cache lives in this process. The app runs as a single process; set
+DEEPFLOW_PREFERENCES_CACHE=0 when several processes write to the same database.
+"""
+import os
+import threading
+import logging
+from collections import OrderedDict
+
+from repositories import DEFAULT_PREFERENCES, PreferencesRepository, StoredPreferences
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_USERS = 10000
+
+
+class PreferencesCache:
+    """user_id -> StoredPreferences for the most recently used users, safe to share between request threads"""
+
+    def __init__(self, max_users=DEFAULT_MAX_USERS):
+        self.max_users = max_users
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """The cached StoredPreferences of the user, or None if they aren't cached"""
+        with self._lock:
+            stored = self._entries.get(user_id)
+            if stored is not None:
+                self._entries.move_to_end(user_id)
+            return stored
+
+    def put(self, user_id, stored):
+        """Cache a user's StoredPreferences, unless a newer version is cached already"""
+        with self._lock:
+            cached = self._entries.get(user_id)
+            if cached is not None and cached.version > stored.version:
+                return
+            self._entries[user_id] = stored
+            self._entries.move_to_end(user_id)
+            if len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CachedPreferencesRepository(PreferencesRepository):
+    """Wraps another PreferencesRepository and answers reads from the cache"""
+
+    def __init__(self, inner, cache):
+        self.inner = inner
+        self.cache = cache
+
+    def get_or_create(self, user_id):
+        stored = self.cache.get(user_id)
+        if stored is None:
+            stored = self.inner.get_or_create(user_id)
+            self.cache.put(user_id, stored)
+        # Callers get their own dict, so they can't change the cached one
+        return StoredPreferences(dict(stored.preferences), stored.version)
+
+    def save(self, user_id, preferences):
+        try:
+            version = self.inner.save(user_id, preferences)
+        except Exception:
+            self.cache.discard(user_id)
+            raise
+        self.cache.put(user_id, StoredPreferences({name: bool(preferences[name]) for name in DEFAULT_PREFERENCES},
+                                                  version))
+        return version
+
+    def delete_for_user(self, user_id):
+        try:
+            self.inner.delete_for_user(user_id)
+        finally:
+            self.cache.discard(user_id)
+
+
+_cache = None
+
+
+def init_app(app, repos, enabled=None, max_users=DEFAULT_MAX_USERS):
+    """
+    Put the preferences cache in front of repos.preferences unless
+    DEEPFLOW_PREFERENCES_CACHE=0 (or enabled=False)
+    """
+    global _cache
+    if enabled is None:
+        enabled = os.environ.get('DEEPFLOW_PREFERENCES_CACHE', '1') == '1'
+    if not enabled:
+        return None
+    _cache = PreferencesCache(max_users)
+    repos.preferences = CachedPreferencesRepository(repos.preferences, _cache)
+    app.extensions['deepflow_preferences_cache'] = _cache
+    logger.info("Preferences cache enabled (up to %d users)", max_users)
+    return _cache
+
+
+def get_cache():
+    """Return the preferences cache, or None if it is disabled"""
+    return _cache
@@ -0,0 +1,121 @@
+"""
+Energy check-in rate limit for DeepFlow.
+
+A user may log DAILY_LIMIT end check-ins per period; once they have, every
+check-in is refused until the period rolls over at RESET_HOUR (6:00 AM) in the
+user's own timezone.
+
+Instead of counting energy_logs rows on every check, the limiter keeps each
+user's end check-ins of the last WINDOW_MS (the current period in any timezone
+started less than that long ago) in memory: loaded from the database once at
+start-up, through an index of recent end check-ins, and appended to by the
+routes after every insert. That is at most a
+handful of entries per user, since the limit refuses more, so a status check is
+a lookup and a short loop. Periods are cut in the user's timezone as the
+timezone service (timezones.py) resolves it.
+
+A check-in holds its user's lock (checking_in()) from the limit check until it
+has been recorded, so two check-ins sent at once cannot both take the last
+slot.
+
+Like the timer cache, the counts live in this process.
+"""
+import threading
+import logging
+from datetime import datetime, timedelta
+
+from timeutils import now_ms, to_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+DAILY_LIMIT = 5
+RESET_HOUR = 6  # Local hour at which a new period starts
+# End check-ins kept per user. A period runs from one 6 AM rollover to the next, 25 hours at
+# most (on the day clocks go back), so the earliest rollover still in force is within this
+WINDOW_MS = 25 * 60 * 60 * 1000
+LOCK_STRIPES = 64
+
+
+def period_bounds(now, tz, reset_hour=RESET_HOUR):
+    """(start, end) of the period containing epoch-ms `now`, as aware datetimes in tz"""
+    local = datetime.fromtimestamp(now / 1000, tz)
+    start = local.replace(hour=reset_hour, minute=0, second=0, microsecond=0)
+    if local.hour < reset_hour:
+        start -= timedelta(days=1)
+    return start, start + timedelta(days=1)
+
+
+class CheckinRateLimiter:
+    """Per-user end check-ins of the recent past, and the period each user is in"""
+
+    def __init__(self, user_timezone, limit=DAILY_LIMIT):
+        self.user_timezone = user_timezone  # user_id -> tzinfo
+        self.limit = limit
+        self._checkins = {}  # user_id -> [(timestamp, int timer_id)] of end check-ins within WINDOW_MS
+        self._lock = threading.Lock()
+        self._stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def checking_in(self, user_id):
+        """Lock to hold from checking a user's limit until their check-in is recorded"""
+        return self._stripes[user_id % LOCK_STRIPES]
+
+    def load(self, checkins):
+        """Start from (user_id, timer_id, timestamp) end check-ins read from the database"""
+        cutoff = now_ms() - WINDOW_MS
+        loaded = {}
+        for user_id, timer_id, timestamp in checkins:
+            if timestamp >= cutoff:
+                loaded.setdefault(user_id, []).append((timestamp, int(timer_id)))
+        with self._lock:
+            self._checkins = loaded
+        logger.info("Rate limiter loaded recent end check-ins of %d users", len(loaded))
+
+    def record(self, user_id, timer_id, timestamp):
+        """Count an end check-in once it has been stored"""
+        cutoff = now_ms() - WINDOW_MS
+        if timestamp < cutoff:
+            return
+        with self._lock:
+            recent = [entry for entry in self._checkins.get(user_id, ()) if entry[0] >= cutoff]
+            recent.append((timestamp, int(timer_id)))
+            self._checkins[user_id] = recent
+
+    def status(self, user_id, exclude_timer_id=None, now=None):
+        """
+        (end check-ins in the user's current period, local end of the period),
+        optionally not counting one timer's check-ins
+        """
+        now = now if now is not None else now_ms()
+        if exclude_timer_id is not None:
+            exclude_timer_id = int(exclude_timer_id)  # Entries hold int ids
+        start, end = period_bounds(now, self.user_timezone(user_id))
+        start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+        count = sum(1 for timestamp, timer_id in self._checkins.get(user_id, ())
+                    if start_ms <= timestamp < end_ms
+                    and not (exclude_timer_id is not None and timer_id == exclude_timer_id))
+        return count, end
+
+    def forget(self, user_id):
+        with self._lock:
+            self._checkins.pop(user_id, None)
+
+
+_limiter = None
+
+
+def init_app(app, repos, user_timezone):
+    """Create the limiter and load the last two days of end check-ins from every database"""
+    global _limiter
+    _limiter = CheckinRateLimiter(user_timezone)
+    try:
+        _limiter.load(repos.energy.recent_end_checkins(now_ms() - WINDOW_MS))
+    except Exception as e:
+        # Start empty rather than not at all; the limit then only counts new check-ins
+        logger.error("Error loading recent check-ins for the rate limiter: %s", str(e))
+    app.extensions['deepflow_rate_limiter'] = _limiter
+    return _limiter
+
+
+def get_limiter():
+    """Return the process-wide check-in rate limiter"""
+    return _limiter
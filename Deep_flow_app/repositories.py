@@ -0,0 +1,1441 @@
+"""
+Storage interfaces for DeepFlow and their SQLite and in-memory backends.
+
+Routes talk to five repositories (users, timers, energy, shelf and
+preferences) and never issue SQL themselves. The SQLite backend is the real
+one and goes through database.py and write_queue.py, so sharding, the
+read-only analytics path and the optional writer thread all keep working.
+The in-memory backend holds everything in Python dicts; it is meant for quick
+test and benchmark runs, and as a baseline for measuring how much time each
+endpoint spends in SQLite.
+
+Pick the backend with DEEPFLOW_STORAGE=sqlite (default) or memory.
+"""
+import os
+import sqlite3
+import threading
+import logging
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import database
+from database import get_db, get_directory_db, get_read_db
+from timer_state import (RUNNING, STOPPED, TIMER_COLUMNS, TRANSITIONS, IDEMPOTENCY_KEY_TTL_MS, IllegalTransition,
+                         IdempotencyKeyReused, TimerStateMachine, as_of_epoch, stale)
+from timeutils import now_ms
+from write_queue import run_write
+
+logger = logging.getLogger(__name__)
+
+# Backends report failures as sqlite3.Error (or a subclass), so routes have one type to catch
+StorageError = sqlite3.Error
+
+User = namedtuple('User', 'id username password country state_province')
+
+# Same column order as the timers table; dashboard.html reads timers by position
+Timer = namedtuple('Timer', 'id user_id name duration start_time end_time paused_at is_running elapsed_time epoch '
+                             'version')
+
+# The Timer a client command left behind, and whether it is the stored result of an earlier try
+CommandResult = namedtuple('CommandResult', 'timer replayed')
+
+ShelfItem = namedtuple('ShelfItem', 'id task_text created_at completed')
+
+CheckIn = namedtuple('CheckIn', 'id timestamp energy_level timer_name stage')
+
+DailyRollup = namedtuple('DailyRollup', 'day energy_sum checkin_count energy_min energy_max')
+
+# The readings (check-ins and insights) in one time bucket: how many, and the lowest and highest with their timestamps
+EnergyBucket = namedtuple('EnergyBucket', 'bucket readings low_timestamp low high_timestamp high')
+
+# period is the user-local date of the day, or of the Monday starting the week, as labelled by local_periods()
+FocusTotal = namedtuple('FocusTotal', 'period focused_ms session_count')
+
+FOCUS_PERIODS = ("day", "week")
+
+DEFAULT_PREFERENCES = {
+    "enable_start_checkin": True,
+    "enable_mid_checkin": True,
+    "enable_end_checkin": True,
+    "enable_energy_log": True,
+    "enable_sound": False
+}
+
+# Timer action a check-in at this stage triggers
+CHECKIN_TIMER_ACTIONS = {"start": "start", "end": "stop"}
+
+# A user's preferences dict and its version, which every save bumps
+StoredPreferences = namedtuple('StoredPreferences', 'preferences version')
+
+# Preference that turns check-ins at this stage on or off
+CHECKIN_PREFERENCES = {stage: f"enable_{stage}_checkin" for stage in ("start", "mid", "end")}
+
+# What record_checkin did. outcome is "logged", "not_found" (not the user's timer) or "disabled" (the
+# stage is turned off in their preferences); timer is the Timer the check-in started or stopped, if any
+LoggedCheckin = namedtuple('LoggedCheckin', 'outcome timestamp timer')
+
+
+def _period_of(periods, end_ms, ms):
+    """Label of the (label, start epoch ms) period an epoch-ms instant falls in, or None outside them all"""
+    if not periods[0][1] <= ms < end_ms:
+        return None
+    return periods[bisect_right([start for _, start in periods], ms) - 1][0]
+
+
+# Interfaces
+
+class UserRepository(ABC):
+    """Accounts: credentials and location"""
+
+    @abstractmethod
+    def get(self, user_id):
+        """The User with this id, or None"""
+
+    @abstractmethod
+    def get_by_username(self, username):
+        """The User with this username, or None"""
+
+    @abstractmethod
+    def username_taken(self, username, exclude_user_id=None):
+        """True if another account already uses username"""
+
+    @abstractmethod
+    def create(self, username, password_hash):
+        """Create an account and return its id"""
+
+    @abstractmethod
+    def count(self):
+        """Number of accounts"""
+
+    @abstractmethod
+    def list_usernames(self):
+        """Every username"""
+
+    @abstractmethod
+    def update_username(self, user_id, username):
+        """Rename an account"""
+
+    @abstractmethod
+    def update_password(self, user_id, password_hash):
+        """Replace an account's password hash"""
+
+    @abstractmethod
+    def update_location(self, user_id, country, state_province):
+        """Set the country and state used for the user's timezone"""
+
+    @abstractmethod
+    def session_epoch(self, user_id):
+        """The user's current session epoch (see timer_state.py)"""
+
+    @abstractmethod
+    def start_session(self, user_id):
+        """Bump the user's session epoch on login and return the new one"""
+
+    @abstractmethod
+    def delete(self, user_id):
+        """Delete an account (its data is removed through the other repositories)"""
+
+
+class TimerRepository(ABC):
+    """
+    Timers and their running state. Reads and transitions take the user's
+    session epoch; timers left running or paused from an earlier session are
+    treated as stopped (see timer_state.py). Without an epoch rows are taken
+    as stored.
+    """
+
+    @abstractmethod
+    def list_for_user(self, user_id, epoch=None):
+        """The user's Timers"""
+
+    @abstractmethod
+    def get(self, user_id, timer_id, epoch=None):
+        """The user's Timer with this id, or None"""
+
+    def state(self, user_id, timer_id, epoch=None):
+        """
+        What /get_timer_state needs: an object with id, name, duration,
+        elapsed_time, is_running and start_time, or None. Defaults to get().
+        """
+        return self.get(user_id, timer_id, epoch)
+
+    @abstractmethod
+    def create(self, user_id, name, duration_seconds):
+        """Create a stopped timer and return its id"""
+
+    @abstractmethod
+    def delete(self, user_id, timer_id):
+        """Delete one of the user's timers"""
+
+    @abstractmethod
+    def transition(self, user_id, timer_id, action, now=None, epoch=None):
+        """
+        Apply start/pause/resume/stop/expire; returns the updated Timer, or None if it isn't the user's.
+
+        Raises IllegalTransition if the timer's state does not allow the action.
+        A start stamps the timer with epoch.
+        """
+
+    @abstractmethod
+    def command(self, user_id, timer_id, action, epoch=None, expected_version=None, idempotency_key=None):
+        """
+        A transition requested by a client; returns a CommandResult, or None if the timer isn't the user's.
+
+        A repeated idempotency key returns the first result without applying
+        anything. Raises IllegalTransition, VersionConflict if the timer is not
+        at expected_version, or IdempotencyKeyReused.
+        """
+
+    @abstractmethod
+    def list_running(self):
+        """Every running Timer, across all users"""
+
+    @abstractmethod
+    def count_all(self):
+        """Number of timers across all users"""
+
+    @abstractmethod
+    def export(self, user_id):
+        """The user's timer rows as dicts"""
+
+    @abstractmethod
+    def focus_totals(self, user_id, periods, end_ms):
+        """
+        FocusTotals of the runs that ended in each of the (label, start epoch ms)
+        periods, which run until the next one's start (the last until end_ms), as
+        timeutils.local_periods() gives them for the user's days or weeks
+        """
+
+    @abstractmethod
+    def export_sessions(self, user_id):
+        """The user's timer_sessions rows as dicts"""
+
+    @abstractmethod
+    def delete_for_user(self, user_id):
+        """Delete all of the user's timers and their session history"""
+
+
+class EnergyRepository(ABC):
+    """Energy check-ins, detailed insights and their daily roll-ups"""
+
+    @abstractmethod
+    def record_checkin(self, user_id, timer_id, stage, energy_level, epoch=None):
+        """
+        Record a check-in (and its chart insight) and start/stop the timer for
+        'start'/'end' stages, as of the user's session epoch, in one transaction
+        that first checks the timer is the user's and the stage is enabled in
+        their preferences. Returns a LoggedCheckin.
+        """
+
+    @abstractmethod
+    def record_checkins(self, user_id, checkins):
+        """
+        Record a batch of check-in dicts (timer_id, stage, energy_level, timestamp;
+        ids are ints, as validated by the route) in one transaction, without driving timers. Returns a bool per item: False
+        where the timer isn't the user's.
+        """
+
+    @abstractmethod
+    def recent_end_checkins(self, since_ms):
+        """(user_id, timer_id, timestamp) of every end-stage check-in since an instant, across all users"""
+
+    @abstractmethod
+    def checkins_with_timer_names(self, user_id, start_ms, end_ms, before=None, limit=None):
+        """
+        The user's CheckIns between two instants joined with their timer's name,
+        newest first: only those before the (timestamp, id) `before`, and at
+        most `limit` of them, when given
+        """
+
+    @abstractmethod
+    def insight_levels(self, user_id, start_ms, end_ms, before=None, limit=None):
+        """
+        (id, timestamp, overall_energy) of the user's insights between two
+        instants, newest first, bounded like checkins_with_timer_names
+        """
+
+    @abstractmethod
+    def daily_rollups(self, user_id, first_day, last_day, limit=None):
+        """The user's DailyRollups of compacted check-ins between two days, newest first"""
+
+    @abstractmethod
+    def energy_level_span(self, user_id, start_ms, end_ms):
+        """
+        (first timestamp, last timestamp, count) of the user's check-ins and
+        insights between two instants; the timestamps are None if there are none.
+        Check-ins whose timer was deleted are left out, as in energy_level_extremes
+        """
+
+    @abstractmethod
+    def energy_level_extremes(self, user_id, start_ms, end_ms, bucket_ms):
+        """
+        EnergyBuckets of the user's check-ins and insights between two instants,
+        split into buckets of bucket_ms counted from start_ms, in bucket order
+        """
+
+    @abstractmethod
+    def daily_totals(self, user_id, days, end_ms):
+        """
+        (date, energy_sum, check-in count) per day with check-ins, from raw check-ins
+        and roll-ups, for (label, start epoch ms) days like focus_totals' periods
+        """
+
+    @abstractmethod
+    def latest_insights(self, user_id, limit):
+        """The user's most recent insight rows as dicts, newest first"""
+
+    @abstractmethod
+    def save_insight(self, user_id, overall_energy, motivation_level, focus_clarity, physical_energy,
+                     mood_state, energy_source, energy_drains, notes):
+        """Store a detailed energy insight"""
+
+    @abstractmethod
+    def export(self, user_id):
+        """Dict of energy_logs, energy_insights and energy_daily_rollups rows as dicts"""
+
+    @abstractmethod
+    def delete_for_user(self, user_id):
+        """Delete all of the user's energy data"""
+
+
+class ShelfRepository(ABC):
+    """Flow Shelf items"""
+
+    @abstractmethod
+    def add(self, user_id, text):
+        """Add an item and return its id"""
+
+    @abstractmethod
+    def remove(self, user_id, item_id=None, text=None):
+        """Remove an item by id, or every item with this text"""
+
+    @abstractmethod
+    def list_for_user(self, user_id):
+        """The user's ShelfItems, newest first"""
+
+    @abstractmethod
+    def count_all(self):
+        """Number of shelf items across all users"""
+
+    @abstractmethod
+    def export(self, user_id):
+        """The user's shelf rows as dicts"""
+
+    @abstractmethod
+    def delete_for_user(self, user_id):
+        """Delete all of the user's shelf items"""
+
+
+class PreferencesRepository(ABC):
+    """Per-user feature toggles"""
+
+    @abstractmethod
+    def get_or_create(self, user_id):
+        """The user's StoredPreferences, storing the defaults first if they have none"""
+
+    @abstractmethod
+    def save(self, user_id, preferences):
+        """Store a full preferences dict; returns its new version"""
+
+    @abstractmethod
+    def delete_for_user(self, user_id):
+        """Delete the user's preferences"""
+
+
+class Repositories:
+    """The set of repositories the routes use"""
+
+    def __init__(self, users, timers, energy, shelf, preferences):
+        self.users = users
+        self.timers = timers
+        self.energy = energy
+        self.shelf = shelf
+        self.preferences = preferences
+
+
+# SQLite backend
+
+def _fetch_timer(cursor, user_id, timer_id, epoch=None):
+    cursor.execute(f"""
+        SELECT {TIMER_COLUMNS} FROM timers
+        WHERE id = ? AND user_id = ?
+    """, (timer_id, user_id))
+    row = cursor.fetchone()
+    return as_of_epoch(Timer._make(row), epoch) if row else None
+
+
+def _period_sql(column, periods, end_ms):
+    """
+    (SQL CASE, parameters) giving the label of the (label, start epoch ms) period an
+    epoch-ms column falls in. Periods are cut in the user's timezone by the caller, so
+    SQLite's server-local 'localtime' never decides which day a row belongs to.
+    """
+    ends = [start for _, start in periods[1:]] + [end_ms]
+    params = []
+    for (label, _), end in zip(periods, ends):
+        params += [end, label]
+    return "CASE" + f" WHEN {column} < ? THEN ?" * len(periods) + " END", params
+
+
+def _rows_as_dicts(cursor, query, params):
+    cursor.row_factory = sqlite3.Row
+    cursor.execute(query, params)
+    return [dict(row) for row in cursor.fetchall()]
+
+
+# Per-user queries on hot paths. The SQLite backend runs exactly these, and
+# tests/test_query_plans.py checks that each one searches an index.
+
+USER_TIMERS_SQL = f"SELECT {TIMER_COLUMNS} FROM timers WHERE user_id = ?"
+
+# Across all users, but only the last period's worth; read once at start-up by rate_limiter.py
+RECENT_END_CHECKINS_SQL = """
+    SELECT user_id, timer_id, timestamp
+    FROM energy_logs
+    WHERE stage = 'end' AND timestamp >= ?
+"""
+
+SHELF_ITEMS_SQL = """
+    SELECT id, task_text, created_at, completed
+    FROM flow_shelf
+    WHERE user_id = ?
+    ORDER BY created_at DESC
+"""
+
+LATEST_INSIGHTS_SQL = """
+    SELECT * FROM energy_insights
+    WHERE user_id = ?
+    ORDER BY timestamp DESC
+    LIMIT ?
+"""
+
+DAILY_ROLLUPS_SQL = """
+    SELECT day, energy_sum, checkin_count, energy_min, energy_max
+    FROM energy_daily_rollups
+    WHERE user_id = ? AND day BETWEEN ? AND ?
+    ORDER BY day DESC
+    LIMIT ?
+"""
+
+ENERGY_SPAN_SQL = """
+    SELECT MIN(first), MAX(last), SUM(readings)
+    FROM (
+        SELECT MIN(e.timestamp) AS first, MAX(e.timestamp) AS last, COUNT(*) AS readings
+        FROM energy_logs e
+        JOIN timers t ON e.timer_id = t.id
+        WHERE e.user_id = ? AND e.timestamp BETWEEN ? AND ?
+        UNION ALL
+        SELECT MIN(timestamp), MAX(timestamp), COUNT(*)
+        FROM energy_insights
+        WHERE user_id = ? AND timestamp BETWEEN ? AND ?
+    )
+"""
+
+# {extreme} is MIN or MAX. With a single MIN() or MAX(), SQLite takes the bare timestamp
+# from the row holding it, so each pass finds one extreme and when it happened
+ENERGY_EXTREMES_SQL = """
+    SELECT bucket, COUNT(*), timestamp, {extreme}(level)
+    FROM (
+        SELECT (e.timestamp - ?) / ? AS bucket, e.timestamp, e.energy_level AS level
+        FROM energy_logs e
+        JOIN timers t ON e.timer_id = t.id
+        WHERE e.user_id = ? AND e.timestamp BETWEEN ? AND ?
+        UNION ALL
+        SELECT (timestamp - ?) / ?, timestamp, overall_energy
+        FROM energy_insights
+        WHERE user_id = ? AND timestamp BETWEEN ? AND ?
+    )
+    GROUP BY bucket
+    ORDER BY bucket
+"""
+
+
+def energy_extremes_query(user_id, start_ms, end_ms, bucket_ms, extreme):
+    """(SQL, parameters) of the MIN or MAX reading per bucket, as in energy_level_extremes"""
+    return ENERGY_EXTREMES_SQL.format(extreme=extreme), (start_ms, bucket_ms, user_id, start_ms, end_ms,
+                                                         start_ms, bucket_ms, user_id, start_ms, end_ms)
+
+
+def daily_totals_query(user_id, days, end_ms):
+    """(SQL, parameters) of a user's check-ins and roll-ups summed per day, as in daily_totals"""
+    day_sql, day_params = _period_sql("timestamp", days, end_ms)
+    return f"""
+        SELECT log_date, SUM(energy_sum), SUM(session_count)
+        FROM (
+            SELECT {day_sql} as log_date,
+                   SUM(energy_level) as energy_sum, COUNT(*) as session_count
+            FROM energy_logs
+            WHERE user_id = ? AND timestamp >= ? AND timestamp < ?
+            GROUP BY log_date
+            UNION ALL
+            SELECT day, energy_sum, checkin_count
+            FROM energy_daily_rollups
+            WHERE user_id = ? AND day BETWEEN ? AND ?
+        )
+        GROUP BY log_date
+        ORDER BY log_date
+    """, (*day_params, user_id, days[0][1], end_ms, user_id, days[0][0], days[-1][0])
+
+
+def focus_totals_query(user_id, periods, end_ms):
+    """(SQL, parameters) of a user's finished runs summed per period, as in focus_totals"""
+    period_sql, period_params = _period_sql("ended_at", periods, end_ms)
+    return f"""
+        SELECT {period_sql} AS period, SUM(focused_ms), COUNT(*)
+        FROM timer_sessions
+        WHERE user_id = ? AND ended_at >= ? AND ended_at < ?
+        GROUP BY period
+        ORDER BY period
+    """, (*period_params, user_id, periods[0][1], end_ms)
+
+
+def _page_query(select, alias, user_id, start_ms, end_ms, before, limit):
+    column = f"{alias}." if alias else ""
+    query = select + f" WHERE {column}user_id = ? AND {column}timestamp BETWEEN ? AND ?"
+    params = [user_id, start_ms, end_ms]
+
+    # Keyset pagination: the plain timestamp bound lets the index seek straight to the cursor
+    if before:
+        query += f" AND {column}timestamp <= ? AND ({column}timestamp, {column}id) < (?, ?)"
+        params += [before[0], *before]
+
+    query += f" ORDER BY {column}timestamp DESC, {column}id DESC LIMIT ?"
+    params.append(limit if limit is not None else -1)
+    return query, params
+
+
+def checkins_page_query(user_id, start_ms, end_ms, before=None, limit=None):
+    """(SQL, parameters) of a page of check-ins with timer names, as in checkins_with_timer_names"""
+    return _page_query("""
+        SELECT
+            e.id,
+            e.timestamp,
+            e.energy_level,
+            t.name as timer_name,
+            e.stage
+        FROM energy_logs e
+        JOIN timers t ON e.timer_id = t.id
+    """, "e", user_id, start_ms, end_ms, before, limit)
+
+
+def insights_page_query(user_id, start_ms, end_ms, before=None, limit=None):
+    """(SQL, parameters) of a page of insight levels, as in insight_levels"""
+    return _page_query("""
+        SELECT
+            id,
+            timestamp,
+            overall_energy
+        FROM energy_insights
+    """, "", user_id, start_ms, end_ms, before, limit)
+
+
+class SQLiteUserRepository(UserRepository):
+    """Users live in the global (directory) database"""
+
+    def get(self, user_id):
+        cursor = get_directory_db().cursor()
+        cursor.execute("SELECT id, username, password, country, state_province FROM users WHERE id = ?",
+                       (user_id,))
+        row = cursor.fetchone()
+        return User._make(row) if row else None
+
+    def get_by_username(self, username):
+        cursor = get_directory_db().cursor()
+        cursor.execute("SELECT id, username, password, country, state_province FROM users WHERE username = ?",
+                       (username,))
+        row = cursor.fetchone()
+        return User._make(row) if row else None
+
+    def username_taken(self, username, exclude_user_id=None):
+        cursor = get_directory_db().cursor()
+        cursor.execute("SELECT id FROM users WHERE username = ? AND id IS NOT ?", (username, exclude_user_id))
+        return cursor.fetchone() is not None
+
+    def create(self, username, password_hash):
+        conn = get_directory_db()
+        try:
+            cursor = conn.execute("INSERT INTO users (username, password) VALUES (?, ?)",
+                                  (username, password_hash))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        return cursor.lastrowid
+
+    def count(self):
+        return get_directory_db().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def list_usernames(self):
+        return [row[0] for row in get_directory_db().execute("SELECT username FROM users").fetchall()]
+
+    def _update(self, query, params):
+        conn = get_directory_db()
+        conn.execute(query, params)
+        conn.commit()
+
+    def update_username(self, user_id, username):
+        self._update("UPDATE users SET username = ? WHERE id = ?", (username, user_id))
+
+    def update_password(self, user_id, password_hash):
+        self._update("UPDATE users SET password = ? WHERE id = ?", (password_hash, user_id))
+
+    def update_location(self, user_id, country, state_province):
+        self._update("UPDATE users SET country = ?, state_province = ? WHERE id = ?",
+                     (country, state_province, user_id))
+
+    def session_epoch(self, user_id):
+        row = get_directory_db().execute("SELECT session_epoch FROM users WHERE id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def start_session(self, user_id):
+        conn = get_directory_db()
+        row = conn.execute("""
+            UPDATE users SET session_epoch = session_epoch + 1
+            WHERE id = ?
+            RETURNING session_epoch
+        """, (user_id,)).fetchone()
+        conn.commit()
+        return row[0] if row else 0
+
+    def delete(self, user_id):
+        self._update("DELETE FROM users WHERE id = ?", (user_id,))
+
+
+class SQLiteTimerRepository(TimerRepository):
+    """Transitions go through the state machine, one UPDATE ... RETURNING each"""
+
+    machine = TimerStateMachine()
+
+    def list_for_user(self, user_id, epoch=None):
+        cursor = get_db().cursor()
+        cursor.execute(USER_TIMERS_SQL, (user_id,))
+        return [as_of_epoch(Timer._make(row), epoch) for row in cursor.fetchall()]
+
+    def get(self, user_id, timer_id, epoch=None):
+        return _fetch_timer(get_db().cursor(), user_id, timer_id, epoch)
+
+    def create(self, user_id, name, duration_seconds):
+        def insert(conn):
+            return conn.execute("""
+                INSERT INTO timers (user_id, name, duration)
+                VALUES (?, ?, ?)
+            """, (user_id, name, duration_seconds)).lastrowid
+        return run_write(insert)
+
+    def delete(self, user_id, timer_id):
+        def remove(conn):
+            conn.execute("DELETE FROM timers WHERE id = ? AND user_id = ?", (timer_id, user_id))
+        run_write(remove)
+
+    def transition(self, user_id, timer_id, action, now=None, epoch=None):
+        now = now if now is not None else now_ms()
+
+        def apply(conn):
+            row = self.machine.apply(conn, user_id, timer_id, action, now, epoch)
+            return Timer._make(row) if row else None
+        return run_write(apply)
+
+    def command(self, user_id, timer_id, action, epoch=None, expected_version=None, idempotency_key=None):
+        def apply(conn):
+            row, replayed = self.machine.command(conn, user_id, timer_id, action, now_ms(), epoch,
+                                                 expected_version, idempotency_key)
+            return CommandResult(Timer._make(row), replayed) if row else None
+        return run_write(apply)
+
+    def list_running(self):
+        # From every database holding per-user data
+        timers = []
+        for pool in database.get_user_pools():
+            with pool.connection() as conn:
+                rows = conn.execute(f"SELECT {TIMER_COLUMNS} FROM timers WHERE is_running = ?",
+                                    (RUNNING,)).fetchall()
+                timers.extend(Timer._make(row) for row in rows)
+        return timers
+
+    def count_all(self):
+        # Summed over every database holding per-user data
+        total = 0
+        for pool in database.get_user_pools():
+            with pool.connection() as conn:
+                total += conn.execute("SELECT COUNT(*) FROM timers").fetchone()[0]
+        return total
+
+    def export(self, user_id):
+        return _rows_as_dicts(get_read_db().cursor(), USER_TIMERS_SQL, (user_id,))
+
+    def focus_totals(self, user_id, periods, end_ms):
+        cursor = get_read_db().cursor()
+        cursor.execute(*focus_totals_query(user_id, periods, end_ms))
+        return [FocusTotal._make(row) for row in cursor.fetchall()]
+
+    def export_sessions(self, user_id):
+        return _rows_as_dicts(get_read_db().cursor(), "SELECT * FROM timer_sessions WHERE user_id = ?", (user_id,))
+
+    def delete_for_user(self, user_id):
+        def remove(conn):
+            conn.execute("DELETE FROM timer_commands WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM timer_sessions WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM timers WHERE user_id = ?", (user_id,))
+        run_write(remove)
+
+
+class SQLiteEnergyRepository(EnergyRepository):
+    """Analytics reads go through the read-only connection, writes through run_write()"""
+
+    def record_checkin(self, user_id, timer_id, stage, energy_level, epoch=None):
+        preference = CHECKIN_PREFERENCES[stage]
+
+        def record(conn):
+            cursor = conn.cursor()
+
+            # Check the timer belongs to the user and the stage is enabled (defaults apply
+            # until the user has a preferences row)
+            cursor.execute(f"""
+                SELECT COALESCE(p.{preference}, 1)
+                FROM timers t
+                LEFT JOIN user_preferences p ON p.user_id = t.user_id
+                WHERE t.id = ? AND t.user_id = ?
+            """, (timer_id, user_id))
+            row = cursor.fetchone()
+
+            if not row:
+                return LoggedCheckin("not_found", None, None)
+            if not row[0]:
+                return LoggedCheckin("disabled", None, None)
+
+            now = now_ms()
+
+            # Insert energy log for simple tracking
+            cursor.execute("""
+                INSERT INTO energy_logs (user_id, timer_id, stage, energy_level, timestamp)
+                VALUES (?, ?, ?, ?, ?)
+            """, (user_id, timer_id, stage, energy_level, now))
+
+            # Also insert into the detailed energy_insights table for graphing
+            # We'll use the single energy_level for all numeric insight fields
+            # and provide default values for text fields.
+            cursor.execute("""
+                INSERT INTO energy_insights
+                (user_id, overall_energy, motivation_level, focus_clarity, physical_energy,
+                 mood_state, notes, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (user_id, energy_level, energy_level, energy_level,
+                  energy_level, 'check-in', f'Logged from timer {stage}', now))
+
+            # A 'start' check-in also starts the timer and an 'end' one stops it
+            timer = None
+            action = CHECKIN_TIMER_ACTIONS.get(stage)
+            if action:
+                try:
+                    timer = Timer._make(SQLiteTimerRepository.machine.apply(conn, user_id, timer_id, action,
+                                                                            now, epoch))
+                    logger.debug("Applied %s to timer %s automatically after energy log.", action, timer_id)
+                except IllegalTransition as e:
+                    # e.g. the countdown already stopped it; the check-in still counts
+                    logger.debug("%s", e)
+
+            return LoggedCheckin("logged", now, timer)
+        return run_write(record)
+
+    def record_checkins(self, user_id, checkins):
+        def record(conn):
+            cursor = conn.cursor()
+
+            # Check timer ownership for the whole batch at once
+            timer_ids = sorted({checkin["timer_id"] for checkin in checkins})
+            placeholders = ",".join("?" * len(timer_ids))
+            cursor.execute(f"""
+                SELECT id FROM timers
+                WHERE user_id = ? AND id IN ({placeholders})
+            """, [user_id, *timer_ids])
+            owned = {row[0] for row in cursor.fetchall()}
+
+            rows = [c for c in checkins if c["timer_id"] in owned]
+
+            cursor.executemany("""
+                INSERT INTO energy_logs (user_id, timer_id, stage, energy_level, timestamp)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(user_id, c["timer_id"], c["stage"], c["energy_level"], c["timestamp"]) for c in rows])
+
+            # Mirror into energy_insights for graphing, the same way record_checkin does
+            cursor.executemany("""
+                INSERT INTO energy_insights
+                (user_id, overall_energy, motivation_level, focus_clarity, physical_energy,
+                 mood_state, notes, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(user_id, c["energy_level"], c["energy_level"], c["energy_level"], c["energy_level"],
+                   'check-in', f'Logged from timer {c["stage"]}', c["timestamp"]) for c in rows])
+
+            return [c["timer_id"] in owned for c in checkins]
+        return run_write(record) if checkins else []
+
+    def recent_end_checkins(self, since_ms):
+        # From every database holding per-user data; read once at start-up
+        checkins = []
+        for pool in database.get_user_pools():
+            with pool.connection() as conn:
+                checkins.extend(conn.execute(RECENT_END_CHECKINS_SQL, (since_ms,)).fetchall())
+        return [tuple(row) for row in checkins]
+
+    def checkins_with_timer_names(self, user_id, start_ms, end_ms, before=None, limit=None):
+        cursor = get_read_db().cursor()
+        cursor.execute(*checkins_page_query(user_id, start_ms, end_ms, before, limit))
+        return [CheckIn._make(row) for row in cursor.fetchall()]
+
+    def insight_levels(self, user_id, start_ms, end_ms, before=None, limit=None):
+        cursor = get_read_db().cursor()
+        cursor.execute(*insights_page_query(user_id, start_ms, end_ms, before, limit))
+        return cursor.fetchall()
+
+    def daily_rollups(self, user_id, first_day, last_day, limit=None):
+        cursor = get_read_db().cursor()
+        cursor.execute(DAILY_ROLLUPS_SQL, (user_id, first_day, last_day, limit if limit is not None else -1))
+        return [DailyRollup._make(row) for row in cursor.fetchall()]
+
+    def energy_level_span(self, user_id, start_ms, end_ms):
+        cursor = get_read_db().cursor()
+        cursor.execute(ENERGY_SPAN_SQL, (user_id, start_ms, end_ms, user_id, start_ms, end_ms))
+        return tuple(cursor.fetchone())
+
+    def energy_level_extremes(self, user_id, start_ms, end_ms, bucket_ms):
+        cursor = get_read_db().cursor()
+        passes = []
+        for extreme in ("MIN", "MAX"):
+            cursor.execute(*energy_extremes_query(user_id, start_ms, end_ms, bucket_ms, extreme))
+            passes.append(cursor.fetchall())
+        return [EnergyBucket(bucket, readings, low_timestamp, low, high_timestamp, high)
+                for (bucket, readings, low_timestamp, low), (_, _, high_timestamp, high) in zip(*passes)]
+
+    def daily_totals(self, user_id, days, end_ms):
+        cursor = get_read_db().cursor()
+        cursor.execute(*daily_totals_query(user_id, days, end_ms))
+        return cursor.fetchall()
+
+    def latest_insights(self, user_id, limit):
+        return _rows_as_dicts(get_read_db().cursor(), LATEST_INSIGHTS_SQL, (user_id, limit))
+
+    def save_insight(self, user_id, overall_energy, motivation_level, focus_clarity, physical_energy,
+                     mood_state, energy_source, energy_drains, notes):
+        def save(conn):
+            conn.execute("""
+                INSERT INTO energy_insights
+                (user_id, overall_energy, motivation_level, focus_clarity, physical_energy,
+                 mood_state, energy_source, energy_drains, notes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (user_id, overall_energy, motivation_level, focus_clarity,
+                  physical_energy, mood_state, energy_source, energy_drains, notes))
+        run_write(save)
+
+    def export(self, user_id):
+        cursor = get_read_db().cursor()
+        return {
+            table: _rows_as_dicts(cursor, f"SELECT * FROM {table} WHERE user_id = ?", (user_id,))
+            for table in ("energy_logs", "energy_insights", "energy_daily_rollups")
+        }
+
+    def delete_for_user(self, user_id):
+        def remove(conn):
+            for table in ("energy_insights", "energy_logs", "energy_daily_rollups"):
+                conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+        run_write(remove)
+
+
+class SQLiteShelfRepository(ShelfRepository):
+
+    def add(self, user_id, text):
+        def insert(conn):
+            return conn.execute("""
+                INSERT INTO flow_shelf (user_id, task_text)
+                VALUES (?, ?)
+            """, (user_id, text)).lastrowid
+        return run_write(insert)
+
+    def remove(self, user_id, item_id=None, text=None):
+        def delete(conn):
+            # If we have the ID, use that; otherwise use the text
+            if item_id:
+                conn.execute("""
+                    DELETE FROM flow_shelf
+                    WHERE id = ? AND user_id = ?
+                """, (item_id, user_id))
+            else:
+                conn.execute("""
+                    DELETE FROM flow_shelf
+                    WHERE task_text = ? AND user_id = ?
+                """, (text, user_id))
+        run_write(delete)
+
+    def list_for_user(self, user_id):
+        cursor = get_db().cursor()
+        cursor.execute(SHELF_ITEMS_SQL, (user_id,))
+        return [ShelfItem._make(row) for row in cursor.fetchall()]
+
+    def count_all(self):
+        total = 0
+        for pool in database.get_user_pools():
+            with pool.connection() as conn:
+                total += conn.execute("SELECT COUNT(*) FROM flow_shelf").fetchone()[0]
+        return total
+
+    def export(self, user_id):
+        return _rows_as_dicts(get_read_db().cursor(), "SELECT * FROM flow_shelf WHERE user_id = ?", (user_id,))
+
+    def delete_for_user(self, user_id):
+        def remove(conn):
+            conn.execute("DELETE FROM flow_shelf WHERE user_id = ?", (user_id,))
+        run_write(remove)
+
+
+class SQLitePreferencesRepository(PreferencesRepository):
+
+    def get_or_create(self, user_id):
+        cursor = get_db().cursor()
+        cursor.execute("""
+            SELECT enable_start_checkin, enable_mid_checkin, enable_end_checkin,
+                   enable_energy_log, enable_sound, version
+            FROM user_preferences
+            WHERE user_id = ?
+        """, (user_id,))
+        row = cursor.fetchone()
+
+        if not row:
+            # Create default preferences for new user
+            version = self.save(user_id, DEFAULT_PREFERENCES)
+            return StoredPreferences(dict(DEFAULT_PREFERENCES), version)
+
+        return StoredPreferences({name: bool(value) for name, value in zip(DEFAULT_PREFERENCES, row)}, row[-1])
+
+    def save(self, user_id, preferences):
+        def upsert(conn):
+            # Updated in place rather than replaced, so the version carries on
+            return conn.execute("""
+                INSERT INTO user_preferences
+                (user_id, enable_start_checkin, enable_mid_checkin, enable_end_checkin,
+                 enable_energy_log, enable_sound)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    enable_start_checkin = excluded.enable_start_checkin,
+                    enable_mid_checkin = excluded.enable_mid_checkin,
+                    enable_end_checkin = excluded.enable_end_checkin,
+                    enable_energy_log = excluded.enable_energy_log,
+                    enable_sound = excluded.enable_sound,
+                    version = user_preferences.version + 1
+                RETURNING version
+            """, (user_id, *(preferences[name] for name in DEFAULT_PREFERENCES))).fetchone()[0]
+        return run_write(upsert)
+
+    def delete_for_user(self, user_id):
+        def remove(conn):
+            conn.execute("DELETE FROM user_preferences WHERE user_id = ?", (user_id,))
+        run_write(remove)
+
+
+# In-memory backend
+
+class MemoryStore:
+    """Every table as a dict of id -> row dict, guarded by one lock"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.users = {}
+        self.timers = {}
+        self.timer_runs = {}  # timer_id -> {"run_started_at", "pause_count"} of the current run
+        self.timer_sessions = {}
+        self.timer_commands = {}  # (user_id, idempotency_key) -> row
+        self.energy_logs = {}
+        self.energy_insights = {}
+        self.energy_daily_rollups = {}  # (user_id, day) -> row
+        self.flow_shelf = {}
+        self.user_preferences = {}  # user_id -> preferences dict
+        self.preference_versions = {}  # user_id -> version of their preferences
+        self._last_ids = {}
+
+    def next_id(self, table):
+        """AUTOINCREMENT-style ids, per table"""
+        self._last_ids[table] = self._last_ids.get(table, 0) + 1
+        return self._last_ids[table]
+
+
+def _utc_now_text():
+    """CURRENT_TIMESTAMP as SQLite writes it"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class MemoryUserRepository(UserRepository):
+
+    def __init__(self, store):
+        self.store = store
+
+    def _user(self, row):
+        return User(row["id"], row["username"], row["password"], row["country"], row["state_province"])
+
+    def get(self, user_id):
+        with self.store.lock:
+            row = self.store.users.get(user_id)
+            return self._user(row) if row else None
+
+    def get_by_username(self, username):
+        with self.store.lock:
+            for row in self.store.users.values():
+                if row["username"] == username:
+                    return self._user(row)
+        return None
+
+    def username_taken(self, username, exclude_user_id=None):
+        user = self.get_by_username(username)
+        return user is not None and user.id != exclude_user_id
+
+    def create(self, username, password_hash):
+        with self.store.lock:
+            if self.username_taken(username):
+                raise sqlite3.IntegrityError("UNIQUE constraint failed: users.username")
+            user_id = self.store.next_id("users")
+            self.store.users[user_id] = {"id": user_id, "username": username, "password": password_hash,
+                                         "country": 'AU', "state_province": None, "session_epoch": 0}
+            return user_id
+
+    def count(self):
+        with self.store.lock:
+            return len(self.store.users)
+
+    def list_usernames(self):
+        with self.store.lock:
+            return [row["username"] for row in self.store.users.values()]
+
+    def _update(self, user_id, **values):
+        with self.store.lock:
+            if user_id in self.store.users:
+                self.store.users[user_id].update(values)
+
+    def update_username(self, user_id, username):
+        self._update(user_id, username=username)
+
+    def update_password(self, user_id, password_hash):
+        self._update(user_id, password=password_hash)
+
+    def update_location(self, user_id, country, state_province):
+        self._update(user_id, country=country, state_province=state_province)
+
+    def session_epoch(self, user_id):
+        with self.store.lock:
+            row = self.store.users.get(user_id)
+            return row["session_epoch"] if row else 0
+
+    def start_session(self, user_id):
+        with self.store.lock:
+            row = self.store.users.get(user_id)
+            if row is None:
+                return 0
+            row["session_epoch"] += 1
+            return row["session_epoch"]
+
+    def delete(self, user_id):
+        with self.store.lock:
+            self.store.users.pop(user_id, None)
+
+
+def _apply_memory_transition(store, row, action, now, epoch=None, expected_version=None):
+    """Apply an action to a memory timer row, with the same run history as the SQLite backend"""
+    machine = MemoryTimerRepository.machine
+    state = STOPPED if stale(Timer(**row), epoch) else row["is_running"]
+    machine.check_version(row["id"], expected_version, row["version"])
+    machine.check(row["id"], action, state)
+    if action == "expire" and not machine.due(Timer(**row), now):
+        raise IllegalTransition(row["id"], action, state)
+    row.update(machine.changes(Timer(**row), action, now))
+    row["version"] += 1
+    if action == "start" and epoch is not None:
+        row["epoch"] = epoch
+
+    run = store.timer_runs.setdefault(row["id"], {"run_started_at": None, "pause_count": 0})
+    if action == "start":
+        run.update(run_started_at=now, pause_count=0)
+    elif action == "pause":
+        run["pause_count"] += 1
+    elif TRANSITIONS[action][1] == STOPPED and run["run_started_at"] is not None:
+        session_id = store.next_id("timer_sessions")
+        store.timer_sessions[session_id] = {
+            "id": session_id, "user_id": row["user_id"], "timer_id": row["id"],
+            "started_at": run["run_started_at"], "ended_at": now,
+            "focused_ms": row["elapsed_time"], "pause_count": run["pause_count"]
+        }
+    return Timer(**row)
+
+
+class MemoryTimerRepository(TimerRepository):
+
+    machine = TimerStateMachine()
+
+    def __init__(self, store):
+        self.store = store
+
+    def _owned(self, user_id, timer_id):
+        row = self.store.timers.get(timer_id)
+        return row if row is not None and row["user_id"] == user_id else None
+
+    def list_for_user(self, user_id, epoch=None):
+        with self.store.lock:
+            return [as_of_epoch(Timer(**row), epoch) for row in self.store.timers.values()
+                    if row["user_id"] == user_id]
+
+    def get(self, user_id, timer_id, epoch=None):
+        with self.store.lock:
+            row = self._owned(user_id, timer_id)
+            return as_of_epoch(Timer(**row), epoch) if row else None
+
+    def create(self, user_id, name, duration_seconds):
+        with self.store.lock:
+            timer_id = self.store.next_id("timers")
+            self.store.timers[timer_id] = Timer(timer_id, user_id, name, duration_seconds,
+                                                None, None, None, 0, 0, 0, 0)._asdict()
+            return timer_id
+
+    def delete(self, user_id, timer_id):
+        with self.store.lock:
+            if self._owned(user_id, timer_id):
+                del self.store.timers[timer_id]
+
+    def transition(self, user_id, timer_id, action, now=None, epoch=None):
+        now = now if now is not None else now_ms()
+        with self.store.lock:
+            row = self._owned(user_id, timer_id)
+            if row is None:
+                return None
+            return _apply_memory_transition(self.store, row, action, now, epoch)
+
+    def command(self, user_id, timer_id, action, epoch=None, expected_version=None, idempotency_key=None):
+        now = now_ms()
+        with self.store.lock:
+            row = self._owned(user_id, timer_id)
+            if row is None:
+                return None
+            stored = self.store.timer_commands.get((user_id, idempotency_key))
+            if stored is not None:
+                if (stored["timer_id"], stored["action"]) != (timer_id, action):
+                    raise IdempotencyKeyReused(idempotency_key)
+                return CommandResult(stored["result"], True)
+            timer = _apply_memory_transition(self.store, row, action, now, epoch, expected_version)
+            if idempotency_key is not None:
+                for key in [k for k, c in self.store.timer_commands.items()
+                            if k[0] == user_id and c["created_at"] < now - IDEMPOTENCY_KEY_TTL_MS]:
+                    del self.store.timer_commands[key]
+                self.store.timer_commands[(user_id, idempotency_key)] = {
+                    "timer_id": timer_id, "action": action, "result": timer, "created_at": now
+                }
+            return CommandResult(timer, False)
+
+    def list_running(self):
+        with self.store.lock:
+            return [Timer(**row) for row in self.store.timers.values() if row["is_running"] == RUNNING]
+
+    def count_all(self):
+        with self.store.lock:
+            return len(self.store.timers)
+
+    def export(self, user_id):
+        return [timer._asdict() for timer in self.list_for_user(user_id)]
+
+    def focus_totals(self, user_id, periods, end_ms):
+        totals = {}
+        with self.store.lock:
+            for row in self.store.timer_sessions.values():
+                period = _period_of(periods, end_ms, row["ended_at"])
+                if row["user_id"] == user_id and period is not None:
+                    focused_ms, count = totals.get(period, (0, 0))
+                    totals[period] = (focused_ms + row["focused_ms"], count + 1)
+        return [FocusTotal(p, focused_ms, count) for p, (focused_ms, count) in sorted(totals.items())]
+
+    def export_sessions(self, user_id):
+        with self.store.lock:
+            return [dict(row) for row in self.store.timer_sessions.values() if row["user_id"] == user_id]
+
+    def delete_for_user(self, user_id):
+        with self.store.lock:
+            for timer_id in [t for t, row in self.store.timers.items() if row["user_id"] == user_id]:
+                del self.store.timers[timer_id]
+                self.store.timer_runs.pop(timer_id, None)
+            for session_id in [s for s, row in self.store.timer_sessions.items() if row["user_id"] == user_id]:
+                del self.store.timer_sessions[session_id]
+            for key in [k for k in self.store.timer_commands if k[0] == user_id]:
+                del self.store.timer_commands[key]
+
+
+class MemoryEnergyRepository(EnergyRepository):
+
+    def __init__(self, store):
+        self.store = store
+
+    def _insert_log(self, user_id, timer_id, stage, energy_level, timestamp):
+        log_id = self.store.next_id("energy_logs")
+        self.store.energy_logs[log_id] = {"id": log_id, "user_id": user_id, "timer_id": timer_id,
+                                          "stage": stage, "energy_level": energy_level, "timestamp": timestamp}
+        self._insert_insight(user_id, energy_level, energy_level, energy_level, energy_level,
+                             'check-in', None, None, f'Logged from timer {stage}', timestamp)
+
+    def _insert_insight(self, user_id, overall_energy, motivation_level, focus_clarity, physical_energy,
+                        mood_state, energy_source, energy_drains, notes, timestamp):
+        insight_id = self.store.next_id("energy_insights")
+        self.store.energy_insights[insight_id] = {
+            "id": insight_id, "user_id": user_id, "overall_energy": overall_energy,
+            "motivation_level": motivation_level, "focus_clarity": focus_clarity,
+            "physical_energy": physical_energy, "mood_state": mood_state,
+            "energy_source": energy_source, "energy_drains": energy_drains, "notes": notes,
+            "timestamp": timestamp
+        }
+
+    def _owns_timer(self, user_id, timer_id):
+        row = self.store.timers.get(timer_id)
+        return row is not None and row["user_id"] == user_id
+
+    def record_checkin(self, user_id, timer_id, stage, energy_level, epoch=None):
+        preference = CHECKIN_PREFERENCES[stage]
+        with self.store.lock:
+            if not self._owns_timer(user_id, timer_id):
+                return LoggedCheckin("not_found", None, None)
+            if not self.store.user_preferences.get(user_id, DEFAULT_PREFERENCES)[preference]:
+                return LoggedCheckin("disabled", None, None)
+            now = now_ms()
+            self._insert_log(user_id, timer_id, stage, energy_level, now)
+            timer = None
+            action = CHECKIN_TIMER_ACTIONS.get(stage)
+            if action:
+                row = self.store.timers[timer_id]
+                try:
+                    _apply_memory_transition(self.store, row, action, now, epoch)
+                    timer = Timer(**row)
+                except IllegalTransition as e:
+                    logger.debug("%s", e)
+            return LoggedCheckin("logged", now, timer)
+
+    def record_checkins(self, user_id, checkins):
+        with self.store.lock:
+            results = []
+            for checkin in checkins:
+                owned = self._owns_timer(user_id, checkin["timer_id"])
+                if owned:
+                    self._insert_log(user_id, checkin["timer_id"], checkin["stage"],
+                                     checkin["energy_level"], checkin["timestamp"])
+                results.append(owned)
+            return results
+
+    def recent_end_checkins(self, since_ms):
+        with self.store.lock:
+            return [(row["user_id"], row["timer_id"], row["timestamp"]) for row in self.store.energy_logs.values()
+                    if row["stage"] == 'end' and row["timestamp"] >= since_ms]
+
+    def checkins_with_timer_names(self, user_id, start_ms, end_ms, before=None, limit=None):
+        with self.store.lock:
+            checkins = sorted((CheckIn(row["id"], row["timestamp"], row["energy_level"],
+                                       self.store.timers[row["timer_id"]]["name"], row["stage"])
+                               for row in self.store.energy_logs.values()
+                               if row["user_id"] == user_id and row["timer_id"] in self.store.timers
+                               and start_ms <= row["timestamp"] <= end_ms
+                               and (not before or (row["timestamp"], row["id"]) < tuple(before))),
+                              key=lambda checkin: (checkin.timestamp, checkin.id), reverse=True)
+        return checkins[:limit] if limit is not None else checkins
+
+    def insight_levels(self, user_id, start_ms, end_ms, before=None, limit=None):
+        with self.store.lock:
+            insights = sorted(((row["id"], row["timestamp"], row["overall_energy"])
+                               for row in self.store.energy_insights.values()
+                               if row["user_id"] == user_id and start_ms <= row["timestamp"] <= end_ms
+                               and (not before or (row["timestamp"], row["id"]) < tuple(before))),
+                              key=lambda insight: (insight[1], insight[0]), reverse=True)
+        return insights[:limit] if limit is not None else insights
+
+    def daily_rollups(self, user_id, first_day, last_day, limit=None):
+        with self.store.lock:
+            rollups = sorted((DailyRollup(row["day"], row["energy_sum"], row["checkin_count"],
+                                          row["energy_min"], row["energy_max"])
+                              for (owner, day), row in self.store.energy_daily_rollups.items()
+                              if owner == user_id and first_day <= day <= last_day),
+                             key=lambda rollup: rollup.day, reverse=True)
+        return rollups[:limit] if limit is not None else rollups
+
+    def _readings(self, user_id, start_ms, end_ms):
+        """
+        (timestamp, level) of the user's insights and check-ins between two instants,
+        leaving out check-ins whose timer is gone, as the SQL backend's JOIN does
+        """
+        readings = [(row["timestamp"], row["energy_level"]) for row in self.store.energy_logs.values()
+                    if row["user_id"] == user_id and start_ms <= row["timestamp"] <= end_ms
+                    and row["timer_id"] in self.store.timers]
+        readings += [(row["timestamp"], row["overall_energy"]) for row in self.store.energy_insights.values()
+                     if row["user_id"] == user_id and start_ms <= row["timestamp"] <= end_ms]
+        return readings
+
+    def energy_level_span(self, user_id, start_ms, end_ms):
+        with self.store.lock:
+            timestamps = [timestamp for timestamp, _ in self._readings(user_id, start_ms, end_ms)]
+        if not timestamps:
+            return None, None, 0
+        return min(timestamps), max(timestamps), len(timestamps)
+
+    def energy_level_extremes(self, user_id, start_ms, end_ms, bucket_ms):
+        buckets = {}
+        with self.store.lock:
+            readings = self._readings(user_id, start_ms, end_ms)
+        for timestamp, level in readings:
+            bucket = (timestamp - start_ms) // bucket_ms
+            found = buckets.get(bucket)
+            if found is None:
+                buckets[bucket] = EnergyBucket(bucket, 1, timestamp, level, timestamp, level)
+                continue
+            low = (timestamp, level) if level < found.low else (found.low_timestamp, found.low)
+            high = (timestamp, level) if level > found.high else (found.high_timestamp, found.high)
+            buckets[bucket] = EnergyBucket(bucket, found.readings + 1, *low, *high)
+        return [buckets[bucket] for bucket in sorted(buckets)]
+
+    def daily_totals(self, user_id, days, end_ms):
+        first_day, last_day = days[0][0], days[-1][0]
+        totals = {}
+        with self.store.lock:
+            for row in self.store.energy_logs.values():
+                day_name = _period_of(days, end_ms, row["timestamp"])
+                if row["user_id"] == user_id and day_name is not None:
+                    day = totals.setdefault(day_name, [0, 0])
+                    day[0] += row["energy_level"]
+                    day[1] += 1
+            for (owner, day_name), row in self.store.energy_daily_rollups.items():
+                if owner == user_id and first_day <= day_name <= last_day:
+                    day = totals.setdefault(day_name, [0, 0])
+                    day[0] += row["energy_sum"]
+                    day[1] += row["checkin_count"]
+        return [(day, energy_sum, count) for day, (energy_sum, count) in sorted(totals.items())]
+
+    def latest_insights(self, user_id, limit):
+        with self.store.lock:
+            rows = [dict(row) for row in self.store.energy_insights.values() if row["user_id"] == user_id]
+        rows.sort(key=lambda row: row["timestamp"], reverse=True)
+        return rows[:limit] if limit >= 0 else rows
+
+    def save_insight(self, user_id, overall_energy, motivation_level, focus_clarity, physical_energy,
+                     mood_state, energy_source, energy_drains, notes):
+        with self.store.lock:
+            self._insert_insight(user_id, overall_energy, motivation_level, focus_clarity, physical_energy,
+                                 mood_state, energy_source, energy_drains, notes, now_ms())
+
+    def export(self, user_id):
+        with self.store.lock:
+            return {
+                "energy_logs": [dict(row) for row in self.store.energy_logs.values()
+                                if row["user_id"] == user_id],
+                "energy_insights": [dict(row) for row in self.store.energy_insights.values()
+                                    if row["user_id"] == user_id],
+                "energy_daily_rollups": [dict(row) for (owner, _), row in self.store.energy_daily_rollups.items()
+                                         if owner == user_id]
+            }
+
+    def delete_for_user(self, user_id):
+        with self.store.lock:
+            for table in (self.store.energy_logs, self.store.energy_insights):
+                for row_id in [i for i, row in table.items() if row["user_id"] == user_id]:
+                    del table[row_id]
+            for key in [key for key in self.store.energy_daily_rollups if key[0] == user_id]:
+                del self.store.energy_daily_rollups[key]
+
+
+class MemoryShelfRepository(ShelfRepository):
+
+    def __init__(self, store):
+        self.store = store
+
+    def add(self, user_id, text):
+        with self.store.lock:
+            item_id = self.store.next_id("flow_shelf")
+            self.store.flow_shelf[item_id] = {"id": item_id, "user_id": user_id, "task_text": text,
+                                              "created_at": _utc_now_text(), "completed": 0}
+            return item_id
+
+    def remove(self, user_id, item_id=None, text=None):
+        with self.store.lock:
+            for row_id, row in list(self.store.flow_shelf.items()):
+                if row["user_id"] != user_id:
+                    continue
+                if (item_id and row_id == item_id) or (not item_id and row["task_text"] == text):
+                    del self.store.flow_shelf[row_id]
+
+    def list_for_user(self, user_id):
+        with self.store.lock:
+            rows = [row for row in self.store.flow_shelf.values() if row["user_id"] == user_id]
+            rows.sort(key=lambda row: row["created_at"], reverse=True)
+            return [ShelfItem(row["id"], row["task_text"], row["created_at"], row["completed"]) for row in rows]
+
+    def count_all(self):
+        with self.store.lock:
+            return len(self.store.flow_shelf)
+
+    def export(self, user_id):
+        with self.store.lock:
+            return [dict(row) for row in self.store.flow_shelf.values() if row["user_id"] == user_id]
+
+    def delete_for_user(self, user_id):
+        with self.store.lock:
+            for row_id in [i for i, row in self.store.flow_shelf.items() if row["user_id"] == user_id]:
+                del self.store.flow_shelf[row_id]
+
+
+class MemoryPreferencesRepository(PreferencesRepository):
+
+    def __init__(self, store):
+        self.store = store
+
+    def get_or_create(self, user_id):
+        with self.store.lock:
+            preferences = self.store.user_preferences.setdefault(user_id, dict(DEFAULT_PREFERENCES))
+            return StoredPreferences(dict(preferences), self.store.preference_versions.setdefault(user_id, 1))
+
+    def save(self, user_id, preferences):
+        with self.store.lock:
+            self.store.user_preferences[user_id] = {name: bool(preferences[name]) for name in DEFAULT_PREFERENCES}
+            version = self.store.preference_versions.get(user_id, 0) + 1
+            self.store.preference_versions[user_id] = version
+            return version
+
+    def delete_for_user(self, user_id):
+        with self.store.lock:
+            self.store.user_preferences.pop(user_id, None)
+            self.store.preference_versions.pop(user_id, None)
+
+
+def sqlite_repositories():
+    """Repositories backed by the application's SQLite databases"""
+    return Repositories(SQLiteUserRepository(), SQLiteTimerRepository(), SQLiteEnergyRepository(),
+                        SQLiteShelfRepository(), SQLitePreferencesRepository())
+
+
+def memory_repositories(store=None):
+    """Repositories backed by a (fresh, unless given) MemoryStore"""
+    store = store or MemoryStore()
+    return Repositories(MemoryUserRepository(store), MemoryTimerRepository(store),
+                        MemoryEnergyRepository(store), MemoryShelfRepository(store),
+                        MemoryPreferencesRepository(store))
+
+
+BACKENDS = {
+    "sqlite": sqlite_repositories,
+    "memory": memory_repositories,
+}
+
+_repositories = None
+
+
+def init_app(app, backend=None):
+    """Create the repositories for the configured backend and bind them to the app"""
+    global _repositories
+    backend = backend or os.environ.get('DEEPFLOW_STORAGE', 'sqlite')
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    _repositories = BACKENDS[backend]()
+    app.extensions['deepflow_repositories'] = _repositories
+    logger.info("Using %s storage backend", backend)
+    return _repositories
+
+
+def get_repositories():
+    """Return the repositories created by init_app()"""
+    if _repositories is None:
+        raise RuntimeError("repositories.init_app() has not been called")
+    return _repositories
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Retention job for DeepFlow's raw energy data.
+
+Check-ins older than the retention horizon are compacted into one row per user
+and day in energy_daily_rollups (count, sum, min, max and a per-stage
+breakdown), the day being the user's own calendar day in their timezone, and
+then deleted, along with the 'check-in' insights /log_energy
+mirrors them into. Insights written by the user are kept. The freed pages are
+then handed back to the file system with an incremental VACUUM.
+
+The horizon is DEEPFLOW_RETENTION_DAYS days (default 180). Run it from cron with
+
+    python3 retention.py [path/to/Deepflow.db]
+
+or have the app run it in the background by setting DEEPFLOW_RETENTION_DAYS.
+
+Databases created by migrations.py use incremental auto-vacuum from the start.
+Older ones need a one-off full VACUUM to switch over, which locks the whole
+database while it rewrites the file, so the job never does it by itself; run it
+once while the app is stopped with
+
+    python3 retention.py --rebuild [path/to/Deepflow.db]
+"""
+import os
+import sys
+import sqlite3
+import threading
+import logging
+from datetime import datetime, timedelta
+
+import migrations
+import timezones
+from timeutils import to_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETENTION_DAYS = 180
+RUN_INTERVAL = 6 * 60 * 60  # Seconds between background runs
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def retention_cutoff_ms(days, now=None):
+    """
+    Epoch milliseconds of server-local midnight `days` days ago; older check-ins get
+    rolled up, each user's only up to the start of their own day it falls on
+    """
+    midnight = (now or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    return to_epoch_ms(midnight - timedelta(days=days))
+
+
+def _day_start_ms(ms, tz):
+    """Epoch milliseconds of the local midnight in tz (None: server local) starting the day ms falls on"""
+    day = datetime.fromtimestamp(ms / 1000, tz).date()
+    return to_epoch_ms(datetime.combine(day, datetime.min.time(), tz))
+
+
+def _daily_rollups(rows, zones):
+    """
+    energy_daily_rollups rows for (user_id, timestamp, energy_level, stage) check-ins,
+    one per user and day in the user's timezone (zones: user id -> tzinfo)
+    """
+    days = {}
+    for user_id, timestamp, energy_level, stage in rows:
+        day = datetime.fromtimestamp(timestamp / 1000, zones[user_id]).strftime('%Y-%m-%d')
+        rollup = days.get((user_id, day))
+        if rollup is None:
+            rollup = days[(user_id, day)] = {
+                "count": 0, "sum": 0, "min": energy_level, "max": energy_level,
+                "stages": {"start": [0, 0], "mid": [0, 0], "end": [0, 0]},
+                "first": timestamp, "last": timestamp,
+            }
+        rollup["count"] += 1
+        rollup["sum"] += energy_level
+        rollup["min"] = min(rollup["min"], energy_level)
+        rollup["max"] = max(rollup["max"], energy_level)
+        if stage in rollup["stages"]:
+            rollup["stages"][stage][0] += 1
+            rollup["stages"][stage][1] += energy_level
+        rollup["first"] = min(rollup["first"], timestamp)
+        rollup["last"] = max(rollup["last"], timestamp)
+    return [
+        (user_id, day, r["count"], r["sum"], r["min"], r["max"],
+         *r["stages"]["start"], *r["stages"]["mid"], *r["stages"]["end"], r["first"], r["last"])
+        for (user_id, day), r in days.items()
+    ]
+
+
+def _server_timezone(user_id):
+    """The server's own timezone, for when the users' timezones are unknown"""
+    return None
+
+
+def roll_up_energy_logs(conn, cutoff_ms, user_timezone=_server_timezone):
+    """
+    Fold check-ins older than cutoff_ms into energy_daily_rollups and delete them.
+
+    Check-ins are grouped by the day they fell on in their user's timezone
+    (user_timezone(user_id) -> tzinfo), so roll-ups line up with the days the
+    insights pages cut in that timezone. For the same reason each user's cut-off
+    is moved back to the start of their own day cutoff_ms falls on: a day is
+    either rolled up whole or left raw, never split. Runs in one write
+    transaction. Days that already have a roll-up are merged into it, so running
+    the job again (or with a shorter horizon) is safe.
+
+    Returns the number of check-ins compacted.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+
+        cursor.execute("""
+            SELECT user_id, timestamp, energy_level, stage
+            FROM energy_logs
+            WHERE timestamp < ?
+        """, (cutoff_ms,))
+        rows = cursor.fetchall()
+        cursor.execute("""
+            SELECT DISTINCT user_id FROM energy_insights
+            WHERE mood_state = 'check-in' AND timestamp < ?
+        """, (cutoff_ms,))
+        users = {row[0] for row in rows} | {row[0] for row in cursor.fetchall()}
+        zones = {user_id: user_timezone(user_id) for user_id in users}
+        cutoffs = {user_id: _day_start_ms(cutoff_ms, zone) for user_id, zone in zones.items()}
+
+        rows = [row for row in rows if row[1] < cutoffs[row[0]]]
+        rollups = _daily_rollups(rows, zones)
+
+        cursor.executemany("""
+            INSERT INTO energy_daily_rollups
+                (user_id, day, checkin_count, energy_sum, energy_min, energy_max,
+                 start_count, start_sum, mid_count, mid_sum, end_count, end_sum,
+                 first_timestamp, last_timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, day) DO UPDATE SET
+                checkin_count = checkin_count + excluded.checkin_count,
+                energy_sum = energy_sum + excluded.energy_sum,
+                energy_min = MIN(energy_min, excluded.energy_min),
+                energy_max = MAX(energy_max, excluded.energy_max),
+                start_count = start_count + excluded.start_count,
+                start_sum = start_sum + excluded.start_sum,
+                mid_count = mid_count + excluded.mid_count,
+                mid_sum = mid_sum + excluded.mid_sum,
+                end_count = end_count + excluded.end_count,
+                end_sum = end_sum + excluded.end_sum,
+                first_timestamp = MIN(first_timestamp, excluded.first_timestamp),
+                last_timestamp = MAX(last_timestamp, excluded.last_timestamp)
+        """, rollups)
+
+        cursor.executemany("DELETE FROM energy_logs WHERE user_id = ? AND timestamp < ?", cutoffs.items())
+        compacted = len(rows)
+
+        # The automatic copies /log_energy writes for the chart are covered by the roll-ups now
+        cursor.executemany("""
+            DELETE FROM energy_insights
+            WHERE user_id = ? AND mood_state = 'check-in' AND timestamp < ?
+        """, cutoffs.items())
+
+        conn.commit()
+        return compacted
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+
+def incremental_vacuum(conn):
+    """
+    Return free pages to the file system; returns False if the database can't yet.
+
+    incremental_vacuum only works once auto_vacuum is INCREMENTAL, which for an
+    existing database needs the one-off rebuild_for_incremental_vacuum(). Until
+    then the freed pages are reused by later writes but the file does not shrink.
+    """
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if auto_vacuum != AUTO_VACUUM_INCREMENTAL:
+        logger.warning("Database is not in incremental auto-vacuum mode, so it keeps its free pages; "
+                       "run 'python3 retention.py --rebuild' once while the app is stopped")
+        return False
+    # The pragma frees pages one step per result row, so it has to be drained
+    conn.execute("PRAGMA incremental_vacuum").fetchall()
+    return True
+
+
+def rebuild_for_incremental_vacuum(conn):
+    """Switch a database to incremental auto-vacuum with a full VACUUM (locks it until done)"""
+    logger.info("Switching database to incremental auto-vacuum (one-off full VACUUM)")
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def run_retention(conn, days=DEFAULT_RETENTION_DAYS, user_timezone=_server_timezone):
+    """Roll up check-ins older than `days` days and vacuum; returns the number compacted"""
+    compacted = roll_up_energy_logs(conn, retention_cutoff_ms(days), user_timezone)
+    if compacted:
+        incremental_vacuum(conn)
+    logger.info("Retention: rolled up %d check-ins older than %d days", compacted, days)
+    return compacted
+
+
+class RetentionJob:
+    """Runs run_retention() against a set of connection pools on a background thread"""
+
+    def __init__(self, pools, days, user_timezone=_server_timezone, interval=RUN_INTERVAL):
+        self.pools = pools
+        self.days = days
+        self.user_timezone = user_timezone  # user id -> tzinfo
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """Apply retention to every pool, one database at a time"""
+        for pool in self.pools:
+            try:
+                with pool.connection() as conn:
+                    run_retention(conn, self.days, self.user_timezone)
+            except sqlite3.Error as e:
+                logger.error("Retention failed for %s: %s", pool.db_path, str(e))
+
+    def start(self):
+        """Start the job thread; the first run happens straight away"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="deepflow-retention", daemon=True)
+        self._thread.start()
+        logger.info("Retention job started (horizon %d days)", self.days)
+
+    def stop(self):
+        """Stop the job thread after its current run"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            self.run_once()
+            if self._stop.wait(self.interval):
+                return
+
+
+def init_app(app, pools, user_timezone):
+    """
+    Start the background retention job if DEEPFLOW_RETENTION_DAYS is set; check-ins
+    are rolled up by the days of user_timezone(user_id), looked up in an app context
+    """
+    days = os.environ.get('DEEPFLOW_RETENTION_DAYS')
+    if not days:
+        return None
+
+    def zone(user_id):
+        with app.app_context():
+            return user_timezone(user_id)
+
+    job = RetentionJob(pools, int(days), zone)
+    job.start()
+    app.extensions['deepflow_retention'] = job
+    return job
+
+
+def _zones_from_users(conn):
+    """user id -> tzinfo from the users table of conn's database, as timezones.py resolves it"""
+    def zone(user_id):
+        try:
+            row = conn.execute("SELECT country, state_province FROM users WHERE id = ?", (user_id,)).fetchone()
+        except sqlite3.OperationalError:  # A shard without the users table
+            row = None
+        return timezones.zone_for(*row) if row else timezones.DEFAULT_ZONE
+    return zone
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    args = sys.argv[1:]
+    rebuild = '--rebuild' in args
+    args = [arg for arg in args if arg != '--rebuild']
+    target = args[0] if args else migrations.DB_PATH
+    horizon = int(os.environ.get('DEEPFLOW_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+    try:
+        migrations.migrate_database(target)
+        conn = sqlite3.connect(target)
+        try:
+            if rebuild:
+                rebuild_for_incremental_vacuum(conn)
+            count = run_retention(conn, horizon, _zones_from_users(conn))
+        finally:
+            conn.close()
+        print(f"✅ Rolled up {count} check-ins older than {horizon} days in {target}.")
+    except sqlite3.Error as e:
+        print(f"❌ Retention failed: {e}")
+        sys.exit(1)
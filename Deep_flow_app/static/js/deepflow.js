@@ -157,17 +157,12 @@ function startTimerDirectly(timerId) {
         window.stopTimerFlashing(timerId);
     }
     
-    fetch(`/start_timer/${timerId}`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        }
-    })
-    .then(response => response.json())
+    // Idempotent and version-checked like the other timer buttons (see timer-toggle.js)
+    sendTimerCommand(timerId, 'start')
     .then(data => {
         if (data.success) {
             window.location.reload();
-        } else {
+        } else if (!data.conflict) {
             alert(`Error starting timer: ${data.error}`);
         }
     })
@@ -183,17 +178,12 @@ function stopTimerDirectly(timerId) {
         window.stopTimerFlashing(timerId);
     }
     
-    fetch(`/stop_timer/${timerId}`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        }
-    })
-    .then(response => response.json())
+    // Idempotent and version-checked like the other timer buttons (see timer-toggle.js)
+    sendTimerCommand(timerId, 'stop')
     .then(data => {
         if (data.success) {
             window.location.reload();
-        } else {
+        } else if (!data.conflict) {
             alert(`Error stopping timer: ${data.error}`);
         }
     })
@@ -76,11 +76,18 @@ document.addEventListener('DOMContentLoaded', function () {
         const nextWeekBtn = document.getElementById('next-week-btn');
         const currentWeekDisplay = document.getElementById('current-week-display');
         
+        const prevWeekBtn = document.getElementById('prev-week-btn');
+        
         // Disable next week button if at current period
         if (nextWeekBtn) {
             nextWeekBtn.disabled = (currentWeekOffset >= 0);
         }
         
+        // The all-time view already shows everything
+        if (prevWeekBtn) {
+            prevWeekBtn.disabled = (currentDataRange === 'all');
+        }
+        
         // Update display based on data range
         if (currentWeekDisplay) {
             if (currentDataRange === 'week') {
@@ -129,9 +136,11 @@ document.addEventListener('DOMContentLoaded', function () {
                 return { energyData: monthlyData, preferencesData };
             });
         } else {
-            // Fetch all data (existing behavior)
+            // Fetch the whole history downsampled by the server to about one point per pixel of the chart,
+            // so the payload and the render stay the same size however long the history gets
+            const points = Math.round((chartContainer.clientWidth || 800) * (window.devicePixelRatio || 1));
             dataPromise = Promise.all([
-                fetch('/get_energy_logs').then(response => response.json()),
+                fetch(`/get_energy_logs?points=${points}`).then(response => response.json()),
                 fetch('/get_user_preferences').then(response => response.json())
             ]).then(([energyData, preferencesData]) => {
                 // Hide weekly feedback for all-time view
@@ -21,10 +21,152 @@ document.addEventListener('DOMContentLoaded', function() {
      * Initialize all countdown timers on the page
      */
     function initializeCountdowns() {
-        document.querySelectorAll('.timer-countdown').forEach(function(countdownEl) {
-            const timerId = countdownEl.id.replace('countdown-', '');
-            initializeTimer(timerId);
+        // The dashboard embeds every timer's state, so the countdowns can start straight away
+        if (window.initialTimerStates) {
+            window.initialTimerStates.forEach(applyTimerState);
+        }
+        
+        // Then one server-sent event stream keeps them up to date
+        if (window.EventSource) {
+            connectTimerStream();
+        } else if (!window.initialTimerStates) {
+            loadTimerStates();
+        }
+    }
+    
+    /**
+     * Initialize every countdown from one /get_timer_states request
+     */
+    function loadTimerStates() {
+        fetch('/get_timer_states')
+            .then(response => response.json())
+            .then(data => {
+                if (data.success) {
+                    data.timers.forEach(applyTimerState);
+                } else {
+                    console.error('Failed to get timer states:', data.error);
+                }
+            })
+            .catch(error => {
+                console.error('Error getting timer states:', error);
+                // Fallback to old logic if backend fails
+                document.querySelectorAll('.timer-countdown').forEach(function(countdownEl) {
+                    initializeTimerFallback(countdownEl.id.replace('countdown-', ''));
+                });
+            });
+    }
+    
+    /**
+     * Follow /timers/stream: a snapshot of all timers, then one event per change
+     */
+    function connectTimerStream() {
+        const stream = new EventSource('/timers/stream');
+        let receivedSnapshot = false;
+        
+        stream.addEventListener('snapshot', function(event) {
+            receivedSnapshot = true;
+            window.timerStreamConnected = true;
+            JSON.parse(event.data).timers.forEach(applyTimerState);
         });
+        
+        ['started', 'paused', 'resumed', 'stopped'].forEach(function(type) {
+            stream.addEventListener(type, function(event) {
+                applyTimerState(JSON.parse(event.data));
+            });
+        });
+        
+        stream.addEventListener('expired', function(event) {
+            expireTimer(String(JSON.parse(event.data).id));
+        });
+        
+        stream.onerror = function() {
+            window.timerStreamConnected = false;
+            if (!receivedSnapshot) {
+                // The stream never came up; stay with the embedded state, or load it once
+                stream.close();
+                if (!window.initialTimerStates) {
+                    loadTimerStates();
+                }
+            }
+            // Otherwise EventSource reconnects by itself and gets a fresh snapshot
+        };
+        
+        window.timerStream = stream;
+    }
+    
+    /**
+     * Bring one timer's countdown in line with its state from the server
+     * @param {Object} timer - Timer state as /get_timer_state returns it
+     */
+    function applyTimerState(timer) {
+        const timerId = String(timer.id);
+        const timerItem = document.querySelector(`.timer-item[data-timer-id="${timerId}"]`);
+        if (!timerItem) return;
+        
+        // Sent back with the next action so it only applies to this state
+        window.timerVersions = window.timerVersions || {};
+        window.timerVersions[timerId] = timer.version;
+        
+        const countdownEl = document.querySelector(`#countdown-${timerId} .time-display`);
+        
+        // Finished here and stopped by the server meanwhile; the end check-in reloads the page
+        if (timer.is_running === 0 && timerItem.classList.contains('timer-completed')) return;
+        
+        // Started or stopped somewhere else (e.g. another tab): the page needs the other layout
+        if ((timer.is_running === 0) === Boolean(countdownEl)) {
+            window.location.reload();
+            return;
+        }
+        if (!countdownEl) return;
+        
+        if (window.updateTimerUI) {
+            window.updateTimerUI(timerId, timer.is_running === 1 ? 'running' : 'paused');
+        }
+        
+        if (timer.is_running === 1) {
+            // Already finished here and waiting on the end check-in; don't finish it twice
+            if (timer.remaining_time <= 0 && timerItem.classList.contains('timer-completed')) return;
+            startCountdownFromRemaining(timerId, timer.remaining_time, timer.duration);
+        } else {
+            if (window.timerCountdowns[timerId]) {
+                clearInterval(window.timerCountdowns[timerId]);
+                delete window.timerCountdowns[timerId];
+            }
+            displayRemainingTime(countdownEl, timer.remaining_time);
+        }
+    }
+    
+    /**
+     * The server saw a timer run out; finish its countdown if this tab hasn't yet
+     * (background tabs may have their intervals throttled)
+     * @param {string} timerId - ID of the timer
+     */
+    function expireTimer(timerId) {
+        if (!window.timerCountdowns[timerId]) return;
+        
+        const countdownEl = document.querySelector(`#countdown-${timerId} .time-display`);
+        if (countdownEl) {
+            updateCountdownDisplay(countdownEl, new Date(), timerId);
+        }
+        finishCountdown(timerId);
+    }
+    
+    /**
+     * Stop a countdown that reached zero and ask for the end-of-session check-in
+     * @param {string} timerId - ID of the timer
+     */
+    function finishCountdown(timerId) {
+        clearInterval(window.timerCountdowns[timerId]);
+        delete window.timerCountdowns[timerId];
+        
+        // Show the energy check-in modal instead of reloading
+        console.log(`Timer ${timerId} finished. Showing energy check-in modal.`);
+        if (window.showEnergyCheckinModal) {
+            window.showEnergyCheckinModal(timerId, 'end');
+        } else {
+            console.error('showEnergyCheckinModal function not found. Reloading as a fallback.');
+            window.location.reload();
+        }
     }
     
     /**
@@ -80,8 +222,8 @@ document.addEventListener('DOMContentLoaded', function() {
             const timeDisplay = countdownEl.querySelector('.time-display');
             if (timeDisplay) {
                 // Calculate the elapsed time until the pause
-                const startDate = new Date(startTime.replace(' ', 'T'));
-                const pauseDate = new Date(pausedAt.replace(' ', 'T'));
+                const startDate = parseTimerTimestamp(startTime);
+                const pauseDate = parseTimerTimestamp(pausedAt);
                 const elapsedSeconds = Math.floor((pauseDate - startDate) / 1000);
                 const remainingSeconds = Math.max(0, duration - elapsedSeconds);
                 
@@ -90,12 +232,25 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
+    /**
+     * Parse a timer timestamp from a data attribute
+     * @param {string} value - Epoch milliseconds (or a legacy 'YYYY-MM-DD HH:MM:SS' string)
+     * @returns {Date} - The parsed date
+     */
+    function parseTimerTimestamp(value) {
+        if (/^\d+$/.test(value)) {
+            return new Date(Number(value));
+        }
+        return new Date(value.replace(' ', 'T'));
+    }
+    
     /**
      * Start countdown for a specific timer using remaining milliseconds
      * @param {string} timerId - ID of the timer
      * @param {number} remainingMs - Remaining time in milliseconds
+     * @param {number} [durationSeconds] - Total duration; looked up from the backend if omitted
      */
-    function startCountdownFromRemaining(timerId, remainingMs) {
+    function startCountdownFromRemaining(timerId, remainingMs, durationSeconds) {
         // Clear any existing countdown for this timer
         if (window.timerCountdowns[timerId]) {
             clearInterval(window.timerCountdowns[timerId]);
@@ -107,51 +262,18 @@ document.addEventListener('DOMContentLoaded', function() {
         // Calculate end time based on current time and remaining milliseconds
         const endTime = new Date(Date.now() + remainingMs);
         
+        // Timer states from the stream already carry the duration
+        if (durationSeconds !== undefined) {
+            runCountdown(timerId, countdownEl, endTime, durationSeconds * 1000, remainingMs);
+            return;
+        }
+        
         // Get timer state to determine original duration for mid-session check-in logic
         fetch(`/get_timer_state/${timerId}`)
             .then(response => response.json())
             .then(data => {
                 if (data.success) {
-                    const totalDurationMs = data.timer.duration * 1000; // Convert seconds to milliseconds
-                    const elapsedMs = totalDurationMs - remainingMs;
-                    const midPointMs = totalDurationMs / 2;
-                    
-                    // Track if mid-session check-in has been shown (check if we've passed midpoint)
-                    let midSessionShown = elapsedMs >= midPointMs;
-                    
-                    // Update immediately
-                    updateCountdownDisplay(countdownEl, endTime, timerId);
-                    
-                    // Set interval to update countdown
-                    window.timerCountdowns[timerId] = setInterval(function() {
-                        const isComplete = updateCountdownDisplay(countdownEl, endTime, timerId);
-                        const currentRemainingMs = endTime.getTime() - Date.now();
-                        const currentElapsedMs = totalDurationMs - currentRemainingMs;
-                        
-                        // Check for mid-session check-in (only for sessions longer than 30 minutes)
-                        if (!midSessionShown && totalDurationMs >= 1800000 && currentElapsedMs >= midPointMs) {
-                            midSessionShown = true;
-                            console.log(`Timer ${timerId} reached midpoint. Showing mid-session check-in.`);
-                            if (window.showEnergyCheckinModal) {
-                                window.showEnergyCheckinModal(timerId, 'mid');
-                            }
-                        }
-                        
-                        // If countdown is complete, clear interval and show energy check-in
-                        if (isComplete) {
-                            clearInterval(window.timerCountdowns[timerId]);
-                            delete window.timerCountdowns[timerId];
-                            
-                            // Show the energy check-in modal instead of reloading
-                            console.log(`Timer ${timerId} finished. Showing energy check-in modal.`);
-                            if (window.showEnergyCheckinModal) {
-                                window.showEnergyCheckinModal(timerId, 'end');
-                            } else {
-                                console.error('showEnergyCheckinModal function not found. Reloading as a fallback.');
-                                window.location.reload();
-                            }
-                        }
-                    }, 1000);
+                    runCountdown(timerId, countdownEl, endTime, data.timer.duration * 1000, remainingMs);
                 } else {
                     // Fallback to simple countdown without mid-session check-in
                     startSimpleCountdown(timerId, remainingMs, endTime, countdownEl);
@@ -164,6 +286,51 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
     
+    /**
+     * Run the countdown interval, with the mid-session check-in for long sessions
+     * @param {string} timerId - ID of the timer
+     * @param {Element} countdownEl - The time display element
+     * @param {Date} endTime - When the timer runs out
+     * @param {number} totalDurationMs - Total duration in milliseconds
+     * @param {number} remainingMs - Remaining time in milliseconds at endTime's calculation
+     */
+    function runCountdown(timerId, countdownEl, endTime, totalDurationMs, remainingMs) {
+        // Clear a countdown a concurrent start may have set up meanwhile
+        if (window.timerCountdowns[timerId]) {
+            clearInterval(window.timerCountdowns[timerId]);
+        }
+        
+        const elapsedMs = totalDurationMs - remainingMs;
+        const midPointMs = totalDurationMs / 2;
+        
+        // Track if mid-session check-in has been shown (check if we've passed midpoint)
+        let midSessionShown = elapsedMs >= midPointMs;
+        
+        // Update immediately
+        updateCountdownDisplay(countdownEl, endTime, timerId);
+        
+        // Set interval to update countdown
+        window.timerCountdowns[timerId] = setInterval(function() {
+            const isComplete = updateCountdownDisplay(countdownEl, endTime, timerId);
+            const currentRemainingMs = endTime.getTime() - Date.now();
+            const currentElapsedMs = totalDurationMs - currentRemainingMs;
+            
+            // Check for mid-session check-in (only for sessions longer than 30 minutes)
+            if (!midSessionShown && totalDurationMs >= 1800000 && currentElapsedMs >= midPointMs) {
+                midSessionShown = true;
+                console.log(`Timer ${timerId} reached midpoint. Showing mid-session check-in.`);
+                if (window.showEnergyCheckinModal) {
+                    window.showEnergyCheckinModal(timerId, 'mid');
+                }
+            }
+            
+            // If countdown is complete, clear interval and show energy check-in
+            if (isComplete) {
+                finishCountdown(timerId);
+            }
+        }, 1000);
+    }
+    
     /**
      * Fallback simple countdown without mid-session check-in
      */
@@ -217,7 +384,7 @@ document.addEventListener('DOMContentLoaded', function() {
      * Start countdown for a specific timer
      * @param {string} timerId - ID of the timer
      * @param {number} durationSeconds - Total duration in seconds
-     * @param {string} startTimeStr - Start time string from the database
+     * @param {string} startTimeStr - Start time from the database (epoch milliseconds)
      */
     function startCountdown(timerId, durationSeconds, startTimeStr) {
         // Clear any existing countdown for this timer
@@ -229,7 +396,7 @@ document.addEventListener('DOMContentLoaded', function() {
         if (!countdownEl) return;
         
         // Parse start time 
-        const startTime = new Date(startTimeStr.replace(' ', 'T'));
+        const startTime = parseTimerTimestamp(startTimeStr);
         if (isNaN(startTime.getTime())) {
             console.error(`Invalid start time: ${startTimeStr}`);
             countdownEl.textContent = 'Error: Invalid start time';
@@ -358,13 +525,7 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Make stopTimerDirectly globally available for timer completion
     window.stopTimerDirectly = function(timerId) {
-        fetch(`/stop_timer/${timerId}`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            }
-        })
-        .then(response => response.json())
+        sendTimerCommand(timerId, 'stop')
         .then(data => {
             if (data.success) {
                 window.location.reload();
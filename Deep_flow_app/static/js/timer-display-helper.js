@@ -16,11 +16,19 @@ function formatTimeRemaining(remainingSeconds) {
     return `${hours.toString().padStart(2, '0')}:${minutes.toString().padStart(2, '0')}:${seconds.toString().padStart(2, '0')}`;
 }
 
+// Parse a timer timestamp: epoch milliseconds, or a legacy 'YYYY-MM-DD HH:MM:SS' string
+function parseTimestampAttribute(value) {
+    if (/^\d+$/.test(value)) {
+        return new Date(Number(value));
+    }
+    return new Date(value.replace(' ', 'T'));
+}
+
 // Calculate remaining time for a paused timer
 function calculatePausedTimeRemaining(startTimeStr, pausedAtStr, durationSeconds) {
     try {
-        const startTime = new Date(startTimeStr.replace(' ', 'T'));
-        const pausedAt = new Date(pausedAtStr.replace(' ', 'T'));
+        const startTime = parseTimestampAttribute(startTimeStr);
+        const pausedAt = parseTimestampAttribute(pausedAtStr);
         
         if (isNaN(startTime.getTime()) || isNaN(pausedAt.getTime())) {
             console.error('Invalid date format for time calculation');
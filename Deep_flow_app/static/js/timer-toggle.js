@@ -1,3 +1,65 @@
+// Latest version of each timer seen by this page (see applyTimerState in timer-countdown.js)
+window.timerVersions = window.timerVersions || {};
+
+const TIMER_COMMAND_RETRIES = 3;
+
+/**
+ * Send a timer action. The request carries an idempotency key, so network
+ * failures are retried with the same key without the risk of applying the
+ * action twice, and the timer version this page last saw, so an action based
+ * on an outdated view is refused (409) instead of overwriting another tab's.
+ * On a 409 the page reloads to show the timer's current state, and the promise
+ * resolves with the response marked conflict: true (and success: false), which
+ * callers should not report as an error.
+ * @param {string} timerId - ID of the timer
+ * @param {string} action - 'start', 'pause', 'resume' or 'stop'
+ * @returns {Promise<Object>} - The parsed JSON response
+ */
+function sendTimerCommand(timerId, action) {
+    const key = window.crypto && window.crypto.randomUUID
+        ? window.crypto.randomUUID()
+        : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    const body = JSON.stringify({
+        idempotency_key: key,
+        expected_version: window.timerVersions[timerId]
+    });
+    
+    function attempt(retriesLeft) {
+        return fetch(`/${action}_timer/${timerId}`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: body
+        })
+        .catch(error => {
+            if (retriesLeft <= 0) throw error;
+            console.warn(`Retrying ${action} of timer ${timerId}:`, error);
+            return new Promise(resolve => setTimeout(resolve, 500 * (TIMER_COMMAND_RETRIES - retriesLeft + 1)))
+                .then(() => attempt(retriesLeft - 1));
+        });
+    }
+    
+    return attempt(TIMER_COMMAND_RETRIES)
+        .then(response => {
+            if (response.status === 409) {
+                // The timer changed elsewhere (another tab or device); show its current state
+                window.location.reload();
+                return response.json()
+                    .catch(() => ({}))
+                    .then(data => Object.assign({ error: 'The timer changed elsewhere' }, data,
+                                                { success: false, conflict: true }));
+            }
+            return response.json();
+        })
+        .then(data => {
+            if (data.success && data.version !== undefined) {
+                window.timerVersions[timerId] = data.version;
+            }
+            return data;
+        });
+}
+
 function startTimer(timerId) {
     console.log(`Attempting to start timer with ID: ${timerId}`);
 
@@ -7,20 +69,13 @@ function startTimer(timerId) {
     }
 
     // Make a request to the backend to start the timer
-    fetch(`/start_timer/${timerId}`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-            // Include any necessary headers, like CSRF tokens if required
-        },
-    })
-    .then(response => response.json())
+    sendTimerCommand(timerId, 'start')
     .then(data => {
         if (data.success) {
             console.log(`Timer ${timerId} started successfully on the server.`);
             // Reload the page to update the timer's state and start the countdown
             window.location.reload();
-        } else {
+        } else if (!data.conflict) {
             console.error(`Failed to start timer ${timerId}:`, data.error);
             alert(`Could not start the timer: ${data.error}`);
         }
@@ -37,13 +92,7 @@ function pauseTimer(timerId) {
         window.stopTimerFlashing(timerId);
     }
     
-    fetch(`/pause_timer/${timerId}`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-    })
-    .then(response => response.json())
+    sendTimerCommand(timerId, 'pause')
     .then(data => {
         if (data.success) {
             // Stop the countdown and update UI to show paused state
@@ -57,7 +106,7 @@ function pauseTimer(timerId) {
             
             // Get the current timer state from backend to show accurate remaining time
             refreshTimerState(timerId);
-        } else {
+        } else if (!data.conflict) {
             alert(`Error: ${data.error}`);
         }
     })
@@ -73,13 +122,7 @@ function resumeTimer(timerId) {
         window.stopTimerFlashing(timerId);
     }
     
-    fetch(`/resume_timer/${timerId}`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-    })
-    .then(response => response.json())
+    sendTimerCommand(timerId, 'resume')
     .then(data => {
         if (data.success) {
             // Update timer UI to show running state
@@ -87,7 +130,7 @@ function resumeTimer(timerId) {
             
             // Get the current timer state from backend and start countdown with accurate remaining time
             refreshTimerState(timerId);
-        } else {
+        } else if (!data.conflict) {
             alert(`Error: ${data.error}`);
         }
     })
@@ -103,17 +146,11 @@ function stopTimer(timerId) {
         window.stopTimerFlashing(timerId);
     }
     
-    fetch(`/stop_timer/${timerId}`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-    })
-    .then(response => response.json())
+    sendTimerCommand(timerId, 'stop')
     .then(data => {
         if (data.success) {
             window.location.reload();
-        } else {
+        } else if (!data.conflict) {
             alert(`Error: ${data.error}`);
         }
     });
@@ -174,6 +211,9 @@ function updateTimerUI(timerId, state) {
  * @param {string} timerId - ID of the timer
  */
 function refreshTimerState(timerId) {
+    // The live timer stream delivers the new state by itself
+    if (window.timerStreamConnected) return;
+    
     fetch(`/get_timer_state/${timerId}`)
         .then(response => response.json())
         .then(data => {
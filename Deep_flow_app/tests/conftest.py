@@ -0,0 +1,75 @@
+"""
+Shared fixtures for DeepFlow's tests.
+
+app.py sets itself up at import time, so the database path is pointed at a
+scratch directory before it is imported; every test then signs up a user of
+its own, which keeps tests independent while they share one app.
+"""
+import os
+import sys
+import itertools
+import contextlib
+import tempfile
+
+import pytest
+from flask import session
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault('DEEPFLOW_DB_PATH', os.path.join(tempfile.mkdtemp(prefix='deepflow-tests-'), 'Deepflow.db'))
+
+import app as deepflow_app  # noqa: E402
+import database  # noqa: E402
+
+PASSWORD = 'Passw0rd!xx'
+_usernames = (f"tester{n}" for n in itertools.count(1))
+
+
+@deepflow_app.app.before_request
+def refresh_analytics_snapshot():
+    """
+    With DEEPFLOW_ANALYTICS_SNAPSHOT_SECONDS set, analytics reads come from a copy of the
+    database refreshed in the background; bring it up to date so tests read what they wrote
+    """
+    database.refresh_snapshot()
+
+
+@pytest.fixture
+def app():
+    deepflow_app.app.config['TESTING'] = True
+    return deepflow_app.app
+
+
+@pytest.fixture
+def repos():
+    return deepflow_app.repos
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user(app, client, repos):
+    """A signed-up, logged-in user with one timer: (user_id, timer_id)"""
+    username = next(_usernames)
+    client.post('/signup', data={'username': username, 'password': PASSWORD, 'confirm_password': PASSWORD})
+    client.post('/login', data={'username': username, 'password': PASSWORD})
+    client.post('/add_timer', data={'name': 'Focus', 'duration': '30'})
+    with app.app_context():
+        user_id = repos.users.get_by_username(username).id
+    timers = client.get('/get_timer_states').get_json()['timers']
+    return user_id, timers[0]['id']
+
+
+@pytest.fixture
+def as_user(app):
+    """Context manager running storage calls inside a request for a user, as the routes do"""
+    @contextlib.contextmanager
+    def request_for(user_id):
+        with app.test_request_context():
+            session['user_id'] = user_id
+            database.refresh_snapshot()
+            yield
+    return request_for
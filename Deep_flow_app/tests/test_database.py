@@ -0,0 +1,89 @@
+"""Tests for database.py's connection pools"""
+import sqlite3
+
+import pytest
+from flask import session
+
+import database
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "Deepflow.db")
+
+
+def test_pool_opens_more_when_empty_and_keeps_only_max_idle(db_path):
+    pool = database.ConnectionPool(db_path, max_idle=2)
+    checked_out = [pool.acquire() for _ in range(3)]
+    assert len(set(map(id, checked_out))) == 3
+    
+    for conn in checked_out:
+        pool.release(conn)
+    
+    # The last one back is closed, and the most recently used of the others is handed out first
+    with pytest.raises(sqlite3.ProgrammingError):
+        checked_out[2].execute("SELECT 1")
+    assert pool.acquire() is checked_out[1]
+    assert pool.acquire() is checked_out[0]
+    assert pool.acquire() not in checked_out
+
+
+def test_released_connections_come_back_configured_and_without_open_transactions(db_path):
+    pool = database.ConnectionPool(db_path, max_idle=1)
+    conn = pool.acquire()
+    conn.execute("CREATE TABLE notes (body TEXT)")
+    conn.commit()
+    conn.execute("INSERT INTO notes VALUES ('uncommitted')")
+    pool.release(conn)
+    
+    reused = pool.acquire()
+    assert reused is conn and not reused.in_transaction
+    assert reused.execute("SELECT COUNT(*) FROM notes").fetchone() == (0,)
+    assert reused.execute("PRAGMA journal_mode").fetchone() == ('wal',)
+
+
+def test_read_only_pool_refuses_writes(db_path):
+    with database.ConnectionPool(db_path).connection() as conn:
+        conn.execute("CREATE TABLE notes (body TEXT)")
+        conn.commit()
+    read_pool = database.ConnectionPool(db_path, pragmas=database.READ_ONLY_PRAGMAS, read_only=True)
+    
+    with read_pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM notes").fetchone() == (0,)
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            conn.execute("INSERT INTO notes VALUES ('nope')")
+
+
+def test_snapshot_shows_writes_once_refreshed(db_path, tmp_path):
+    pool = database.ConnectionPool(db_path)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE notes (body TEXT)")
+        conn.commit()
+    snapshot_path = str(tmp_path / "Deepflow.snapshot.db")
+    read_pool = database.ConnectionPool(snapshot_path, pragmas=database.READ_ONLY_PRAGMAS, read_only=True)
+    refresher = database.SnapshotRefresher(db_path, snapshot_path, read_pool)
+    refresher.refresh()
+    with pool.connection() as conn:
+        conn.execute("INSERT INTO notes VALUES ('new')")
+        conn.commit()
+    
+    with read_pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM notes").fetchone() == (0,)
+    refresher.refresh()
+    with read_pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM notes").fetchone() == (1,)
+
+
+def test_users_are_routed_to_shard_user_id_mod_n(app, monkeypatch, tmp_path):
+    paths = database.shard_paths(str(tmp_path / "Deepflow.db"), 3)
+    shard_pools = [database.ConnectionPool(path) for path in paths]
+    monkeypatch.setattr(database, '_shard_pools', shard_pools)
+    
+    assert [database.shard_for_user(user_id) for user_id in (3, 4, 5, "7")] == [0, 1, 2, 1]
+    assert database.current_pool() is database.get_pool()
+    for user_id in (10, 11, 12):
+        with app.test_request_context():
+            session['user_id'] = user_id
+            assert database.current_pool() is shard_pools[user_id % 3]
+            path = database.get_db().execute("PRAGMA database_list").fetchone()[2]
+            assert path == paths[user_id % 3]
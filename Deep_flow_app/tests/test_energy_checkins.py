@@ -0,0 +1,119 @@
+"""Tests for /log_energy and the energy check-in validation"""
+import os
+import threading
+
+import pytest
+
+import app as deepflow_app
+import database
+import write_queue
+
+
+def test_checkin_accepts_timer_id_as_sent_by_the_dashboard(client, user):
+    _, timer_id = user
+    
+    response = client.post('/log_energy', json={"timer_id": str(timer_id), "stage": "start", "energy_level": 7})
+    
+    assert response.status_code == 200, response.get_json()
+    timer = client.get(f'/get_timer_state/{timer_id}').get_json()['timer']
+    assert timer['is_running'] == 1
+
+
+def test_end_checkin_with_string_timer_id_stops_the_timer(client, user):
+    _, timer_id = user
+    client.post('/log_energy', json={"timer_id": str(timer_id), "stage": "start", "energy_level": 7})
+    
+    response = client.post('/log_energy', json={"timer_id": str(timer_id), "stage": "end", "energy_level": 4})
+    
+    assert response.status_code == 200, response.get_json()
+    assert client.get(f'/get_timer_state/{timer_id}').get_json()['timer']['is_running'] == 0
+
+
+def test_checkin_rejects_non_integer_timer_ids(client, user):
+    for timer_id in ("abc", "1.5", 1.5, True, [1], {"id": 1}):
+        response = client.post('/log_energy', json={"timer_id": timer_id, "stage": "mid", "energy_level": 5})
+        assert response.status_code == 400, timer_id
+
+
+def test_validate_energy_checkin_parses_timer_id():
+    checkin, error, status = deepflow_app.validate_energy_checkin(
+        {"timer_id": " 12 ", "stage": "mid", "energy_level": "6"}, None)
+    
+    assert error is None and status is None
+    assert checkin["timer_id"] == 12 and checkin["energy_level"] == 6
+
+
+def test_checkin_on_someone_elses_timer_is_not_found(client, user):
+    response = client.post('/log_energy', json={"timer_id": "999999", "stage": "mid", "energy_level": 5})
+    
+    assert response.status_code == 404
+
+
+def end_checkin(timer_id, **extra):
+    return {"timer_id": timer_id, "stage": "end", "energy_level": 5, **extra}
+
+
+def test_batch_stores_mixed_string_and_int_timer_ids(client, user):
+    _, timer_id = user
+    checkins = [{"timer_id": str(timer_id), "stage": "mid", "energy_level": 3},
+                {"timer_id": timer_id, "stage": "mid", "energy_level": 4}]
+    
+    response = client.post('/log_energy/batch', json={"checkins": checkins})
+    
+    assert response.status_code == 200, response.get_json()
+    body = response.get_json()
+    assert body["logged"] == 2
+    assert [result["status"] for result in body["results"]] == [200, 200]
+
+
+def test_batch_items_on_unknown_timers_do_not_use_up_the_limit(client, user):
+    _, timer_id = user
+    checkins = [end_checkin(999999) for _ in range(3)] + [end_checkin(str(timer_id)) for _ in range(5)]
+    
+    body = client.post('/log_energy/batch', json={"checkins": checkins}).get_json()
+    
+    assert [result["status"] for result in body["results"]] == [404] * 3 + [200] * 5
+    assert body["logged"] == 5
+    assert body["rate_limit"]["remaining_sessions"] == 0
+
+
+def test_concurrent_batches_cannot_both_take_the_last_slots(app, client, user):
+    _, timer_id = user
+    cookie = client.get_cookie('session')
+    barrier = threading.Barrier(2)
+    statuses = []
+    
+    def send_batch():
+        other = app.test_client()
+        other.set_cookie('session', cookie.value)
+        barrier.wait()
+        body = other.post('/log_energy/batch', json={"checkins": [end_checkin(timer_id) for _ in range(4)]}).get_json()
+        statuses.extend(result["status"] for result in body["results"])
+    
+    threads = [threading.Thread(target=send_batch) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert sorted(statuses) == [200] * 5 + [429] * 3
+
+
+def test_checkin_checks_and_inserts_in_one_immediate_transaction(repos, user, as_user):
+    if os.environ.get('DEEPFLOW_STORAGE', 'sqlite') != 'sqlite' or write_queue.get_write_queue():
+        pytest.skip("traces the request connection run_write() uses without the write queue")
+    user_id, timer_id = user
+    statements = []
+    with as_user(user_id):
+        conn = database.get_db()
+        conn.set_trace_callback(lambda sql: statements.append(" ".join(sql.split())))
+        try:
+            result = repos.energy.record_checkin(user_id, timer_id, "mid", 6)
+        finally:
+            conn.set_trace_callback(None)
+    
+    assert result.outcome == "logged"
+    kinds = [statement.split()[0].upper() for statement in statements]
+    # The ownership and preference check is inside the transaction, ahead of the inserts
+    assert kinds[0:2] == ["BEGIN", "SELECT"] and statements[0] == "BEGIN IMMEDIATE"
+    assert kinds[2:] == ["INSERT", "INSERT", "COMMIT"]
@@ -0,0 +1,111 @@
+"""Tests for /get_energy_logs: keyset paging, and downsampling long ranges to their lows and highs"""
+import pytest
+
+import app as deepflow_app
+
+DAY_MS = 24 * 60 * 60 * 1000
+FIRST = 1735689600000  # 2025-01-01 00:00 UTC
+
+
+def log_checkins(repos, as_user, user_id, timer_id, levels, first=FIRST, step=DAY_MS):
+    """One check-in per level, `step` apart from `first`"""
+    with as_user(user_id):
+        repos.energy.record_checkins(user_id, [
+            {"timer_id": timer_id, "stage": "mid", "energy_level": level, "timestamp": first + step * i}
+            for i, level in enumerate(levels)
+        ])
+
+
+def walk_pages(client, **params):
+    """Every page from the newest back, stitched together oldest first"""
+    pages = []
+    cursor = None
+    while True:
+        response = client.get('/get_energy_logs', query_string={**params, **({'cursor': cursor} if cursor else {})})
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+        pages.append(body['logs'])
+        cursor = body['next_cursor']
+        if cursor is None:
+            return [log for page in reversed(pages) for log in page]
+
+
+@pytest.mark.parametrize("limit", [1, 7])
+def test_pages_add_up_to_the_whole_log(client, repos, user, as_user, limit):
+    user_id, timer_id = user
+    # Each check-in shares its timestamp with the insight mirrored from it, so pages split ties
+    log_checkins(repos, as_user, user_id, timer_id, [3, 8, 5, 6, 2, 9, 4, 7, 1, 10])
+    
+    whole = client.get('/get_energy_logs', query_string={'limit': 100}).get_json()
+    
+    assert whole['next_cursor'] is None and len(whole['logs']) == 20
+    assert walk_pages(client, limit=limit) == whole['logs']
+
+
+def test_pages_keep_to_the_requested_range(client, repos, user, as_user):
+    user_id, timer_id = user
+    log_checkins(repos, as_user, user_id, timer_id, [1, 2, 3, 4, 5, 6])
+    
+    logs = walk_pages(client, limit=2, **{'from': FIRST + DAY_MS, 'to': FIRST + 3 * DAY_MS})
+    
+    assert [log['energy_level'] for log in logs if log['type'] == 'check-in'] == [2, 3, 4]
+
+
+def test_malformed_cursors_are_rejected(client, user):
+    for cursor in ("abc", "1.2", "1.2.3.4", "1735689600000.9.1", "1.x.3"):
+        response = client.get('/get_energy_logs', query_string={'cursor': cursor})
+        assert response.status_code == 400, cursor
+
+
+def test_parse_energy_log_cursor():
+    assert deepflow_app.parse_energy_log_cursor(None) is None
+    assert deepflow_app.parse_energy_log_cursor("") is None
+    assert deepflow_app.parse_energy_log_cursor("1735689600000.1.42") == (1735689600000, 1, 42)
+    with pytest.raises(ValueError):
+        deepflow_app.parse_energy_log_cursor("1735689600000.3.42")
+
+
+def test_few_logs_are_returned_as_they_are(client, repos, user, as_user):
+    user_id, timer_id = user
+    log_checkins(repos, as_user, user_id, timer_id, [3, 8, 5])
+    
+    sampled = client.get('/get_energy_logs?points=10').get_json()
+    paged = client.get('/get_energy_logs').get_json()
+    
+    assert sampled['downsampled'] is False
+    assert sampled['logs'] == paged['logs']
+
+
+def test_downsampling_keeps_the_lowest_and_highest_readings(client, repos, user, as_user):
+    user_id, timer_id = user
+    levels = [5, 6, 4, 7, 5] * 40
+    levels[37], levels[151] = 1, 10
+    log_checkins(repos, as_user, user_id, timer_id, levels, step=60 * 60 * 1000)
+    
+    response = client.get('/get_energy_logs?points=20').get_json()
+    
+    logs = response['logs']
+    assert response['downsampled'] is True
+    assert 0 < len(logs) <= 20
+    assert [log['timestamp'] for log in logs] == sorted(log['timestamp'] for log in logs)
+    assert min(log['energy_level'] for log in logs) == 1
+    assert max(log['energy_level'] for log in logs) == 10
+
+
+def test_span_and_extremes_leave_out_check_ins_of_deleted_timers(client, repos, user, as_user):
+    user_id, timer_id = user
+    client.post('/add_timer', data={'name': 'Gone', 'duration': '30'})
+    gone = max(timer['id'] for timer in client.get('/get_timer_states').get_json()['timers'])
+    log_checkins(repos, as_user, user_id, timer_id, [4, 5, 6])
+    log_checkins(repos, as_user, user_id, gone, [1, 10, 1], first=FIRST + DAY_MS // 2)
+    client.post(f'/delete_timer/{gone}')
+    
+    with as_user(user_id):
+        first, last, readings = repos.energy.energy_level_span(user_id, 0, FIRST + 10 * DAY_MS)
+        buckets = repos.energy.energy_level_extremes(user_id, first, last, DAY_MS)
+    
+    # The three visible check-ins plus the six chart insights mirrored from all of them
+    assert readings == 9
+    assert sum(bucket.readings for bucket in buckets) == readings
+    # Only what the page would show counts towards the points, so these come back untouched
+    assert client.get('/get_energy_logs?points=9').get_json()['downsampled'] is False
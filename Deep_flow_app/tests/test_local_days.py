@@ -0,0 +1,92 @@
+"""Tests for bucketing check-ins and roll-ups by the user's own calendar days"""
+import sqlite3
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import migrations
+import retention
+import timezones
+from timeutils import local_periods, to_epoch_ms
+
+SYDNEY = ZoneInfo('Australia/Sydney')
+LOS_ANGELES = ZoneInfo('America/Los_Angeles')
+
+
+def ms(*args, tz):
+    return to_epoch_ms(datetime(*args, tzinfo=tz))
+
+
+def test_local_periods_start_at_local_midnight_across_daylight_saving():
+    # Sydney moves from UTC+10 to UTC+11 at 2:00 on 5 October 2025
+    days, end = local_periods(date(2025, 10, 4), 3, SYDNEY)
+    
+    starts = [start for _, start in days] + [end]
+    assert [label for label, _ in days] == ['2025-10-04', '2025-10-05', '2025-10-06']
+    assert [(b - a) // 3600000 for a, b in zip(starts, starts[1:])] == [24, 23, 24]
+    assert days[0][1] == ms(2025, 10, 4, tz=SYDNEY)
+
+
+def test_local_periods_by_week():
+    weeks, end = local_periods(date(2025, 3, 3), 2, LOS_ANGELES, timedelta(weeks=1))
+    
+    assert [label for label, _ in weeks] == ['2025-03-03', '2025-03-10']
+    assert end == ms(2025, 3, 17, tz=LOS_ANGELES)
+
+
+def test_daily_totals_cut_days_in_the_given_timezone(repos, user, as_user):
+    user_id, timer_id = user
+    late = ms(2025, 1, 6, 23, 30, tz=SYDNEY)  # 04:30 on the 6th in Los Angeles
+    early = ms(2025, 1, 7, 0, 30, tz=SYDNEY)  # 05:30 on the 6th in Los Angeles
+    with as_user(user_id):
+        repos.energy.record_checkins(user_id, [
+            {"timer_id": timer_id, "stage": "mid", "energy_level": 4, "timestamp": late},
+            {"timer_id": timer_id, "stage": "mid", "energy_level": 8, "timestamp": early},
+        ])
+    
+    with as_user(user_id):
+        in_sydney = repos.energy.daily_totals(user_id, *local_periods(date(2025, 1, 6), 2, SYDNEY))
+        in_los_angeles = repos.energy.daily_totals(user_id, *local_periods(date(2025, 1, 5), 2, LOS_ANGELES))
+    
+    assert [tuple(row) for row in in_sydney] == [('2025-01-06', 4, 1), ('2025-01-07', 8, 1)]
+    assert [tuple(row) for row in in_los_angeles] == [('2025-01-06', 12, 2)]
+
+
+def test_weekly_insights_use_the_users_calendar_day(app, client, repos, user, as_user):
+    user_id, timer_id = user
+    with app.app_context():
+        repos.users.update_location(user_id, 'US', 'CA')
+        timezones.get_service().forget(user_id)
+    today = datetime.now(LOS_ANGELES).date()
+    late_tonight = to_epoch_ms(datetime.combine(today, datetime.min.time(), LOS_ANGELES) + timedelta(hours=23, minutes=30))
+    with as_user(user_id):
+        repos.energy.record_checkins(user_id, [
+            {"timer_id": timer_id, "stage": "mid", "energy_level": 6, "timestamp": late_tonight},
+        ])
+    
+    logs = client.get('/get_weekly_insights').get_json()['logs']
+    
+    assert [(log['date'], log['session_count']) for log in logs] == [(today.isoformat(), 1)]
+    assert logs[0]['timestamp'] == f"{today.isoformat()} 12:00:00"
+
+
+def test_roll_up_groups_check_ins_by_the_users_day(tmp_path):
+    db_path = str(tmp_path / "Deepflow.db")
+    migrations.migrate_database(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO energy_logs (user_id, timer_id, stage, energy_level, timestamp) VALUES (?, 1, ?, ?, ?)",
+        [(1, 'start', 3, ms(2025, 1, 1, 23, 30, tz=LOS_ANGELES)),
+         (1, 'end', 7, ms(2025, 1, 2, 0, 30, tz=LOS_ANGELES)),
+         (2, 'mid', 5, ms(2025, 1, 1, 23, 30, tz=SYDNEY))])
+    conn.commit()
+    zones = {1: LOS_ANGELES, 2: SYDNEY}
+    
+    compacted = retention.roll_up_energy_logs(conn, ms(2025, 2, 1, tz=SYDNEY), zones.get)
+    
+    rollups = conn.execute("""
+        SELECT user_id, day, checkin_count, energy_sum, start_count, end_count
+        FROM energy_daily_rollups ORDER BY user_id, day
+    """).fetchall()
+    conn.close()
+    assert compacted == 3
+    assert rollups == [(1, '2025-01-01', 1, 3, 1, 0), (1, '2025-01-02', 1, 7, 0, 1), (2, '2025-01-01', 1, 5, 0, 0)]
@@ -0,0 +1,17 @@
+"""Tests for serving cached user preferences with an ETag"""
+
+
+def test_saving_preferences_changes_the_etag(client, user):
+    first = client.get('/get_user_preferences')
+    etag = first.headers['ETag']
+    
+    assert client.get('/get_user_preferences', headers={'If-None-Match': etag}).status_code == 304
+    
+    client.post('/update_user_preferences', json={"enable_sound": True})
+    saved = client.get('/get_user_preferences', headers={'If-None-Match': etag})
+    
+    assert saved.status_code == 200
+    assert saved.headers['ETag'] != etag
+    assert saved.get_json()['preferences']['enable_sound'] is True
+    assert client.get('/get_user_preferences', headers={'If-None-Match': saved.headers['ETag']}).status_code == 304
+
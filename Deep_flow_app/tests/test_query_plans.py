@@ -0,0 +1,67 @@
+"""
+Query plan regression tests for DeepFlow's hot queries.
+
+Builds a scratch database with the application's schema through migrations and
+runs EXPLAIN QUERY PLAN on the SQL the SQLite backend actually issues (taken
+from repositories.py), failing if any of it falls back to a full table SCAN
+instead of searching one of the schema indexes.
+"""
+import re
+import sqlite3
+
+import pytest
+
+import migrations
+import repositories
+
+DAY_MS = 24 * 60 * 60 * 1000
+START, END = 1735689600000, 1736294400000
+CURSOR = (1736000000000, 10)
+DAYS = [(f"2025-01-0{n + 1}", START + n * DAY_MS) for n in range(7)]
+
+# (description, (query, parameters)) for every query on a hot path, nearly all of them per user
+HOT_QUERIES = [
+    ("dashboard: timers by user", (repositories.USER_TIMERS_SQL, (1,))),
+    ("rate limiter start-up: recent end check-ins", (repositories.RECENT_END_CHECKINS_SQL, (END,))),
+    ("get_daily_energy_totals: raw check-ins and roll-ups per day",
+     repositories.daily_totals_query(1, DAYS, END)),
+    ("get_energy_logs: first page of check-ins", repositories.checkins_page_query(1, 0, END, None, 501)),
+    ("get_energy_logs: later page of check-ins", repositories.checkins_page_query(1, 0, END, CURSOR, 501)),
+    ("get_energy_logs: first page of insights", repositories.insights_page_query(1, 0, END, None, 501)),
+    ("get_energy_logs: later page of insights", repositories.insights_page_query(1, 0, END, CURSOR, 501)),
+    ("get_energy_logs: daily roll-ups", (repositories.DAILY_ROLLUPS_SQL, (1, '1970-01-01', '2025-01-08', 502))),
+    ("get_energy_logs: span to downsample", (repositories.ENERGY_SPAN_SQL, (1, 0, END, 1, 0, END))),
+    ("get_energy_logs: lowest reading per bucket", repositories.energy_extremes_query(1, 0, END, DAY_MS, "MIN")),
+    ("get_energy_logs: highest reading per bucket", repositories.energy_extremes_query(1, 0, END, DAY_MS, "MAX")),
+    ("get_energy_insights: latest insights", (repositories.LATEST_INSIGHTS_SQL, (1, 10))),
+    ("get_shelf_items: shelf by user", (repositories.SHELF_ITEMS_SQL, (1,))),
+    ("get_focus_minutes: finished runs per day", repositories.focus_totals_query(1, DAYS, END)),
+    ("get_focus_minutes: finished runs per week", repositories.focus_totals_query(1, DAYS[:1], END)),
+]
+
+# Walking the rows a subquery already produced from an index search is not a table scan
+SUBQUERY_SCAN = re.compile(r"SCAN \(subquery-\d+\)$")
+
+
+@pytest.fixture(scope="module")
+def schema(tmp_path_factory):
+    db_path = str(tmp_path_factory.mktemp("plans") / "Deepflow.db")
+    migrations.migrate_database(db_path)
+    conn = sqlite3.connect(db_path)
+    yield conn
+    conn.close()
+
+
+def table_scans(conn, query, params):
+    plan = conn.execute("EXPLAIN QUERY PLAN " + query, params).fetchall()
+    return [row[3] for row in plan if row[3].startswith("SCAN") and not SUBQUERY_SCAN.match(row[3])]
+
+
+@pytest.mark.parametrize("query, params", [query for _, query in HOT_QUERIES],
+                         ids=[description for description, _ in HOT_QUERIES])
+def test_hot_query_uses_an_index(schema, query, params):
+    assert table_scans(schema, query, params) == []
+
+
+def test_a_full_scan_is_reported(schema):
+    assert table_scans(schema, "SELECT * FROM energy_logs WHERE energy_level = ?", (5,)) != []
@@ -0,0 +1,84 @@
+"""Tests for the energy check-in rate limiter's periods and counts"""
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from rate_limiter import CheckinRateLimiter, period_bounds
+from timeutils import now_ms, to_epoch_ms
+
+SYDNEY = ZoneInfo('Australia/Sydney')
+LOS_ANGELES = ZoneInfo('America/Los_Angeles')
+
+
+def ms(*args, tz):
+    return to_epoch_ms(datetime(*args, tzinfo=tz))
+
+
+def test_period_starts_at_six_in_the_users_timezone():
+    start, end = period_bounds(ms(2025, 3, 10, 14, 0, tz=LOS_ANGELES), LOS_ANGELES)
+    
+    assert (start.hour, start.day, end.hour, end.day) == (6, 10, 6, 11)
+
+
+def test_period_before_six_belongs_to_the_previous_day():
+    start, end = period_bounds(ms(2025, 3, 10, 5, 59, tz=SYDNEY), SYDNEY)
+    
+    assert (start.day, end.day) == (9, 10)
+    assert end.hour == 6
+
+
+def test_period_is_23_hours_when_daylight_saving_starts():
+    # Sydney moves from UTC+10 to UTC+11 at 2:00 on 5 October 2025
+    start, end = period_bounds(ms(2025, 10, 4, 20, 0, tz=SYDNEY), SYDNEY)
+    
+    assert (start.hour, end.hour) == (6, 6)
+    assert to_epoch_ms(end) - to_epoch_ms(start) == 23 * 60 * 60 * 1000
+
+
+def test_period_is_25_hours_when_daylight_saving_ends():
+    # Los Angeles moves from UTC-7 to UTC-8 at 2:00 on 2 November 2025
+    start, end = period_bounds(ms(2025, 11, 1, 20, 0, tz=LOS_ANGELES), LOS_ANGELES)
+    
+    assert to_epoch_ms(end) - to_epoch_ms(start) == 25 * 60 * 60 * 1000
+
+
+def test_same_instant_falls_in_different_periods_for_different_users():
+    instant = to_epoch_ms(datetime(2025, 6, 1, 21, 0, tzinfo=timezone.utc))  # 7:00 in Sydney, 14:00 in LA
+    
+    sydney_start, _ = period_bounds(instant, SYDNEY)
+    la_start, _ = period_bounds(instant, LOS_ANGELES)
+    
+    assert sydney_start.date().isoformat() == '2025-06-02'
+    assert la_start.date().isoformat() == '2025-06-01'
+
+
+def test_status_counts_only_the_current_period():
+    limiter = CheckinRateLimiter(lambda user_id: timezone.utc)
+    now = now_ms()
+    start, _ = period_bounds(now, timezone.utc)
+    limiter.record(1, 10, to_epoch_ms(start))
+    limiter.record(1, 10, to_epoch_ms(start - timedelta(milliseconds=1)))
+    
+    count, end = limiter.status(1, now=now)
+    
+    assert count == 1
+    assert end == start + timedelta(days=1)
+
+
+def test_status_excludes_a_timer_given_as_a_string():
+    limiter = CheckinRateLimiter(lambda user_id: timezone.utc)
+    now = now_ms()
+    limiter.load([(1, 10, now), (1, 11, now)])
+    limiter.record(1, "10", now)
+    
+    assert limiter.status(1, now=now)[0] == 3
+    assert limiter.status(1, exclude_timer_id="10", now=now)[0] == 1
+    assert limiter.status(1, exclude_timer_id=11, now=now)[0] == 2
+
+
+def test_forget_drops_the_users_checkins():
+    limiter = CheckinRateLimiter(lambda user_id: timezone.utc)
+    limiter.record(1, 10, now_ms())
+    
+    limiter.forget(1)
+    
+    assert limiter.status(1)[0] == 0
@@ -0,0 +1,79 @@
+"""Tests for retention.py's roll-up of old check-ins"""
+import sqlite3
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import database
+import migrations
+import retention
+from timeutils import to_epoch_ms
+
+LOS_ANGELES = ZoneInfo('America/Los_Angeles')
+
+
+def ms(*args, tz):
+    return to_epoch_ms(datetime(*args, tzinfo=tz))
+
+
+@pytest.fixture
+def conn(tmp_path):
+    db_path = str(tmp_path / "Deepflow.db")
+    migrations.migrate_database(db_path)
+    conn = sqlite3.connect(db_path)
+    yield conn
+    conn.close()
+
+
+def log(conn, *timestamps, user_id=1):
+    conn.executemany(
+        "INSERT INTO energy_logs (user_id, timer_id, stage, energy_level, timestamp) VALUES (?, 1, 'mid', 5, ?)",
+        [(user_id, timestamp) for timestamp in timestamps])
+    conn.executemany("""
+        INSERT INTO energy_insights (user_id, overall_energy, motivation_level, focus_clarity, physical_energy,
+                                     mood_state, notes, timestamp)
+        VALUES (?, 5, 5, 5, 5, 'check-in', 'Logged from timer mid', ?)
+    """, [(user_id, timestamp) for timestamp in timestamps])
+    conn.commit()
+
+
+def test_a_users_day_the_cutoff_falls_on_is_left_whole(conn):
+    # Midnight UTC on the 10th is 16:00 on the 9th in Los Angeles
+    cutoff = ms(2025, 1, 10, tz=timezone.utc)
+    rolled_up = ms(2025, 1, 8, 12, 0, tz=LOS_ANGELES)
+    same_day = [ms(2025, 1, 9, 8, 0, tz=LOS_ANGELES), ms(2025, 1, 9, 20, 0, tz=LOS_ANGELES)]
+    log(conn, rolled_up, *same_day)
+    
+    compacted = retention.roll_up_energy_logs(conn, cutoff, lambda user_id: LOS_ANGELES)
+    
+    assert compacted == 1
+    assert conn.execute("SELECT day, checkin_count FROM energy_daily_rollups").fetchall() == [('2025-01-08', 1)]
+    assert [row[0] for row in conn.execute("SELECT timestamp FROM energy_logs ORDER BY timestamp")] == same_day
+    assert [row[0] for row in conn.execute("SELECT timestamp FROM energy_insights ORDER BY timestamp")] == same_day
+
+
+def test_new_databases_vacuum_incrementally(conn):
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == retention.AUTO_VACUUM_INCREMENTAL
+    assert retention.incremental_vacuum(conn) is True
+
+
+def test_the_apps_databases_are_created_for_incremental_vacuum(app):
+    for pool in database.get_pools():
+        with pool.connection() as conn:
+            assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == retention.AUTO_VACUUM_INCREMENTAL
+
+
+def test_older_databases_are_not_rebuilt_by_the_job(tmp_path):
+    db_path = str(tmp_path / "Deepflow.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT UNIQUE NOT NULL, password TEXT NOT NULL)")
+    conn.commit()
+    migrations.migrate(conn)
+    
+    assert retention.incremental_vacuum(conn) is False
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+    
+    retention.rebuild_for_incremental_vacuum(conn)
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == retention.AUTO_VACUUM_INCREMENTAL
+    conn.close()
@@ -0,0 +1,28 @@
+"""Tests for timer_cache.py's write-through timer state cache"""
+import pytest
+
+import timer_cache
+from timer_state import RUNNING, PAUSED
+
+
+def test_writes_are_cached_and_a_failed_write_drops_the_entry(client, user):
+    user_id, timer_id = user
+    cache = timer_cache.get_cache()
+    if cache is None:
+        pytest.skip("the timer cache is turned off (DEEPFLOW_TIMER_CACHE=0)")
+    
+    version = client.post(f'/start_timer/{timer_id}', json={}).get_json()["version"]
+    
+    # Cached from the write itself, without a read
+    state = cache.get(user_id, timer_id)
+    assert (state.is_running, state.version) == (RUNNING, version)
+    
+    # A rejected write leaves the entry out, so the next read goes back to the database
+    assert client.post(f'/pause_timer/{timer_id}', json={"expected_version": version - 1}).status_code == 409
+    assert cache.get(user_id, timer_id) is None
+    assert client.get(f'/get_timer_state/{timer_id}').get_json()["timer"]["version"] == version
+    assert cache.get(user_id, timer_id).version == version
+    
+    client.post(f'/pause_timer/{timer_id}', json={"expected_version": version})
+    state = cache.get(user_id, timer_id)
+    assert (state.is_running, state.version) == (PAUSED, version + 1)
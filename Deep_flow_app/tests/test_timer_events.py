@@ -0,0 +1,22 @@
+"""Tests for fanning timer events out to a user's open streams"""
+from timer_events import TimerEventBroker, format_event
+
+
+def test_events_reach_every_stream_of_the_user_until_it_closes():
+    broker = TimerEventBroker()
+    first, second, someone_else = broker.subscribe(1), broker.subscribe(1), broker.subscribe(2)
+    stream = broker.stream(first, snapshot=[])
+    assert next(stream) == format_event("snapshot", {"timers": []})
+    
+    broker.publish(1, "started", {"id": 7})
+    
+    assert next(stream) == format_event("started", {"id": 7})
+    assert second.events.get_nowait() == ("started", {"id": 7})
+    assert someone_else.events.empty()
+    
+    # Closing the stream (the client went away) unsubscribes it
+    stream.close()
+    broker.publish(1, "stopped", {"id": 7})
+    
+    assert first.events.empty()
+    assert second.events.get_nowait() == ("stopped", {"id": 7})
@@ -0,0 +1,42 @@
+"""Tests for timer_expiry.py's heap of running timers' deadlines"""
+import queue
+
+from repositories import Timer
+from timer_expiry import TimerExpiryScheduler
+from timer_state import RUNNING, PAUSED
+from timeutils import now_ms
+
+
+class RecordingScheduler(TimerExpiryScheduler):
+    """Hands due timers to a queue instead of stopping them in the database"""
+
+    def __init__(self):
+        super().__init__(app=None, repos=None)
+        self.expired = queue.Queue()
+
+    def expire(self, deadline, timer_id, user_id):
+        self.expired.put((timer_id, deadline))
+
+
+def running(timer_id, due_in_ms):
+    """A timer of user 1 with 60 seconds on the clock that runs out due_in_ms from now"""
+    return Timer(timer_id, 1, "Focus", 60, now_ms() + due_in_ms - 60_000, None, None, RUNNING, 0, 0, 1)
+
+
+def test_timers_expire_in_deadline_order_unless_paused_first():
+    scheduler = RecordingScheduler()
+    scheduler.start()
+    try:
+        later, paused, sooner = running(1, 150), running(2, 50), running(3, 100)
+        for timer in (later, paused, sooner):
+            scheduler.track(timer)
+        scheduler.track(paused._replace(is_running=PAUSED))
+        assert scheduler.pending() == 2
+        
+        fired = [scheduler.expired.get(timeout=2) for _ in range(2)]
+        
+        assert [timer_id for timer_id, _ in fired] == [3, 1]
+        assert all(deadline <= now_ms() for _, deadline in fired)
+        assert scheduler.expired.empty() and scheduler.pending() == 0
+    finally:
+        scheduler.stop()
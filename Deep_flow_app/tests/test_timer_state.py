@@ -0,0 +1,135 @@
+"""Tests for the timer state machine, versions and idempotent timer commands"""
+import sqlite3
+
+import pytest
+
+import migrations
+from timer_state import (RUNNING, PAUSED, STOPPED, IllegalTransition, VersionConflict, IdempotencyKeyReused,
+                         TimerStateMachine)
+
+T0 = 1_700_000_000_000
+ELAPSED, IS_RUNNING, VERSION = 8, 7, 10  # Positions in TIMER_COLUMNS
+
+
+@pytest.fixture
+def conn(tmp_path):
+    db_path = str(tmp_path / "Deepflow.db")
+    migrations.migrate_database(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO users (id, username, password) VALUES (1, 'a', 'x'), (2, 'b', 'x')")
+    conn.execute("INSERT INTO timers (id, user_id, name, duration) VALUES (1, 1, 'Focus', 60)")
+    yield conn
+    conn.close()
+
+
+machine = TimerStateMachine()
+
+
+def test_start_pause_resume_stop_banks_elapsed_time(conn):
+    machine.apply(conn, 1, 1, "start", T0)
+    paused = machine.apply(conn, 1, 1, "pause", T0 + 10_000)
+    machine.apply(conn, 1, 1, "resume", T0 + 20_000)
+    stopped = machine.apply(conn, 1, 1, "stop", T0 + 25_000)
+    
+    assert (paused[IS_RUNNING], paused[ELAPSED]) == (PAUSED, 10_000)
+    assert (stopped[IS_RUNNING], stopped[ELAPSED]) == (STOPPED, 15_000)
+    assert stopped[VERSION] == 4
+
+
+def test_stop_records_the_run(conn):
+    machine.apply(conn, 1, 1, "start", T0)
+    machine.apply(conn, 1, 1, "pause", T0 + 1_000)
+    machine.apply(conn, 1, 1, "stop", T0 + 5_000)
+    
+    assert conn.execute("SELECT started_at, ended_at, focused_ms, pause_count FROM timer_sessions").fetchall() == \
+        [(T0, T0 + 5_000, 1_000, 1)]
+
+
+@pytest.mark.parametrize("action", ["pause", "resume", "stop", "expire"])
+def test_illegal_moves_from_stopped_are_refused_without_changes(conn, action):
+    with pytest.raises(IllegalTransition) as refused:
+        machine.apply(conn, 1, 1, action, T0)
+    
+    assert refused.value.state == STOPPED
+    assert conn.execute("SELECT is_running, version FROM timers WHERE id = 1").fetchone() == (STOPPED, 0)
+
+
+def test_someone_elses_timer_is_not_found(conn):
+    assert machine.apply(conn, 2, 1, "start", T0) is None
+
+
+def test_expire_applies_only_once_the_duration_is_reached(conn):
+    machine.apply(conn, 1, 1, "start", T0)
+    
+    with pytest.raises(IllegalTransition):
+        machine.apply(conn, 1, 1, "expire", T0 + 59_999)
+    expired = machine.apply(conn, 1, 1, "expire", T0 + 60_000)
+    
+    assert expired[IS_RUNNING] == STOPPED
+
+
+def test_timer_from_an_earlier_session_counts_as_stopped(conn):
+    machine.apply(conn, 1, 1, "start", T0, epoch=1)
+    
+    with pytest.raises(IllegalTransition):
+        machine.apply(conn, 1, 1, "pause", T0 + 1_000, epoch=2)
+    restarted = machine.apply(conn, 1, 1, "start", T0 + 2_000, epoch=2)
+    
+    assert restarted[IS_RUNNING] == RUNNING
+
+
+def test_expected_version_mismatch_is_a_conflict(conn):
+    machine.apply(conn, 1, 1, "start", T0)
+    
+    with pytest.raises(VersionConflict) as conflict:
+        machine.apply(conn, 1, 1, "pause", T0 + 1_000, expected_version=0)
+    paused = machine.apply(conn, 1, 1, "pause", T0 + 1_000, expected_version=1)
+    
+    assert (conflict.value.expected, conflict.value.actual) == (0, 1)
+    assert paused[VERSION] == 2
+
+
+def test_repeated_idempotency_key_replays_without_applying(conn):
+    first, replayed = machine.command(conn, 1, 1, "start", T0, key="k1")
+    again, replayed_again = machine.command(conn, 1, 1, "start", T0 + 5_000, key="k1")
+    
+    assert (replayed, replayed_again) == (False, True)
+    assert list(again) == list(first)
+    assert conn.execute("SELECT version FROM timers WHERE id = 1").fetchone() == (1,)
+
+
+def test_idempotency_key_reused_for_another_action_is_refused(conn):
+    machine.command(conn, 1, 1, "start", T0, key="k1")
+    
+    with pytest.raises(IdempotencyKeyReused):
+        machine.command(conn, 1, 1, "pause", T0 + 1_000, key="k1")
+
+
+def test_route_answers_409_on_a_stale_expected_version(client, user):
+    _, timer_id = user
+    version = client.post(f'/start_timer/{timer_id}', json={}).get_json()["version"]
+    
+    stale = client.post(f'/pause_timer/{timer_id}', json={"expected_version": version - 1})
+    current = client.post(f'/pause_timer/{timer_id}', json={"expected_version": version})
+    
+    assert stale.status_code == 409
+    assert current.status_code == 200 and current.get_json()["version"] == version + 1
+
+
+def test_route_replays_a_retried_command(client, user):
+    _, timer_id = user
+    headers = {"Idempotency-Key": "retry-1"}
+    
+    first = client.post(f'/start_timer/{timer_id}', json={}, headers=headers).get_json()
+    retry = client.post(f'/start_timer/{timer_id}', json={}, headers=headers)
+    reused = client.post(f'/stop_timer/{timer_id}', json={}, headers=headers)
+    
+    assert retry.status_code == 200
+    assert retry.get_json()["replayed"] is True and retry.get_json()["version"] == first["version"]
+    assert reused.status_code == 422
+
+
+def test_route_answers_409_on_an_illegal_move(client, user):
+    _, timer_id = user
+    
+    assert client.post(f'/pause_timer/{timer_id}', json={}).status_code == 409
@@ -0,0 +1,45 @@
+"""Tests for formatting whole columns of epoch milliseconds in a user's timezone"""
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from timeutils import format_ms, format_ms_column, to_epoch_ms
+
+SYDNEY = ZoneInfo('Australia/Sydney')
+LOS_ANGELES = ZoneInfo('America/Los_Angeles')
+HOUR_MS = 60 * 60 * 1000
+
+# UTC instants clocks change at in 2025
+TRANSITIONS = [
+    ("Sydney, clocks forward", SYDNEY, datetime(2025, 10, 4, 16, 0, tzinfo=timezone.utc)),
+    ("Sydney, clocks back", SYDNEY, datetime(2025, 4, 5, 16, 0, tzinfo=timezone.utc)),
+    ("Los Angeles, clocks forward", LOS_ANGELES, datetime(2025, 3, 9, 10, 0, tzinfo=timezone.utc)),
+    ("Los Angeles, clocks back", LOS_ANGELES, datetime(2025, 11, 2, 9, 0, tzinfo=timezone.utc)),
+]
+
+
+@pytest.mark.parametrize("tz, change", [(tz, change) for _, tz, change in TRANSITIONS],
+                         ids=[description for description, _, _ in TRANSITIONS])
+def test_column_matches_format_ms_across_a_dst_change(tz, change):
+    instant = to_epoch_ms(change)
+    # Every 7 minutes 13 seconds for a day either side, plus the milliseconds around the change
+    values = list(range(instant - 24 * HOUR_MS, instant + 24 * HOUR_MS, 433007))
+    values += [instant - 1, instant, instant + 1, instant + 999]
+    
+    assert format_ms_column(values, tz) == [format_ms(value, tz) for value in values]
+
+
+def test_column_repeats_the_hour_clocks_go_back_over():
+    # 2:30 happens twice in Sydney on 6 April 2025, first at UTC+11 and then at UTC+10
+    first = to_epoch_ms(datetime(2025, 4, 5, 15, 30, tzinfo=timezone.utc))
+    
+    assert format_ms_column([first, first + HOUR_MS], SYDNEY) == ['2025-04-06 02:30:00'] * 2
+
+
+def test_column_in_any_order_and_fixed_offsets():
+    values = [1735689600000 + offset for offset in (5 * HOUR_MS, -HOUR_MS, 40 * 24 * HOUR_MS, 0)]
+    
+    for tz in (timezone.utc, timezone(timedelta(hours=5, minutes=30)), SYDNEY):
+        assert format_ms_column(values, tz) == [format_ms(value, tz) for value in values]
+    assert format_ms_column([], SYDNEY) == []
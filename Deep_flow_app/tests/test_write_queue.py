@@ -0,0 +1,141 @@
+"""Tests for write_queue.py's single writer: batching, per-job rollback and draining on stop"""
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import database
+from write_queue import WriteQueue
+
+
+@pytest.fixture
+def pool(tmp_path):
+    # Foreign keys on, so that a dangling parent id fails the COMMIT of a deferred key
+    pool = database.ConnectionPool(str(tmp_path / "Deepflow.db"),
+                                   pragmas=database.CONNECTION_PRAGMAS + (("foreign_keys", "ON"),))
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE parents (id INTEGER PRIMARY KEY)")
+        conn.execute("""
+            CREATE TABLE notes (id INTEGER PRIMARY KEY, body TEXT NOT NULL,
+                                parent_id INTEGER REFERENCES parents (id) DEFERRABLE INITIALLY DEFERRED)
+        """)
+        conn.commit()
+    return pool
+
+
+@pytest.fixture
+def writer(pool):
+    writer = WriteQueue(pool)
+    writer.start()
+    yield writer
+    writer.stop()
+
+
+class HeldWriter:
+    """Keeps the writer busy on one job until released, so that the next jobs queue up behind it"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.gate = threading.Event()
+        self.submitters = ThreadPoolExecutor(max_workers=16)
+        started = threading.Event()
+    
+        def blocked(conn):
+            started.set()
+            self.gate.wait(5)
+    
+        self.held = self.submitters.submit(writer.submit, blocked)
+        started.wait(5)
+
+    def queue(self, *mutations):
+        """Submit mutations from other threads and wait until they are all queued"""
+        depth = self.writer.stats()["queue_depth"] + len(mutations)
+        futures = [self.submitters.submit(self.writer.submit, mutation) for mutation in mutations]
+        self.wait_for_depth(depth)
+        return futures
+
+    def wait_for_depth(self, depth):
+        deadline = time.monotonic() + 5
+        while self.writer.stats()["queue_depth"] < depth:
+            assert time.monotonic() < deadline, "jobs never queued"
+            time.sleep(0.001)
+
+    def release(self):
+        self.gate.set()
+        self.held.result(5)
+
+
+@pytest.fixture
+def held(writer):
+    held = HeldWriter(writer)
+    yield held
+    held.gate.set()
+    held.submitters.shutdown()
+
+
+def note(body, parent_id=None):
+    def mutation(conn):
+        return conn.execute("INSERT INTO notes (body, parent_id) VALUES (?, ?)", (body, parent_id)).lastrowid
+    return mutation
+
+
+def failing(conn):
+    conn.execute("INSERT INTO notes (body) VALUES ('half done')")
+    raise ValueError("job failed")
+
+
+def bodies(pool):
+    with pool.connection() as conn:
+        return sorted(row[0] for row in conn.execute("SELECT body FROM notes"))
+
+
+def test_jobs_that_queue_up_are_committed_as_one_batch(pool, writer, held):
+    futures = held.queue(*(note(f"note {n}") for n in range(10)))
+    held.release()
+    
+    assert len({future.result(5) for future in futures}) == 10
+    stats = writer.stats()
+    assert stats["batches"] == 2  # The held job, then everything queued behind it
+    assert stats["max_batch_size"] == 10
+    assert bodies(pool) == sorted(f"note {n}" for n in range(10))
+
+
+def test_a_failed_job_is_rolled_back_and_the_rest_of_its_batch_commits(pool, writer, held):
+    futures = held.queue(note("before"), failing, note("after"))
+    held.release()
+    
+    assert futures[0].result(5) and futures[2].result(5)
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    assert writer.stats()["failed_jobs"] == 1
+    assert bodies(pool) == ["after", "before"]
+
+
+def test_a_failed_commit_fails_the_whole_batch(pool, writer, held):
+    # The dangling parent is only caught at COMMIT, after every job in the batch has run
+    futures = held.queue(note("fine"), note("orphan", parent_id=42))
+    held.release()
+    
+    for future in futures:
+        with pytest.raises(sqlite3.IntegrityError):
+            future.result(5)
+    assert writer.stats()["failed_jobs"] == 2
+    assert bodies(pool) == []
+    # The writer carries on with the next batch
+    assert writer.submit(note("next batch"))
+    assert bodies(pool) == ["next batch"]
+
+
+def test_stop_drains_queued_writes_first(pool, writer, held):
+    futures = held.queue(*(note(f"note {n}") for n in range(5)))
+    stopping = threading.Thread(target=writer.stop)
+    stopping.start()
+    held.wait_for_depth(6)  # The stop sentinel, behind the five writes
+    held.release()
+    stopping.join(5)
+    
+    assert not stopping.is_alive()
+    assert all(future.result(5) for future in futures)
+    assert bodies(pool) == sorted(f"note {n}" for n in range(5))
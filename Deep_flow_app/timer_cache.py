@@ -0,0 +1,260 @@
+"""
+Write-through cache of timer state for DeepFlow.
+
+timer-countdown.js and timer-toggle.js call /get_timer_state for every timer on
+every dashboard load and after every timer action. This cache keeps what that
+endpoint needs per timer (name, duration, banked elapsed time, running flag and
+start instant) in a small slotted object, so the remaining time is plain
+arithmetic on the cached integers and SQLite is not touched.
+
+Every timer write goes through CachedTimerRepository, which stores the row the
+write returned once it has committed (or drops the entry when it cannot know
+the new state). Timers that are not cached yet are loaded on first read.
+
+The users' session epochs, which every timer read is checked against, are
+kept here too, so serving a timer's state needs no query at all.
+
+The cache lives in this process. The app runs as a single process; set
+DEEPFLOW_TIMER_CACHE=0 when several processes write to the same database.
+"""
+import os
+import threading
+import logging
+
+from repositories import TimerRepository, CHECKIN_TIMER_ACTIONS
+from timer_state import stale
+
+logger = logging.getLogger(__name__)
+
+LOCK_STRIPES = 64
+
+
+class TimerState:
+    """The cached state of one timer"""
+
+    __slots__ = ("id", "user_id", "name", "duration", "elapsed_time", "is_running", "start_time", "epoch",
+                 "version")
+
+    def __init__(self, timer):
+        self.id = timer.id
+        self.user_id = timer.user_id
+        self.name = timer.name
+        self.duration = timer.duration
+        self.elapsed_time = timer.elapsed_time
+        self.is_running = timer.is_running
+        self.start_time = timer.start_time
+        self.epoch = timer.epoch
+        self.version = timer.version
+
+
+class TimerStateCache:
+    """timer id -> TimerState, safe to share between request threads"""
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+        # Writes to the same timer are serialised so their results are cached in commit order
+        self._stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def get(self, user_id, timer_id):
+        """The cached state of the user's timer, or None if it isn't cached"""
+        state = self._states.get(timer_id)
+        if state is None or state.user_id != user_id:
+            return None
+        return state
+
+    def put(self, timer):
+        """Cache a timer row (a repositories.Timer)"""
+        with self._lock:
+            self._states[timer.id] = TimerState(timer)
+
+    def discard(self, timer_id):
+        with self._lock:
+            self._states.pop(timer_id, None)
+
+    def discard_user(self, user_id):
+        with self._lock:
+            for timer_id in [t for t, state in self._states.items() if state.user_id == user_id]:
+                del self._states[timer_id]
+
+    def writing(self, timer_id):
+        """Lock to hold while writing a timer and caching the result"""
+        if not isinstance(timer_id, int):
+            raise TypeError(f"Timer ids are ints, got {timer_id!r}")
+        return self._stripes[timer_id % LOCK_STRIPES]
+
+    def __len__(self):
+        return len(self._states)
+
+
+class CachedTimerRepository(TimerRepository):
+    """Wraps another TimerRepository and keeps the cache in step with its writes"""
+
+    def __init__(self, inner, cache):
+        self.inner = inner
+        self.cache = cache
+
+    def state(self, user_id, timer_id, epoch=None):
+        state = self.cache.get(user_id, timer_id)
+        if state is not None and not stale(state, epoch):
+            return state
+        # Load under the write lock so a write committing meanwhile can't be overwritten by this older row.
+        # A timer from an earlier session comes back (and is cached) stopped.
+        with self.cache.writing(timer_id):
+            timer = self.inner.get(user_id, timer_id, epoch)
+            if timer is not None:
+                self.cache.put(timer)
+            return timer
+
+    def list_for_user(self, user_id, epoch=None):
+        return self.inner.list_for_user(user_id, epoch)
+
+    def get(self, user_id, timer_id, epoch=None):
+        return self.inner.get(user_id, timer_id, epoch)
+
+    def create(self, user_id, name, duration_seconds):
+        return self.inner.create(user_id, name, duration_seconds)
+
+    def delete(self, user_id, timer_id):
+        with self.cache.writing(timer_id):
+            try:
+                self.inner.delete(user_id, timer_id)
+            finally:
+                self.cache.discard(timer_id)
+
+    def transition(self, user_id, timer_id, action, now=None, epoch=None):
+        with self.cache.writing(timer_id):
+            try:
+                timer = self.inner.transition(user_id, timer_id, action, now, epoch)
+            except Exception:
+                # Rejected or failed; the cached state may be what misled the caller
+                self.cache.discard(timer_id)
+                raise
+            if timer is not None:
+                self.cache.put(timer)
+            return timer
+
+    def command(self, user_id, timer_id, action, epoch=None, expected_version=None, idempotency_key=None):
+        with self.cache.writing(timer_id):
+            try:
+                result = self.inner.command(user_id, timer_id, action, epoch, expected_version, idempotency_key)
+            except Exception:
+                self.cache.discard(timer_id)
+                raise
+            # A replay carries the timer as it was back then; leave the cache alone
+            if result is not None and not result.replayed:
+                self.cache.put(result.timer)
+            return result
+
+    def list_running(self):
+        return self.inner.list_running()
+
+    def count_all(self):
+        return self.inner.count_all()
+
+    def export(self, user_id):
+        return self.inner.export(user_id)
+
+    def focus_totals(self, user_id, periods, end_ms):
+        return self.inner.focus_totals(user_id, periods, end_ms)
+
+    def export_sessions(self, user_id):
+        return self.inner.export_sessions(user_id)
+
+    def delete_for_user(self, user_id):
+        try:
+            self.inner.delete_for_user(user_id)
+        finally:
+            self.cache.discard_user(user_id)
+
+
+class CachedEnergyRepository:
+    """
+    Passes everything through to another EnergyRepository, caching the timer
+    'start' and 'end' check-ins start and stop
+    """
+
+    def __init__(self, inner, cache):
+        self.inner = inner
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def record_checkin(self, user_id, timer_id, stage, energy_level, epoch=None):
+        if stage not in CHECKIN_TIMER_ACTIONS:
+            return self.inner.record_checkin(user_id, timer_id, stage, energy_level, epoch)
+        with self.cache.writing(timer_id):
+            try:
+                logged = self.inner.record_checkin(user_id, timer_id, stage, energy_level, epoch)
+            except Exception:
+                self.cache.discard(timer_id)
+                raise
+            if logged.timer is not None:
+                self.cache.put(logged.timer)
+            return logged
+
+
+class CachedUserRepository:
+    """
+    Passes everything through to another UserRepository, remembering each
+    user's session epoch once read or bumped
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+        self._epochs = {}  # user_id -> session epoch
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def session_epoch(self, user_id):
+        epoch = self._epochs.get(user_id)
+        if epoch is None:
+            epoch = self.inner.session_epoch(user_id)
+            with self._lock:
+                # A login committing meanwhile has already stored a newer one
+                epoch = max(epoch, self._epochs.get(user_id, epoch))
+                self._epochs[user_id] = epoch
+        return epoch
+
+    def start_session(self, user_id):
+        epoch = self.inner.start_session(user_id)
+        with self._lock:
+            self._epochs[user_id] = max(epoch, self._epochs.get(user_id, epoch))
+        return epoch
+
+    def delete(self, user_id):
+        try:
+            self.inner.delete(user_id)
+        finally:
+            with self._lock:
+                self._epochs.pop(user_id, None)
+
+
+_cache = None
+
+
+def init_app(app, repos, enabled=None):
+    """
+    Put the timer cache in front of repos.timers (and repos.energy and repos.users) unless
+    DEEPFLOW_TIMER_CACHE=0 (or enabled=False)
+    """
+    global _cache
+    if enabled is None:
+        enabled = os.environ.get('DEEPFLOW_TIMER_CACHE', '1') == '1'
+    if not enabled:
+        return None
+    _cache = TimerStateCache()
+    repos.timers = CachedTimerRepository(repos.timers, _cache)
+    repos.energy = CachedEnergyRepository(repos.energy, _cache)
+    repos.users = CachedUserRepository(repos.users)
+    app.extensions['deepflow_timer_cache'] = _cache
+    logger.info("Timer state cache enabled")
+    return _cache
+
+
+def get_cache():
+    """Return the timer cache, or None if it is disabled"""
+    return _cache
@@ -0,0 +1,101 @@
+"""
+Live timer state for DeepFlow dashboards over Server-Sent Events.
+
+Each open dashboard holds one /timers/stream connection instead of polling
+/get_timer_state per timer. The stream starts with a 'snapshot' of all the
+user's timers and then carries one event per transition ('started', 'paused',
+'resumed', 'stopped'), published by the routes once the write has committed,
+and 'expired' when timer_expiry stops a running timer at its duration, so every
+open tab finishes at the same moment however much the browser throttles its
+intervals.
+
+Every event's data is the timer's state as /get_timer_state returns it. Events
+are delivered within this process only, like the timer cache.
+"""
+import json
+import queue
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_SECONDS = 15  # Comment line sent on idle streams so dead connections get noticed
+MAX_PENDING = 100  # Events queued for one stream before it is considered stuck
+
+
+def format_event(event, data):
+    """One SSE message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class Subscription:
+    """The pending events of one open stream"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.events = queue.Queue(maxsize=MAX_PENDING)
+
+
+class TimerEventBroker:
+    """Fans timer events out to every open stream of the same user"""
+
+    def __init__(self):
+        self._subscriptions = {}  # user_id -> set of Subscription
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_id, event, timer):
+        """Queue an event for every stream of the user; timer is the state payload"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.events.put_nowait((event, timer))
+            except queue.Full:
+                logger.warning("Dropping timer event for a stalled stream of user %s", user_id)
+
+    def stream(self, subscription, snapshot):
+        """
+        Generate the SSE body of one stream: the snapshot, then events as they
+        are published, with keepalives in between. Unsubscribes when the client
+        goes away.
+        """
+        try:
+            yield format_event("snapshot", {"timers": snapshot})
+
+            while True:
+                try:
+                    event, timer = subscription.events.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_event(event, timer)
+        finally:
+            self.unsubscribe(subscription)
+
+
+_broker = TimerEventBroker()
+
+
+def init_app(app):
+    """Expose the broker on the app"""
+    app.extensions['deepflow_timer_events'] = _broker
+    return _broker
+
+
+def get_broker():
+    """Return the process-wide timer event broker"""
+    return _broker
@@ -0,0 +1,150 @@
+"""
+Server-side expiry of DeepFlow timers.
+
+A running timer used to stop only when a browser called /stop_timer, so a
+timer whose tab was closed stayed running in the database forever. The
+scheduler keeps a min-heap of the instants running timers reach their
+duration and stops each one at that instant with the state machine's 'expire'
+action, which banks exactly the timer's duration and records the run in
+timer_sessions. Open dashboards get an 'expired' event.
+
+The heap is loaded from the database at start-up (timers that ran out while
+the app was down are expired straight away) and kept up to date by the routes
+through track() after every timer change. Timers left over from an earlier
+login session count as stopped and are not expired. Entries are never removed from the
+heap; a timer's current deadline is kept beside it and anything else popped
+off the heap is skipped. Timers are expired through the app's repositories,
+so the timer cache stays in step. Like the cache, the schedule lives in this
+process.
+"""
+import heapq
+import threading
+import logging
+
+import database
+from repositories import StorageError
+from timer_state import RUNNING, IllegalTransition
+from timeutils import now_ms, expires_at_ms
+
+logger = logging.getLogger(__name__)
+
+
+class TimerExpiryScheduler:
+    """Stops running timers when they reach their duration, on one background thread"""
+
+    def __init__(self, app, repos, on_expired=None):
+        self.app = app
+        self.repos = repos
+        self.on_expired = on_expired  # Called with each expired Timer once it has committed
+        self._heap = []  # (deadline ms, timer id, user id)
+        self._deadlines = {}  # timer id -> its current deadline
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+    def track(self, timer):
+        """Schedule a timer's expiry from its current state, or cancel it if it isn't running"""
+        with self._condition:
+            if timer.is_running != RUNNING or not timer.start_time:
+                self._deadlines.pop(timer.id, None)
+                return
+            deadline = expires_at_ms(timer.duration, timer.elapsed_time, timer.start_time)
+            if self._deadlines.get(timer.id) == deadline:
+                return
+            self._deadlines[timer.id] = deadline
+            heapq.heappush(self._heap, (deadline, timer.id, timer.user_id))
+            self._condition.notify()
+
+    def load(self):
+        """Schedule every timer that is running in the database"""
+        for timer in self.repos.timers.list_running():
+            self.track(timer)
+        logger.info("Scheduled expiry of %d running timers", len(self._deadlines))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="deepflow-timer-expiry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def pending(self):
+        """Number of timers waiting to expire"""
+        return len(self._deadlines)
+
+    def _next_due(self):
+        """Wait for the earliest deadline and pop it; None once stopping"""
+        with self._condition:
+            while not self._stopping:
+                # Drop entries whose timer was paused, stopped or rescheduled since
+                while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                wait = (self._heap[0][0] - now_ms()) / 1000
+                if wait <= 0:
+                    deadline, timer_id, user_id = heapq.heappop(self._heap)
+                    del self._deadlines[timer_id]
+                    return deadline, timer_id, user_id
+                self._condition.wait(wait)
+            return None
+
+    def _run(self):
+        while True:
+            due = self._next_due()
+            if due is None:
+                return
+            try:
+                self.expire(*due)
+            except Exception as e:
+                logger.error("Error expiring timer %s: %s", due[1], str(e))
+
+    def expire(self, deadline, timer_id, user_id):
+        """Stop one timer as of its deadline; returns the stopped Timer, or None if there was nothing to do"""
+        with database.user_context(self.app, user_id):
+            try:
+                epoch = self.repos.users.session_epoch(user_id)
+                timer = self.repos.timers.transition(user_id, timer_id, "expire", now=deadline, epoch=epoch)
+            except IllegalTransition as e:
+                # Paused, stopped or restarted since it was scheduled, or left over from an
+                # earlier session; follow its current state
+                logger.debug("Not expiring: %s", e)
+                timer = self.repos.timers.get(user_id, timer_id, epoch)
+                if timer is not None:
+                    self.track(timer)
+                return None
+            except StorageError as e:
+                logger.error("Database error expiring timer %s: %s", timer_id, str(e))
+                return None
+        if timer is None:
+            return None  # Deleted
+        logger.info("Timer %d of user %d reached its duration", timer_id, user_id)
+        if self.on_expired is not None:
+            self.on_expired(timer)
+        return timer
+
+
+_scheduler = None
+
+
+def init_app(app, repos, on_expired=None):
+    """Load the running timers and start the expiry thread"""
+    global _scheduler
+    _scheduler = TimerExpiryScheduler(app, repos, on_expired)
+    try:
+        _scheduler.load()
+    except StorageError as e:
+        logger.error("Error loading running timers: %s", str(e))
+    _scheduler.start()
+    app.extensions['deepflow_timer_expiry'] = _scheduler
+    return _scheduler
+
+
+def get_scheduler():
+    """Return the process-wide expiry scheduler"""
+    return _scheduler
@@ -0,0 +1,272 @@
+"""
+Timer state machine for DeepFlow.
+
+A timer is stopped (is_running = 0), running (1) or paused (2), and moves
+between those states only along
+
+    stopped -> running -> paused -> running -> stopped
+
+and a paused timer may also be stopped directly. 'expire' is the stop the
+expiry scheduler applies when a running timer reaches its duration; it is only
+legal while the timer is still running and has actually reached its
+duration, so a timer paused, stopped or restarted just before its deadline is
+left alone.
+
+start, pause, resume and stop are each a single conditional UPDATE ... RETURNING:
+the WHERE clause checks ownership and the current state, and the SET clause
+works out the banked elapsed time from the row's own values, so no SELECT is
+needed first. Only when the UPDATE matches nothing is the row looked at again,
+to tell a missing timer from an illegal move.
+
+Each login bumps the user's session epoch, and a start stamps the timer with
+the epoch it happened under. A timer still running or paused from an earlier
+session counts as stopped (as if it had been reset on login, with nothing
+banked) both when it is read (as_of_epoch()) and when an action is checked.
+Nothing is written until the timer is started again.
+
+Every stop (or expiry) also appends the finished run to timer_sessions, in the same
+transaction; run_started_at and pause_count on the timer row track the run
+until then.
+
+Every transition also bumps the timer's version. A client command (command())
+may name the version it expects, which the UPDATE checks along with the state,
+and may carry an idempotency key: its first result is stored in
+timer_commands in the same transaction, and a retry with the same key gets
+that result back without anything being applied again.
+"""
+import json
+
+STOPPED = 0
+RUNNING = 1
+PAUSED = 2
+
+STATE_NAMES = {STOPPED: "stopped", RUNNING: "running", PAUSED: "paused"}
+
+# action -> (states it may be applied in, state it leads to)
+TRANSITIONS = {
+    "start": ((STOPPED,), RUNNING),
+    "pause": ((RUNNING,), PAUSED),
+    "resume": ((PAUSED,), RUNNING),
+    "stop": ((RUNNING, PAUSED), STOPPED),
+    "expire": ((RUNNING,), STOPPED),
+}
+
+ACTIONS = tuple(TRANSITIONS)
+
+TIMER_COLUMNS = ("id, user_id, name, duration, start_time, end_time, paused_at, is_running, elapsed_time, epoch, "
+                 "version")
+
+IDEMPOTENCY_KEY_TTL_MS = 24 * 60 * 60 * 1000  # How long a command's result is kept for retries
+
+# Per-run bookkeeping returned after TIMER_COLUMNS, for the session history
+RUN_COLUMNS = "run_started_at, pause_count"
+
+# SET clause per action. SQLite evaluates every expression against the row as
+# it was before the UPDATE, so elapsed_time can bank the running session here.
+_SET_CLAUSES = {
+    "start": """
+        is_running = 1, start_time = :now,
+        end_time = NULL, paused_at = NULL, elapsed_time = 0,
+        run_started_at = :now, pause_count = 0, epoch = COALESCE(:epoch, epoch)
+    """,
+    "pause": """
+        is_running = 2, paused_at = :now, pause_count = pause_count + 1,
+        elapsed_time = CASE WHEN start_time THEN COALESCE(elapsed_time, 0) + :now - start_time
+                            ELSE elapsed_time END
+    """,
+    "resume": """
+        is_running = 1, start_time = :now, paused_at = NULL
+    """,
+    "stop": """
+        is_running = 0, end_time = :now, start_time = NULL, paused_at = NULL,
+        elapsed_time = COALESCE(elapsed_time, 0)
+                       + CASE WHEN is_running = 1 AND start_time THEN :now - start_time ELSE 0 END
+    """,
+}
+_SET_CLAUSES["expire"] = _SET_CLAUSES["stop"]
+
+# Conditions on top of the from-states
+_DUE = "start_time + duration * 1000 - COALESCE(elapsed_time, 0) <= :now"
+_WHERE_CLAUSES = {"expire": f"AND {_DUE}"}
+
+# is_running as of the session epoch :epoch (a NULL :epoch compares as current)
+_LIVE_STATE = "CASE WHEN epoch < :epoch THEN 0 ELSE is_running END"
+
+
+def stale(timer, epoch):
+    """Whether a timer is running or paused from before the user's current session epoch"""
+    return epoch is not None and timer.is_running != STOPPED and timer.epoch < epoch
+
+
+def as_of_epoch(timer, epoch):
+    """A Timer row as the user's current session sees it: stale timers are stopped and reset"""
+    if not stale(timer, epoch):
+        return timer
+    return timer._replace(is_running=STOPPED, start_time=None, end_time=None, paused_at=None)
+
+
+class IllegalTransition(ValueError):
+    """Raised when an action is not allowed from the timer's current state"""
+
+    def __init__(self, timer_id, action, state):
+        self.timer_id = timer_id
+        self.action = action
+        self.state = state
+        super().__init__(f"Cannot {action} timer {timer_id} while it is {STATE_NAMES.get(state, state)}")
+
+
+class VersionConflict(ValueError):
+    """Raised when a command expected a different version of the timer than the stored one"""
+
+    def __init__(self, timer_id, expected, actual):
+        self.timer_id = timer_id
+        self.expected = expected
+        self.actual = actual
+        super().__init__(f"Timer {timer_id} has changed (version {actual}, expected {expected})")
+
+
+class IdempotencyKeyReused(ValueError):
+    """Raised when an idempotency key comes back with a different timer or action"""
+
+    def __init__(self, key):
+        self.key = key
+        super().__init__(f"Idempotency key {key} was already used for a different timer command")
+
+
+class TimerStateMachine:
+    """Checks and applies timer transitions"""
+
+    def check(self, timer_id, action, state):
+        """Raise IllegalTransition unless `action` may be applied in `state`"""
+        if action not in TRANSITIONS:
+            raise ValueError(f"Unknown timer action: {action}")
+        if state not in TRANSITIONS[action][0]:
+            raise IllegalTransition(timer_id, action, state)
+
+    def check_version(self, timer_id, expected, actual):
+        """Raise VersionConflict unless the timer is at the expected version (None: any)"""
+        if expected is not None and expected != actual:
+            raise VersionConflict(timer_id, expected, actual)
+
+    def due(self, timer, now):
+        """Whether a running timer has reached its duration by `now` (the _DUE condition)"""
+        return timer.start_time + timer.duration * 1000 - (timer.elapsed_time or 0) <= now
+
+    def changes(self, timer, action, now):
+        """
+        Column values an action writes, given the timer's current row.
+
+        The in-memory equivalent of the SET clauses above, for storage that
+        is not SQLite. Call check() first.
+        """
+        if action == "start":
+            return {"is_running": RUNNING, "start_time": now, "end_time": None, "paused_at": None,
+                    "elapsed_time": 0}
+        if action == "pause":
+            if timer.start_time:
+                return {"is_running": PAUSED, "paused_at": now,
+                        "elapsed_time": (timer.elapsed_time or 0) + now - timer.start_time}
+            # No start time, so there is nothing to bank; just mark it paused
+            return {"is_running": PAUSED, "paused_at": now}
+        if action == "resume":
+            return {"is_running": RUNNING, "start_time": now, "paused_at": None}
+        if action in ("stop", "expire"):
+            # Running timers add the current session; paused ones keep the stored elapsed time
+            elapsed = timer.elapsed_time or 0
+            if timer.is_running == RUNNING and timer.start_time:
+                elapsed += now - timer.start_time
+            return {"is_running": STOPPED, "end_time": now, "start_time": None, "paused_at": None,
+                    "elapsed_time": elapsed}
+        raise ValueError(f"Unknown timer action: {action}")
+
+    def apply(self, conn, user_id, timer_id, action, now, epoch=None, expected_version=None):
+        """
+        Apply `action` to one of the user's timers on `conn` with one conditional UPDATE.
+
+        Returns the updated row as a tuple in TIMER_COLUMNS order, or None if
+        the timer does not exist or is not the user's. Raises IllegalTransition
+        if the timer is in a state the action cannot be applied in, judged as
+        of the user's session epoch (when given), and VersionConflict if it is
+        not at expected_version (when given). A stop or expiry also records
+        the run in timer_sessions.
+        """
+        if action not in TRANSITIONS:
+            raise ValueError(f"Unknown timer action: {action}")
+        from_states, to_state = TRANSITIONS[action]
+        states = ", ".join(str(state) for state in from_states)
+
+        row = conn.execute(f"""
+            UPDATE timers
+            SET {_SET_CLAUSES[action]}, version = version + 1
+            WHERE id = :timer_id AND user_id = :user_id AND {_LIVE_STATE} IN ({states})
+                  AND (:expected_version IS NULL OR version = :expected_version)
+                  {_WHERE_CLAUSES.get(action, "")}
+            RETURNING {TIMER_COLUMNS}, {RUN_COLUMNS}
+        """, {"now": now, "timer_id": timer_id, "user_id": user_id, "epoch": epoch,
+              "expected_version": expected_version}).fetchone()
+        if row is not None:
+            timer, (run_started_at, pause_count) = row[:-2], row[-2:]
+            # Timers started before runs were tracked have no start to record
+            if to_state == STOPPED and run_started_at is not None:
+                focused_ms = timer[8]  # elapsed_time, with the final stretch banked
+                self.record_session(conn, user_id, timer_id, run_started_at, now, focused_ms, pause_count)
+            return timer
+
+        # Nothing matched: the timer isn't there, has moved on, or the move isn't legal
+        current = conn.execute(f"""
+            SELECT {_LIVE_STATE}, version FROM timers WHERE id = :timer_id AND user_id = :user_id
+        """, {"timer_id": timer_id, "user_id": user_id, "epoch": epoch}).fetchone()
+        if current is None:
+            return None
+        self.check_version(timer_id, expected_version, current[1])
+        raise IllegalTransition(timer_id, action, current[0])
+
+    def command(self, conn, user_id, timer_id, action, now, epoch=None, expected_version=None, key=None):
+        """
+        apply() for a command from a client, which may carry an idempotency key.
+
+        Returns (row, replayed). A key seen before gets the row its first use
+        returned, with replayed True, and nothing is applied; otherwise the
+        action is applied and, with a key, its result stored. Raises
+        IdempotencyKeyReused if the key was used for another timer or action.
+        """
+        if key is not None:
+            row = self.replayed(conn, user_id, timer_id, action, key)
+            if row is not None:
+                return row, True
+        try:
+            row = self.apply(conn, user_id, timer_id, action, now, epoch, expected_version)
+        except (IllegalTransition, VersionConflict):
+            # A retry racing the first attempt is only refused once that has committed
+            if key is not None:
+                replay = self.replayed(conn, user_id, timer_id, action, key)
+                if replay is not None:
+                    return replay, True
+            raise
+        if row is not None and key is not None:
+            conn.execute("DELETE FROM timer_commands WHERE user_id = ? AND created_at < ?",
+                         (user_id, now - IDEMPOTENCY_KEY_TTL_MS))
+            conn.execute("""
+                INSERT OR IGNORE INTO timer_commands (user_id, idempotency_key, timer_id, action, result, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (user_id, key, timer_id, action, json.dumps(list(row)), now))
+        return row, False
+
+    def replayed(self, conn, user_id, timer_id, action, key):
+        """The stored result row of an earlier command with this key, or None"""
+        stored = conn.execute("""
+            SELECT timer_id, action, result FROM timer_commands
+            WHERE user_id = ? AND idempotency_key = ?
+        """, (user_id, key)).fetchone()
+        if stored is None:
+            return None
+        if (stored[0], stored[1]) != (timer_id, action):
+            raise IdempotencyKeyReused(key)
+        return tuple(json.loads(stored[2]))
+
+    def record_session(self, conn, user_id, timer_id, started_at, ended_at, focused_ms, pause_count):
+        """Append one finished run to timer_sessions"""
+        conn.execute("""
+            INSERT INTO timer_sessions (user_id, timer_id, started_at, ended_at, focused_ms, pause_count)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (user_id, timer_id, started_at, ended_at, focused_ms, pause_count))
@@ -0,0 +1,103 @@
+"""
+Integer timestamp helpers.
+
+Timer instants (start_time, paused_at, end_time) and energy log / insight
+timestamps are stored as UTC epoch milliseconds. All elapsed-time math is done
+on those integers; datetimes are only created when a value has to be shown to
+a user.
+"""
+import time
+from datetime import date, datetime, timedelta
+
+DISPLAY_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+MS_PER_DAY = 86_400_000
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# SQL expression for "now" in epoch milliseconds, usable in DEFAULT clauses
+SQL_NOW_MS = "(CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))"
+
+
+def now_ms():
+    """Current time as UTC epoch milliseconds"""
+    return time.time_ns() // 1_000_000
+
+
+def to_epoch_ms(dt):
+    """Convert a datetime to epoch milliseconds (naive datetimes are server local time)"""
+    return int(dt.timestamp() * 1000)
+
+
+def current_elapsed_ms(elapsed_time, start_time, is_running, now=None):
+    """
+    Total elapsed milliseconds for a timer row.
+
+    elapsed_time is what was banked before the last pause; while the timer is
+    running (is_running == 1) the time since start_time is added on top.
+    """
+    elapsed = elapsed_time or 0
+    if is_running == 1 and start_time:
+        elapsed += (now if now is not None else now_ms()) - start_time
+    return elapsed
+
+
+def remaining_ms(duration_seconds, elapsed):
+    """Milliseconds left on a timer of duration_seconds after elapsed milliseconds"""
+    return max(0, duration_seconds * 1000 - elapsed)
+
+
+def expires_at_ms(duration_seconds, elapsed_time, start_time):
+    """Epoch milliseconds at which a running timer reaches its duration"""
+    return start_time + duration_seconds * 1000 - (elapsed_time or 0)
+
+
+def format_ms(ms, tz):
+    """Format epoch milliseconds as 'YYYY-MM-DD HH:MM:SS' local time in tz (a tzinfo)"""
+    return datetime.fromtimestamp(ms / 1000, tz).strftime(DISPLAY_FORMAT)
+
+
+def local_periods(first, count, tz, step=timedelta(days=1)):
+    """
+    ([(label, start epoch ms)], end epoch ms) of `count` consecutive periods of
+    `step` (a whole number of days) starting on the date `first`, in tz.
+
+    Each period starts at local midnight, so a day a DST change falls on is 23
+    or 25 hours long; labels are the periods' first dates as 'YYYY-MM-DD'.
+    """
+    starts = [datetime.combine(first + step * i, datetime.min.time(), tz) for i in range(count + 1)]
+    return [(start.strftime('%Y-%m-%d'), to_epoch_ms(start)) for start in starts[:-1]], to_epoch_ms(starts[-1])
+
+
+def _offset_ms(ms, tz):
+    """tz's UTC offset at epoch-ms instant, in milliseconds"""
+    return int(datetime.fromtimestamp(ms / 1000, tz).utcoffset().total_seconds() * 1000)
+
+
+def format_ms_column(values, tz):
+    """
+    format_ms over a whole column of epoch milliseconds.
+
+    The UTC offset is looked up once per UTC day (per value only on days a
+    DST change falls on) and each local date is formatted once; the rest is
+    integer arithmetic, with no datetime per value.
+    """
+    day_offsets = {}  # UTC day number -> offset ms, or None if the offset changes that day
+    dates = {}  # local day number -> 'YYYY-MM-DD'
+    formatted = []
+    for ms in values:
+        utc_day = ms // MS_PER_DAY
+        if utc_day not in day_offsets:
+            first = _offset_ms(utc_day * MS_PER_DAY, tz)
+            last = _offset_ms((utc_day + 1) * MS_PER_DAY - 1, tz)
+            day_offsets[utc_day] = first if first == last else None
+        offset = day_offsets[utc_day]
+        if offset is None:
+            offset = _offset_ms(ms, tz)
+
+        local_day, ms_of_day = divmod(ms + offset, MS_PER_DAY)
+        day = dates.get(local_day)
+        if day is None:
+            day = dates[local_day] = date.fromordinal(_EPOCH_ORDINAL + local_day).isoformat()
+        seconds = ms_of_day // 1000
+        formatted.append(f"{day} {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}")
+    return formatted
@@ -0,0 +1,143 @@
+"""
+Users' timezones for DeepFlow.
+
+A user's timezone comes from the country and state/province they pick in
+settings. The table below maps each choice to an IANA zone, so local times
+follow daylight saving (Sydney is UTC+11 in January, not +10). It is compiled
+into tzinfo objects once at import; each entry also records the fixed offset
+the app used before zones, which stands in when the system has no timezone
+database.
+
+TimezoneService remembers each user's resolved zone until their location
+changes, so routes ask for it without touching the users table.
+"""
+import threading
+import logging
+from datetime import timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from repositories import StorageError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COUNTRY = 'AU'
+
+# country -> (default (zone, fixed offset hours), {state/province -> (zone, fixed offset hours)})
+LOCATION_ZONES = {
+    'US': (('Australia/Sydney', 10), {  # Default to AEST for Australia (changed from -5)
+        'CA': ('America/Los_Angeles', -8),  # Pacific
+        'NY': ('America/New_York', -5),     # Eastern
+        'TX': ('America/Chicago', -6),      # Central
+        'FL': ('America/New_York', -5),     # Eastern
+        'IL': ('America/Chicago', -6),      # Central
+        'WA': ('America/Los_Angeles', -8),  # Pacific
+        'CO': ('America/Denver', -7),       # Mountain
+        'AZ': ('America/Phoenix', -7),      # Mountain (no DST)
+        'HI': ('Pacific/Honolulu', -10),    # Hawaii
+        'AK': ('America/Anchorage', -9),    # Alaska
+    }),
+    'AU': (('Australia/Sydney', 10), {
+        'NSW': ('Australia/Sydney', 10),     # AEST/AEDT
+        'VIC': ('Australia/Melbourne', 10),  # AEST/AEDT
+        'QLD': ('Australia/Brisbane', 10),   # AEST (no DST)
+        'WA': ('Australia/Perth', 8),        # AWST
+        'SA': ('Australia/Adelaide', 9.5),   # ACST/ACDT
+        'TAS': ('Australia/Hobart', 10),     # AEST/AEDT
+        'NT': ('Australia/Darwin', 9.5),     # ACST (no DST)
+        'ACT': ('Australia/Sydney', 10),     # AEST/AEDT
+    }),
+    'CA': (('America/Toronto', -5), {
+        'ON': ('America/Toronto', -5),     # Eastern
+        'QC': ('America/Toronto', -5),     # Eastern
+        'BC': ('America/Vancouver', -8),   # Pacific
+        'AB': ('America/Edmonton', -7),    # Mountain
+        'SK': ('America/Regina', -6),      # Central (no DST)
+        'MB': ('America/Winnipeg', -6),    # Central
+        'NB': ('America/Moncton', -4),     # Atlantic
+        'NS': ('America/Halifax', -4),     # Atlantic
+        'PE': ('America/Halifax', -4),     # Atlantic
+        'NL': ('America/St_Johns', -3.5),  # Newfoundland
+    }),
+    'UK': (('Europe/London', 0), {}),
+    'DE': (('Europe/Berlin', 1), {}),
+    'FR': (('Europe/Paris', 1), {}),
+    'ES': (('Europe/Madrid', 1), {}),
+    'IT': (('Europe/Rome', 1), {}),
+    'JP': (('Asia/Tokyo', 9), {}),
+    'CN': (('Asia/Shanghai', 8), {}),
+    'IN': (('Asia/Kolkata', 5.5), {}),
+    'BR': (('America/Sao_Paulo', -3), {
+        'SP': ('America/Sao_Paulo', -3),   # BRT
+        'RJ': ('America/Sao_Paulo', -3),   # BRT
+        'AC': ('America/Rio_Branco', -5),  # ACT
+        'AM': ('America/Manaus', -4),      # AMT
+    }),
+}
+
+
+def _compile(zone_name, offset_hours):
+    try:
+        return ZoneInfo(zone_name)
+    except ZoneInfoNotFoundError:
+        logger.warning("No timezone data for %s; using UTC%+g all year", zone_name, offset_hours)
+        return timezone(timedelta(hours=offset_hours))
+
+
+# country -> (default tzinfo, {state/province -> tzinfo}), built once
+_ZONES = {
+    country: (_compile(*default), {region: _compile(*zone) for region, zone in regions.items()})
+    for country, (default, regions) in LOCATION_ZONES.items()
+}
+
+DEFAULT_ZONE = _ZONES[DEFAULT_COUNTRY][0]
+
+
+def zone_for(country, state_province=None):
+    """The tzinfo for a country and optional state/province (unknown countries count as Australia)"""
+    default, regions = _ZONES.get(country, _ZONES[DEFAULT_COUNTRY])
+    return regions.get(state_province, default) if state_province else default
+
+
+class TimezoneService:
+    """user id -> tzinfo, resolved from the user's location once and kept until it changes"""
+
+    def __init__(self, users):
+        self.users = users  # A UserRepository
+        self._zones = {}
+        self._lock = threading.Lock()
+
+    def zone(self, user_id):
+        """The user's tzinfo"""
+        zone = self._zones.get(user_id)
+        if zone is not None:
+            return zone
+        try:
+            user = self.users.get(user_id)
+        except StorageError as e:
+            logger.error("Error getting user timezone: %s", str(e))
+            return DEFAULT_ZONE  # Not remembered, so the next call tries again
+        zone = zone_for(user.country, user.state_province) if user else DEFAULT_ZONE
+        with self._lock:
+            self._zones[user_id] = zone
+        return zone
+
+    def forget(self, user_id):
+        """Resolve the user's zone again on the next call, after their location changed"""
+        with self._lock:
+            self._zones.pop(user_id, None)
+
+
+_service = None
+
+
+def init_app(app, repos):
+    """Create the timezone service for the app's users"""
+    global _service
+    _service = TimezoneService(repos.users)
+    app.extensions['deepflow_timezones'] = _service
+    return _service
+
+
+def get_service():
+    """Return the process-wide timezone service"""
+    return _service
@@ -0,0 +1,249 @@
+"""
+Optional single-writer pipeline for DeepFlow database writes.
+
+When enabled, write-heavy routes hand their mutations to one dedicated writer
+thread instead of each fighting for SQLite's write lock. The writer drains the
+queue in small batches, runs every mutation in its own SAVEPOINT inside a single
+BEGIN IMMEDIATE transaction, commits once, and then wakes up the waiting
+requests with their results.
+
+With sharding enabled there is one writer per database file.
+
+Enable it by setting DEEPFLOW_WRITE_QUEUE=1. When it is disabled, run_write()
+runs the mutation in a BEGIN IMMEDIATE transaction of its own on the request's
+connection and commits it.
+"""
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from concurrent.futures import Future
+
+import database
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH = 32
+DEFAULT_MAX_WAIT = 0.002  # Seconds to wait for more work before committing a batch
+SUBMIT_TIMEOUT = 10  # Seconds a request will wait for its write to be committed
+
+_STOP = object()
+
+
+class WriteQueue:
+    """
+    A queue of database mutations applied by a single writer thread.
+
+    A mutation is a callable taking a sqlite3 connection and returning a result.
+    It must not commit or roll back itself; the writer does that for the batch.
+    """
+
+    def __init__(self, pool, max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._conn = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "batches": 0,
+            "jobs": 0,
+            "failed_jobs": 0,
+            "max_batch_size": 0,
+            "lock_wait_ms_total": 0.0,
+            "lock_wait_ms_max": 0.0,
+            "queue_wait_ms_max": 0.0,
+        }
+
+    def start(self):
+        """Start the writer thread"""
+        if self._thread is not None:
+            return
+        self._conn = self.pool.acquire()
+        self._conn.isolation_level = None  # The writer issues BEGIN/COMMIT itself
+        self._thread = threading.Thread(target=self._run, name="deepflow-writer", daemon=True)
+        self._thread.start()
+        logger.info("Write queue started (max_batch=%d)", self.max_batch)
+
+    def stop(self):
+        """Drain outstanding writes and stop the writer thread"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        self._conn.isolation_level = ""
+        self.pool.release(self._conn)
+        self._conn = None
+        logger.info("Write queue stopped")
+
+    def submit(self, mutation, timeout=SUBMIT_TIMEOUT):
+        """
+        Queue a mutation and block until its batch has been committed.
+
+        Returns the mutation's result, or re-raises the exception it raised.
+        """
+        future = Future()
+        self._queue.put((mutation, future, time.perf_counter()))
+        return future.result(timeout=timeout)
+
+    def stats(self):
+        """Return a snapshot of the queue's batch and lock-wait metrics"""
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot["queue_depth"] = self._queue.qsize()
+        snapshot["avg_batch_size"] = (
+            round(snapshot["jobs"] / snapshot["batches"], 2) if snapshot["batches"] else 0
+        )
+        return snapshot
+
+    def _next_batch(self):
+        """Block for one job, then gather whatever else arrives within max_wait"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch and batch[-1] is not _STOP:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stopping = batch[-1] is _STOP
+            jobs = [job for job in batch if job is not _STOP]
+            if jobs:
+                self._commit_batch(jobs)
+            if stopping:
+                return
+
+    def _commit_batch(self, jobs):
+        """Apply a batch of jobs in one transaction and resolve their futures"""
+        conn = self._conn
+        started = time.perf_counter()
+        queue_wait_ms = max((started - enqueued) * 1000 for _, _, enqueued in jobs)
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            logger.error("Writer could not acquire the write lock: %s", str(e))
+            for _, future, _ in jobs:
+                future.set_exception(e)
+            return
+        lock_wait_ms = (time.perf_counter() - started) * 1000
+
+        results = []
+        failed = 0
+        for mutation, future, _ in jobs:
+            conn.execute("SAVEPOINT job")
+            try:
+                result = mutation(conn)
+            except Exception as e:  # Any failure only undoes this job's work
+                conn.execute("ROLLBACK TO job")
+                conn.execute("RELEASE job")
+                results.append((future, None, e))
+                failed += 1
+            else:
+                conn.execute("RELEASE job")
+                results.append((future, result, None))
+
+        try:
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.error("Writer failed to commit batch of %d: %s", len(jobs), str(e))
+            conn.execute("ROLLBACK")
+            results = [(future, None, e) for future, _, _ in results]
+            failed = len(jobs)
+
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        with self._stats_lock:
+            stats = self._stats
+            stats["batches"] += 1
+            stats["jobs"] += len(jobs)
+            stats["failed_jobs"] += failed
+            stats["max_batch_size"] = max(stats["max_batch_size"], len(jobs))
+            stats["lock_wait_ms_total"] += lock_wait_ms
+            stats["lock_wait_ms_max"] = max(stats["lock_wait_ms_max"], lock_wait_ms)
+            stats["queue_wait_ms_max"] = max(stats["queue_wait_ms_max"], queue_wait_ms)
+        logger.debug("Committed write batch of %d (lock wait %.2f ms)", len(jobs), lock_wait_ms)
+
+
+_write_queues = {}  # pool -> WriteQueue
+
+
+def init_app(app, pools, enabled=None):
+    """
+    Start a write queue per database if DEEPFLOW_WRITE_QUEUE is set (or enabled=True).
+
+    pools is every writable pool (see database.get_pools()); with sharding each
+    shard gets its own writer so users on different shards commit in parallel.
+    """
+    if enabled is None:
+        enabled = os.environ.get('DEEPFLOW_WRITE_QUEUE', '0') == '1'
+    if not enabled:
+        return []
+    for pool in pools:
+        write_queue = WriteQueue(pool)
+        write_queue.start()
+        atexit.register(write_queue.stop)  # Flush queued writes on shutdown
+        _write_queues[pool] = write_queue
+    app.extensions['deepflow_write_queues'] = list(_write_queues.values())
+    return list(_write_queues.values())
+
+
+def get_write_queue(pool=None):
+    """
+    Return the running write queue for pool (default: the current request's database),
+    or None if writes go straight to the request connection
+    """
+    if not _write_queues:
+        return None
+    return _write_queues.get(pool if pool is not None else database.current_pool())
+
+
+def run_write(mutation):
+    """
+    Run mutation(conn) as a committed write and return its result.
+
+    With the write queue enabled the mutation is applied by the writer thread,
+    so it must not touch Flask's request or session objects. Without it, the
+    mutation runs on the request's connection and is committed (or rolled back
+    if it raises) straight away. Either way the whole mutation, its reads
+    included, is one BEGIN IMMEDIATE transaction, and it goes to the logged-in
+    user's database.
+    """
+    write_queue = get_write_queue()
+    if write_queue is not None:
+        return write_queue.submit(mutation)
+
+    conn = get_db()
+    # sqlite3's implicit BEGIN only comes before the first INSERT/UPDATE, which would leave
+    # a mutation's checks outside the transaction; take the write lock up front instead
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = mutation(conn)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.isolation_level = isolation_level